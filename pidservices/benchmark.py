@@ -0,0 +1,310 @@
+'''
+*"Without data, you're just another person with an opinion."* - **W. Edwards Deming**
+
+Module contains tools for benchmarking client throughput: a local
+stand-in Pid Manager server, and a function to time a batch of concurrent
+API calls.  Used by ``pidman benchmark`` to compare transports (see
+:mod:`pidservices.transports`)::
+
+    pidman benchmark --requests 2000 --workers 16 --compare requests --compare http2
+
+Without ``--pidman-url``, requests go to a :class:`StandInServer` on
+localhost, which answers every request after a fixed delay to simulate
+server processing time.  The stand-in server speaks HTTP/1.1 and, if
+`h2 <https://python-hyper.org/projects/h2/>`_ is installed (as it is with
+``httpx[http2]``), HTTP/2 over cleartext to clients that use it with
+prior knowledge; the ``http2`` transport then multiplexes its requests
+over a single connection, as it would with an ``https`` Pid Manager that
+supports HTTP/2.
+'''
+
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from pidservices.workers import WorkerPool
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # many benchmark clients connect at once
+    request_queue_size = 128
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    # keep connections open, as a real server would
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; don't wait to coalesce them
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        url = urlparse(self.path)
+        status, text = self.server.stand_in.respond(self.command, url.path,
+            dict((key, val[0]) for key, val in parse_qs(url.query).items()), body)
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+    def handle(self):
+        # HTTP/2 clients with prior knowledge start with the connection
+        # preface (PRI * HTTP/2.0) instead of an HTTP/1.1 request line
+        if self.server.stand_in.http2 and self.rfile.peek(3)[:3] == b'PRI':
+            _HTTP2Connection(self.server.stand_in, self.connection, self.rfile).serve()
+        else:
+            super(_StandInHandler, self).handle()
+
+    def log_message(self, format, *args):
+        # don't log every request to stderr
+        pass
+
+
+class _HTTP2Connection(object):
+    # serve one HTTP/2 connection; each request is answered in its own
+    # thread, so that concurrent requests on the connection are answered
+    # concurrently, as by a real HTTP/2 server
+
+    def __init__(self, stand_in, sock, rfile):
+        import h2.config
+        import h2.connection
+        import h2.events
+        import h2.exceptions
+        self.h2 = h2
+        self.stand_in = stand_in
+        self.sock = sock
+        self.rfile = rfile
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(
+            client_side=False, header_encoding='utf-8'))
+        # guards the connection state and socket writes; notified when
+        # the client opens flow control windows, or the connection closes
+        self.cond = threading.Condition()
+        self.closed = False
+        self.streams = {}
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def serve(self):
+        events = self.h2.events
+        with self.cond:
+            self.conn.initiate_connection()
+            self._flush()
+        try:
+            while True:
+                data = self.rfile.read1(65536)
+                if not data:
+                    break
+                with self.cond:
+                    try:
+                        received = self.conn.receive_data(data)
+                    except self.h2.exceptions.ProtocolError:
+                        # h2 closes the connection; send the client the reason
+                        self._flush()
+                        break
+                    for event in received:
+                        if isinstance(event, events.RequestReceived):
+                            self.streams[event.stream_id] = (dict(event.headers), [])
+                        elif isinstance(event, events.DataReceived):
+                            self.streams[event.stream_id][1].append(event.data)
+                            self.conn.acknowledge_received_data(event.flow_controlled_length,
+                                                                event.stream_id)
+                        elif isinstance(event, events.StreamEnded):
+                            headers, body = self.streams.pop(event.stream_id)
+                            thread = threading.Thread(target=self._respond,
+                                args=(event.stream_id, headers, b''.join(body)),
+                                name='pidservices-stand-in-h2')
+                            thread.daemon = True
+                            thread.start()
+                        elif isinstance(event, events.StreamReset):
+                            self.streams.pop(event.stream_id, None)
+                    self.cond.notify_all()
+                    self._flush()
+        finally:
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+
+    def _respond(self, stream_id, headers, body):
+        url = urlparse(headers[':path'])
+        status, text = self.stand_in.respond(headers[':method'], url.path,
+            dict((key, val[0]) for key, val in parse_qs(url.query).items()),
+            body.decode('utf-8'), protocol='HTTP/2')
+        data = text.encode('utf-8')
+        with self.cond:
+            try:
+                if self.closed:
+                    return
+                self.conn.send_headers(stream_id, [
+                    (':status', str(status)), ('content-type', 'application/json'),
+                    ('content-length', str(len(data)))])
+                # send as much as the client's flow control windows allow,
+                # and wait for them to be opened for the rest
+                while data:
+                    size = min(len(data), self.conn.local_flow_control_window(stream_id),
+                               self.conn.max_outbound_frame_size)
+                    if size > 0:
+                        self.conn.send_data(stream_id, data[:size])
+                        data = data[size:]
+                        continue
+                    self._flush()
+                    self.cond.wait()
+                    if self.closed:
+                        return
+                self.conn.end_stream(stream_id)
+                self._flush()
+            except (self.h2.exceptions.ProtocolError, OSError):
+                # the client reset the stream, or the connection was closed
+                pass
+
+
+class StandInServer(object):
+    '''A local HTTP server that answers Pid Manager API requests with
+    canned responses, for benchmarking the client without a real server.
+    Every ``GET`` of a pid returns a pid with one target; searches return
+    pages of such pids; anything else returns a 404.  Clients can connect
+    with HTTP/1.1 or, if h2 is installed, HTTP/2 with prior knowledge
+    (e.g. :class:`~pidservices.transports.HTTP2Transport` with
+    ``http1=False``).
+
+    Use as a context manager, or call :meth:`start` and :meth:`stop`::
+
+        with StandInServer(delay=0.005) as server:
+            client = PidmanRestClient(server.url)
+
+    :param delay: seconds to wait before answering each request
+    :param port: port to listen on; by default, any free port
+    :param total: number of pids reported by searches
+    :param http2: accept HTTP/2 connections; requires h2
+    '''
+
+    def __init__(self, delay=0, port=0, total=10000, http2=True):
+        self.delay = delay
+        self.total = total
+        self.requests = 0
+        #: number of requests answered, by protocol (``HTTP/1.1`` or ``HTTP/2``)
+        self.protocols = Counter()
+        if http2:
+            try:
+                import h2
+            except ImportError:
+                http2 = False
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', port), _StandInHandler)
+        self.httpd.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        'Base URL of the server.'
+        return 'http://127.0.0.1:%d/' % self.httpd.server_address[1]
+
+    def pid(self, type, noid):
+        return {
+            'pid': noid, 'name': 'pid %s' % noid, 'domain': 'Benchmark',
+            'targets': [{'qualifier': '', 'target_uri': 'http://example.com/%s' % noid,
+                         'active': True}],
+        }
+
+    def respond(self, method, path, params, body, protocol='HTTP/1.1'):
+        '''Generate the response for a request.
+
+        :returns: tuple of status code and response body
+        '''
+        with self._lock:
+            self.requests += 1
+            self.protocols[protocol] += 1
+        if self.delay:
+            time.sleep(self.delay)
+        parts = [part for part in path.split('/') if part]
+        if method == 'GET' and len(parts) == 2 and parts[0] in ('ark', 'purl'):
+            return 200, json.dumps(self.pid(parts[0], parts[1]))
+        if method == 'GET' and parts == ['pids']:
+            count = int(params.get('count') or 100)
+            page = int(params.get('page') or 1)
+            first = (page - 1) * count
+            results = [self.pid('ark', 'b%d' % i)
+                       for i in range(first, min(first + count, self.total))]
+            return 200, json.dumps({
+                'results': results, 'results_count': self.total, 'page': page,
+                'page_count': (self.total + count - 1) // count,
+            })
+        return 404, json.dumps({'error': 'not found'})
+
+    def start(self):
+        # check for shutdown often, so stopping the server is quick
+        self._thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,),
+                                        name='pidservices-stand-in')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+#: operations that can be benchmarked, as functions of a client and a
+#: request number
+OPERATIONS = {
+    'get': lambda client, i: client.get_ark('b%d' % i),
+    'search': lambda client, i: client.search_pids(page=i % 10 + 1, count=100),
+}
+
+
+class BenchmarkResult(namedtuple('BenchmarkResult', ['requests', 'errors', 'elapsed'])):
+    '''Result of a benchmark run: number of requests made, number of
+    errors, and total time in seconds.'''
+    __slots__ = ()
+
+    @property
+    def rate(self):
+        'Requests per second.'
+        return self.requests / self.elapsed if self.elapsed else 0
+
+
+def benchmark(client, operation='get', requests=1000, workers=8):
+    '''Time a batch of API calls made concurrently with a
+    :class:`~pidservices.workers.WorkerPool`.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param operation: name of the operation to run; see :data:`OPERATIONS`
+    :param requests: number of API calls to make
+    :param workers: number of concurrent API calls
+    :returns: :class:`BenchmarkResult`
+    '''
+    func = OPERATIONS[operation]
+
+    def call(i):
+        try:
+            func(client, i)
+        except Exception:
+            return False
+        return True
+
+    errors = 0
+    start = time.time()
+    with WorkerPool(workers) as pool:
+        for ok in pool.imap(call, range(requests), ordered=False):
+            if not ok:
+                errors += 1
+    return BenchmarkResult(requests, errors, time.time() - start)
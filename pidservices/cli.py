@@ -0,0 +1,982 @@
+'''
+*"The secret of getting ahead is getting started."* - **Mark Twain**
+
+Module contains the ``pidman`` command-line tool, which groups common
+operational tasks as subcommands::
+
+    pidman allocate -c pids.cfg -p= > my_pids.txt
+    pidman search --domain "Rushdie Collection" --type ark
+    pidman search --domain "Rushdie Collection" --subdomains --json
+    pidman export --domain "Rushdie Collection" -o rushdie.csv.gz -z gzip
+    pidman import -c pids.cfg -p= items.csv items-arks.csv
+    pidman rewrite-targets --domain "General purchased collections" \\
+        --find www.lexisnexis.com --replace congressional.proquest.com
+    pidman deactivate -c pids.cfg -p= withdrawn.txt
+    pidman verify my_pids.txt
+    pidman check-targets --domain "Rushdie Collection" --type ark
+    pidman diff https://pid.emory.edu/ https://testpid.library.emory.edu/ \\
+        --domain "Rushdie Collection"
+
+All subcommands share Pid Manager connection options, a config file (see
+``--generate-config``), a ``--workers`` option to control how many API
+requests are made concurrently, and periodic progress reports with a
+throughput summary when done (written to standard error).
+'''
+
+import argparse
+import configparser
+from getpass import getpass
+import itertools
+import json
+import os
+import sys
+import threading
+
+from pidservices.clients import PidmanRestClient, parse_ark
+from pidservices.domains import DomainNotFound
+from pidservices.export import export_pids, FORMATS, COMPRESSION
+from pidservices.progress import ProgressReporter
+from pidservices.scheduler import url_host
+from pidservices.workers import WorkerPool
+
+# NOTE: requests and the link checker are imported where they are used, so
+# that ``pidman --help`` and option errors don't pay for importing them
+
+# default number of concurrent API requests
+WORKERS = 4
+
+# available transports for API requests; see pidservices.transports
+TRANSPORTS = ['requests', 'http2']
+
+
+class PasswordAction(argparse.Action):
+    '''Use :meth:`getpass.getpass` to prompt for a password for a
+    command-line argument.'''
+    def __call__(self, parser, namespace, value, option_string=None):
+        # if a value was specified on the command-line, use that
+        if value:
+            setattr(namespace, self.dest, value)
+        # otherwise, use getpass to prompt for a password
+        else:
+            setattr(namespace, self.dest, getpass())
+
+
+def add_dry_run_argument(parser):
+    parser.add_argument('--dry-run', default=False, action='store_true', dest='dry_run',
+        help='Output the updates that would be made, without making them')
+
+
+def parse_pid(value):
+    '''Parse a pid as listed in an input file (e.g., the output of
+    ``pidman allocate``): a resolvable or short-form ARK (optionally
+    qualified), a PURL, or a bare noid.
+
+    :returns: tuple of noid and qualifier ('' for unqualified)
+    '''
+    value = value.strip()
+    ark = parse_ark(value)
+    if ark is not None:
+        return ark['noid'], ark['qualifier'] or ''
+    return value.rstrip('/').split('/')[-1], ''
+
+
+def read_pids(path):
+    'Read pids, one per line, from a file (or ``-`` for standard input).'
+    infile = sys.stdin if path == '-' else open(path)
+    try:
+        for line in infile:
+            if line.strip():
+                yield parse_pid(line)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+
+
+def suffixed_path(path, suffix=None):
+    '''File name with a suffix added before its extension(s), e.g.
+    ``trace.jsonl.gz`` with suffix ``old`` is ``trace.old.jsonl.gz``.'''
+    if not suffix:
+        return path
+    directory, filename = os.path.split(path)
+    name, dot, extension = filename.partition('.')
+    return os.path.join(directory, '%s.%s%s%s' % (name, suffix, dot, extension))
+
+
+class Command(object):
+    '''Base class for ``pidman`` subcommands.  Subclasses set
+    :attr:`name` and :attr:`help`, add their own options in
+    :meth:`add_arguments`, and implement :meth:`handle`.'''
+
+    name = None
+    help = None
+    #: subcommand requires a Pid Manager url
+    requires_url = True
+    #: subcommand requires Pid Manager credentials
+    requires_auth = False
+    #: subcommand supports search options (domain, type, etc)
+    search_options = False
+
+    # config file sections
+    pidman_cfg = 'Pid Manager'
+    pid_cfg = 'Pid Options'
+    perf_cfg = 'Performance'
+
+    #: options that can be loaded from and saved to a config file, as
+    #: tuples of config section, config option, argument name
+    config_options = [
+        (pidman_cfg, 'url', 'pidman_url'),
+        (pidman_cfg, 'username', 'pidman_user'),
+        # NOTE: password not included to avoid storing in plain text
+        (perf_cfg, 'workers', 'workers'),
+        (perf_cfg, 'transport', 'transport'),
+    ]
+
+    def __init__(self):
+        self.args = None
+        self.progress = None
+        self._transports = []
+        self.metrics = None
+        self.tracer = None
+
+    def add_common_arguments(self, parser):
+        parser.add_argument('--quiet', '-q', default=False, action='store_true',
+                            help='Quiet mode: no progress reports or summary')
+        # config file options
+        cfg_args = parser.add_argument_group('Config file options')
+        cfg_args.add_argument('--generate-config', '-g', default=False, dest='gen_config',
+            help='Create a sample config file at the specified location, including any options passed.')
+        cfg_args.add_argument('--config', '-c', help='Load the specified config file')
+
+        # pidman connection options
+        pidman_args = parser.add_argument_group('Pid manager connection options')
+        pidman_args.add_argument('--pidman-url', dest='pidman_url',
+                               help='URL for accessing Pid Manager, e.g. http://pid.emory.edu/')
+        if self.requires_auth:
+            pidman_args.add_argument('--pidman-user', dest='pidman_user', default=None,
+                                   help='PID Manager username')
+            pidman_args.add_argument('--pidman-password', '-p', dest='pidman_password',
+                                   metavar='PASSWORD', default=None, action=PasswordAction,
+                                   help='Password for the specified Pid Manager user (leave blank to be prompted)')
+
+        # performance options
+        perf_args = parser.add_argument_group('Performance options')
+        perf_args.add_argument('--workers', '-w', type=int, default=None, metavar='N',
+            help='Number of API requests to make concurrently (default: %d)' % WORKERS)
+        perf_args.add_argument('--progress-interval', type=float, default=10,
+            dest='progress_interval', metavar='SECONDS',
+            help='How often to report progress (default: %(default)s seconds)')
+        perf_args.add_argument('--progress-format', choices=['text', 'json'], default='text',
+            dest='progress_format',
+            help='Progress report format; json writes one JSON object per line, '
+                 'for monitoring tools (default: %(default)s)')
+        perf_args.add_argument('--transport', choices=TRANSPORTS, default=None,
+            help='HTTP library used for API requests; http2 multiplexes concurrent '
+                 'requests over one connection and requires httpx (default: requests)')
+        perf_args.add_argument('--metrics', metavar='FILE',
+            help='Append API request latency statistics to a file as JSON lines, '
+                 'at the progress interval and when finished')
+        perf_args.add_argument('--slow', type=float, default=None, metavar='SECONDS',
+            help='Log API requests that take longer than this')
+        perf_args.add_argument('--trace', metavar='FILE|URL',
+            help='Record tracing spans for API calls to a file as JSON lines, or send '
+                 'them to an OpenTelemetry collector URL (OTLP/HTTP JSON)')
+        perf_args.add_argument('--record', metavar='FILE',
+            help='Record API requests and responses to a file (gzipped if the name '
+                 'ends in .gz), for replaying with --replay')
+        perf_args.add_argument('--replay', metavar='FILE',
+            help='Answer API requests from a file recorded with --record instead '
+                 'of the Pid Manager, e.g. to measure client overhead')
+        perf_args.add_argument('--replay-latency', type=float, default=0,
+            dest='replay_latency', metavar='SECONDS',
+            help='Synthetic latency added to each replayed response (default: %(default)s)')
+
+        if self.search_options:
+            search_args = parser.add_argument_group('Search options')
+            search_args.add_argument('--domain', '-d', action='append',
+                help='Pids in the domain with this name; may be repeated to search '
+                     'several domains concurrently')
+            search_args.add_argument('--domain-uri', dest='domain_uri', action='append',
+                help='Pids in the domain with this URI; may be repeated')
+            search_args.add_argument('--subdomains', default=False, action='store_true',
+                help='Also search all subdomains of the domain(s)')
+            search_args.add_argument('--type', '-t', choices=['ark', 'purl'],
+                help='Type of pids')
+            search_args.add_argument('--target',
+                help='Pids with this exact target URI')
+            search_args.add_argument('--page-size', type=int, default=1000,
+                dest='page_size', metavar='N',
+                help='Number of pids to request per page (default: %(default)s)')
+            search_args.add_argument('--snapshot', default=False, action='store_true',
+                help='Check that every pid is found exactly once, even if pids change '
+                     'during the search; missed pids are searched for again')
+            search_args.add_argument('--page-latency', type=float, dest='page_latency',
+                metavar='SECONDS',
+                help='Adjust the page size as the search runs, starting from --page-size, '
+                     'to keep page requests near this many seconds; pages are then '
+                     'requested one at a time')
+
+    def add_arguments(self, parser):
+        '''Add subcommand-specific arguments to the parser.'''
+        pass
+
+    def add_host_arguments(self, parser):
+        '''Add options for subcommands that make requests to target hosts;
+        see :class:`~pidservices.scheduler.HostScheduler`.'''
+        host_args = parser.add_argument_group('Target host options')
+        host_args.add_argument('--timeout', type=float, default=10, metavar='SECONDS',
+            help='Timeout for each request (default: %(default)s seconds)')
+        host_args.add_argument('--per-host', type=int, default=2, dest='per_host',
+            metavar='N', help='Maximum concurrent requests to any one host (default: %(default)s)')
+        host_args.add_argument('--rate', type=float, default=None, metavar='N',
+            help='Maximum requests per second to any one host (default: no limit)')
+
+    def get_checker(self, pidclient):
+        from pidservices.linkcheck import TargetChecker
+        return TargetChecker(pidclient, self.args.type, workers=self.args.workers,
+            per_host=self.args.per_host, rate=self.args.rate, timeout=self.args.timeout)
+
+    def handle(self):
+        '''Run the subcommand, using options in :attr:`args`.  Return a
+        non-zero exit status on failure.'''
+        raise NotImplementedError
+
+    def run(self, args):
+        self.args = args
+        # if requested, load config file and set arguments
+        if self.args.config:
+            self.load_configfile()
+        # if requested, generate a config file with any options specified so far,
+        # and then quit
+        if self.args.gen_config:
+            self.generate_configfile()
+            return 0
+        if self.args.workers is None:
+            self.args.workers = WORKERS
+        else:
+            self.args.workers = int(self.args.workers)
+        # defaults applied after the config file, so that its values are used
+        if not self.args.transport:
+            self.args.transport = 'requests'
+        elif self.args.transport not in TRANSPORTS:
+            return self.error('transport "%s" is not a valid choice' % self.args.transport)
+
+        # check required connection parameters
+        if self.requires_url and not self.args.pidman_url:
+            return self.error('PID manager url is required')
+        if self.requires_auth and not all([self.args.pidman_user,
+                                           self.args.pidman_password]):
+            return self.error('PID manager credentials are required')
+
+        tracer = self.get_tracer()
+        try:
+            if tracer is None:
+                return self.handle() or 0
+            with tracer.span('pidman %s' % self.name):
+                return self.handle() or 0
+        except DomainNotFound as err:
+            # e.g., a misspelled --domain name
+            return self.error(err)
+        finally:
+            if tracer is not None:
+                tracer.close()
+            # close connections, and finish writing any recording
+            for transport in self._transports:
+                transport.close()
+            if self.metrics is not None:
+                self.metrics.stop()
+                if self.args.metrics:
+                    self.metrics.export(self.args.metrics)
+
+    def error(self, msg):
+        print('Error: %s' % msg, file=sys.stderr)
+        return 1
+
+    def get_transport(self, name=None, http1=True, suffix=None):
+        '''Create the transport for API requests selected with
+        ``--transport``, ``--record`` and ``--replay``; None for the
+        default requests session.  With ``http1=False``, the http2
+        transport uses HTTP/2 with prior knowledge.  For commands that
+        use more than one Pid Manager, a ``suffix`` (e.g. ``old``) is
+        added to the record or replay file name (``trace.old.jsonl.gz``),
+        so that each has its own file.'''
+        from pidservices import transports
+        if getattr(self.args, 'replay', None):
+            transport = transports.ReplayTransport(suffixed_path(self.args.replay, suffix),
+                                                   latency=self.args.replay_latency)
+        else:
+            name = name or getattr(self.args, 'transport', None) or 'requests'
+            transport = None
+            if name == 'http2':
+                transport = transports.HTTP2Transport(max_connections=self.args.workers,
+                                                      http1=http1)
+            if getattr(self.args, 'record', None):
+                transport = transports.RecordingTransport(
+                    suffixed_path(self.args.record, suffix), transport)
+        if transport is not None:
+            self._transports.append(transport)
+        return transport
+
+    def get_metrics(self):
+        '''Create the :class:`~pidservices.metrics.ClientMetrics` for
+        ``--metrics`` and ``--slow``, if either was specified, and start
+        exporting periodic snapshots; None otherwise.'''
+        if self.metrics is None and (self.args.metrics or self.args.slow is not None):
+            from pidservices.metrics import ClientMetrics
+            self.metrics = ClientMetrics(slow=self.args.slow)
+            if self.args.metrics:
+                self.metrics.start(self.args.metrics, self.args.progress_interval)
+        return self.metrics
+
+    def get_tracer(self):
+        '''Create the :class:`~pidservices.tracing.Tracer` for ``--trace``,
+        if specified; None otherwise.'''
+        if self.tracer is None and getattr(self.args, 'trace', None):
+            from pidservices import tracing
+            if self.args.trace.startswith(('http://', 'https://')):
+                exporter = tracing.OTLPExporter(self.args.trace)
+            else:
+                exporter = tracing.FileExporter(self.args.trace)
+            self.tracer = tracing.Tracer(exporter)
+        return self.tracer
+
+    def get_client(self, auth=None):
+        '''Create a client for the Pid Manager, with the transport,
+        metrics and tracer selected on the command line.
+
+        :param auth: use the Pid Manager credentials; defaults to
+            :attr:`requires_auth`
+        '''
+        if auth is None:
+            auth = self.requires_auth
+        if auth:
+            return PidmanRestClient(self.args.pidman_url, self.args.pidman_user,
+                                    self.args.pidman_password, transport=self.get_transport(),
+                                    metrics=self.get_metrics(), tracer=self.get_tracer())
+        return PidmanRestClient(self.args.pidman_url, transport=self.get_transport(),
+                                metrics=self.get_metrics(), tracer=self.get_tracer())
+
+    def search_opts(self):
+        '''Search parameters specified on the command line, for use with
+        :meth:`~pidservices.clients.PidmanRestClient.iter_search_pids`.'''
+        opts = {}
+        for opt in ['domain', 'domain_uri', 'type', 'target', 'subdomains', 'snapshot']:
+            value = getattr(self.args, opt, None)
+            if value:
+                # domain names are resolved and searched by URI by the
+                # client; several domains are searched concurrently
+                if isinstance(value, list) and len(value) == 1:
+                    value = value[0]
+                opts[opt] = value
+        if getattr(self.args, 'page_latency', None):
+            from pidservices.paging import PageSizeTuner
+            opts['adaptive'] = PageSizeTuner(self.args.page_latency,
+                                             initial=self.args.page_size)
+        return opts
+
+    def start_progress(self, total=None):
+        self.progress = ProgressReporter(self.name, total,
+            interval=None if self.args.quiet else self.args.progress_interval,
+            format=self.args.progress_format)
+        return self.progress
+
+    def finish_progress(self):
+        if self.progress is not None and not self.args.quiet:
+            self.progress.finish()
+
+    ## config file handling (generate config, load config)
+
+    def _config_options(self):
+        # only options this subcommand actually has
+        return [(section, option, dest) for section, option, dest in self.config_options
+                if hasattr(self.args, dest)]
+
+    def setup_configparser(self):
+        # define a config file parser
+        config = configparser.ConfigParser()
+        for section, option, dest in self._config_options():
+            if not config.has_section(section):
+                config.add_section(section)
+            value = getattr(self.args, dest)
+            config.set(section, option, str(value) if value else '')
+        return config
+
+    def generate_configfile(self):
+        config = self.setup_configparser()
+        with open(self.args.gen_config, 'w') as cfgfile:
+            config.write(cfgfile)
+        if not self.args.quiet:
+            print('Config file created at %s' % self.args.gen_config, file=sys.stderr)
+
+    def load_configfile(self):
+        cfg = configparser.ConfigParser()
+        with open(self.args.config) as cfgfile:
+            cfg.read_file(cfgfile)
+
+        # set args from config, making sure not to override any
+        # non-defaults specified on the command line
+        for section, option, dest in self._config_options():
+            if cfg.has_option(section, option) and not getattr(self.args, dest):
+                value = cfg.get(section, option)
+                if value:
+                    setattr(self.args, dest, value)
+
+
+class Allocate(Command):
+    '''Allocate a batch of pids with default values for use in an offline or
+    external system, with values to be updated later.'''
+    name = 'allocate'
+    help = 'allocate a batch of pids with default values'
+    requires_auth = True
+    config_options = Command.config_options + [
+        (Command.pid_cfg, 'max', 'max'),
+        (Command.pid_cfg, 'type', 'type'),
+        (Command.pid_cfg, 'name', 'name'),
+        (Command.pid_cfg, 'target', 'target_uri'),
+        (Command.pid_cfg, 'domain', 'domain'),
+        (Command.pid_cfg, 'pool', 'pool'),
+    ]
+
+    def add_arguments(self, parser):
+        # options for pids to be allocated
+        pid_args = parser.add_argument_group('Pid options')
+        pid_args.add_argument('--max', '-m', type=int, metavar='N',
+            help='Number of pids to allocate')
+        pid_args.add_argument('--type', '-t', choices=['ARK', 'PURL'],
+            help='Type of pids to create (ARK or PURL)')
+        pid_args.add_argument('--name', '-n',
+            help='Default name to use when generating pids')
+        pid_args.add_argument('--target', '-u', dest='target_uri',
+            help='Default target URI to use when generating pids; %s is replaced '
+                 'with the noid of each new pid' % PidmanRestClient.pid_token.replace('%', '%%'))
+        pid_args.add_argument('--domain', '-d',
+            help='Domain (URI or name) that generating pids should belong to')
+        # for now, does not support setting policy
+        parser.add_argument('--pool', metavar='FILE',
+            help='Add pids to a pid pool database (see pidservices.pool) instead of '
+                 'listing them')
+        parser.add_argument('--keep-going', default=False, action='store_true',
+            help='Keep creating pids after an error, instead of stopping at the '
+                 'first one')
+
+    def handle(self):
+        # - max required/integer
+        if not self.args.max:
+            return self.error('number of pids to allocate is required')
+        try:
+            pid_max = int(self.args.max)
+        except ValueError:
+            return self.error('number of pids to allocate must be an integer')
+        # - type required, valid choice (if set via config)
+        if not self.args.type or self.args.type not in ['ARK', 'PURL']:
+            return self.error('type "%s" is not a valid choice' % self.args.type)
+        # - domain required, should be a uri (and existing pid domain?)
+        if not self.args.domain:
+            return self.error('domain is required')
+
+        from requests.exceptions import RequestException
+        pidclient = self.get_client()
+        # check that domain is a valid pid man domain, by name or URI, with
+        # the client's cached list of domains
+        try:
+            domain = pidclient.domains.get(self.args.domain)
+        except DomainNotFound as err:
+            return self.error('domain should be a domain name or a URI on configured '
+                              'Pid Manager site (%s)' % err)
+        except RequestException:
+            if not self.args.domain.startswith(self.args.pidman_url):
+                return self.error('Error retrieving domain information; please check '
+                                  'configuration')
+            print('Error retrieving domain information; please check configuration',
+                  file=sys.stderr)
+        else:
+            self.args.domain = domain.uri
+            if not self.args.quiet:
+                print('Pids will be created in domain %s' % domain.name, file=sys.stderr)
+
+        pidpool = None
+        if self.args.pool:
+            from pidservices.pool import PidPool
+            pidpool = PidPool(self.args.pool)
+
+        # now actually generate and output the pids; unless --keep-going is
+        # set, the first error stops any more pids being started, but pids
+        # already being created are still output
+        failed = threading.Event()
+
+        def target_uris():
+            # a target uri including the pid token is expanded for each new pid
+            for target_uri in itertools.repeat(self.args.target_uri, pid_max):
+                if failed.is_set():
+                    return
+                yield target_uri
+
+        progress = self.start_progress(pid_max)
+        created = 0
+        for pid, err in pidclient.create_pids(self.args.type.lower(), self.args.domain,
+                target_uris(), workers=self.args.workers, progress=progress,
+                name=self.args.name):
+            if err is not None:
+                print('Error generating pid (%s)' % err, file=sys.stderr)
+                if not self.args.keep_going:
+                    failed.set()
+            if pid is not None:
+                created += 1
+                if pidpool is not None:
+                    pidpool.add([pid])
+                else:
+                    print(pid)
+        self.finish_progress()
+        if failed.is_set():
+            print('Stopped after an error; %d of %d pids created' %
+                  (created, pid_max), file=sys.stderr)
+        return 1 if progress.errors else 0
+
+
+class Search(Command):
+    '''Search for pids, outputting one noid per line or full pid
+    information as JSON lines.'''
+    name = 'search'
+    help = 'search for pids and output the results'
+    search_options = True
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', default=False, action='store_true',
+            help='Output full pid information as JSON lines')
+
+    def handle(self):
+        pidclient = self.get_client()
+        progress = self.start_progress()
+        for pid in pidclient.iter_search_pids(self.args.workers, progress,
+                count=self.args.page_size, **self.search_opts()):
+            if self.args.json:
+                print(json.dumps(pid, sort_keys=True))
+            else:
+                print(pid['pid'])
+        self.finish_progress()
+
+
+class Export(Command):
+    '''Export pids and targets matching a search to a file, one row per target.'''
+    name = 'export'
+    help = 'export pids and targets to CSV, JSON lines or Parquet'
+    search_options = True
+
+    def add_arguments(self, parser):
+        output_args = parser.add_argument_group('Output options')
+        output_args.add_argument('--output', '-o', default='-',
+            help='Output file (default: standard output)')
+        output_args.add_argument('--format', '-f', choices=FORMATS, default='csv',
+            help='Output format (default: %(default)s)')
+        output_args.add_argument('--compress', '-z', dest='compression', default=None,
+            help='Compress output: %s for csv/jsonl; a parquet codec (e.g. snappy) for parquet' \
+                % ', '.join(COMPRESSION))
+
+    def handle(self):
+        progress = self.start_progress()
+        try:
+            export_pids(self.get_client(), self.args.output, self.args.format,
+                compression=self.args.compression, workers=self.args.workers,
+                count=self.args.page_size, progress=progress, **self.search_opts())
+        except Exception as err:
+            return self.error('exporting pids failed (%s)' % err)
+        self.finish_progress()
+
+
+class Import(Command):
+    '''Create pids in bulk from a CSV or JSON lines manifest.  Rows already
+    recorded in the output manifest are skipped, so an interrupted import
+    can be resumed by running the same command again.'''
+    name = 'import'
+    help = 'create pids in bulk from a manifest file'
+    requires_auth = True
+    config_options = Command.config_options + [
+        (Command.pid_cfg, 'type', 'type'),
+        (Command.pid_cfg, 'domain', 'domain'),
+        (Command.pid_cfg, 'external_system', 'external_system'),
+        (Command.pid_cfg, 'policy', 'policy'),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Input manifest (.csv or .jsonl)')
+        parser.add_argument('output',
+            help='Output manifest with assigned pids (.csv or .jsonl); appended to if it exists')
+        pid_args = parser.add_argument_group('Pid options')
+        pid_args.add_argument('--type', '-t', choices=['ARK', 'PURL'],
+            help='Type of pids to create (default: ARK)')
+        pid_args.add_argument('--domain', '-d',
+            help='Domain URI that new pids should belong to, unless specified in the manifest')
+        pid_args.add_argument('--external-system', dest='external_system',
+            help='External system name for new pids')
+        pid_args.add_argument('--policy', help='Policy title for new pids')
+
+    def handle(self):
+        if not self.args.domain:
+            return self.error('domain is required')
+        from pidservices.importer import PidImporter
+        pid_type = (self.args.type or 'ARK').lower()
+        importer = PidImporter(self.get_client(), pid_type, self.args.domain,
+            external_system=self.args.external_system, policy=self.args.policy,
+            workers=self.args.workers)
+        progress = self.start_progress()
+        try:
+            counts = importer.run(self.args.manifest, self.args.output, progress)
+        except Exception as err:
+            return self.error('importing pids failed (%s)' % err)
+        if not self.args.quiet:
+            print('Created %(created)d pids; %(partial)d partially created, '
+                '%(error)d errors, %(skipped)d skipped' % counts, file=sys.stderr)
+        self.finish_progress()
+        return 1 if progress.errors else 0
+
+
+class RewriteTargets(Command):
+    '''Find and replace a string (e.g., a hostname or base url) in the
+    target URIs of all pids matching a search.  Only targets that contain
+    the string (and would actually change) are updated; with
+    ``--dry-run``, the planned updates are output instead.'''
+    name = 'rewrite-targets'
+    help = 'find and replace text in target URIs'
+    requires_auth = True
+    search_options = True
+
+    def add_arguments(self, parser):
+        parser.add_argument('--find', required=True,
+            help='Text to find in target URIs, e.g. an old hostname')
+        parser.add_argument('--replace', required=True,
+            help='Replacement text, e.g. a new hostname')
+        parser.add_argument('--check', default=False, action='store_true',
+            help='Check that each new target URI can be retrieved before updating; ' +
+                 'targets are not updated to broken URIs')
+        add_dry_run_argument(parser)
+        self.add_host_arguments(parser)
+
+    def changes(self, pidclient):
+        # generate the target updates needed, as planner changes
+        from pidservices.planner import plan_target
+        self.unchanged = 0
+        for pid in pidclient.iter_search_pids(self.args.workers,
+                count=self.args.page_size, **self.search_opts()):
+            for target in pid.get('targets', []):
+                uri = target.get('target_uri') or ''
+                if self.args.find in uri:
+                    change = plan_target(self.args.type, pid['pid'], target.get('qualifier'),
+                        target, target_uri=uri.replace(self.args.find, self.args.replace))
+                    if change is None:
+                        self.unchanged += 1
+                    else:
+                        yield change
+
+    def handle(self):
+        # pid type is needed to generate target urls for update
+        if not self.args.type:
+            return self.error('type is required')
+        from requests.exceptions import RequestException
+        pidclient = self.get_client()
+        checker = self.get_checker(pidclient) if self.args.check else None
+
+        def update(change):
+            new_uri = change.fields['target_uri']
+            if checker is not None:
+                result = checker.probe(new_uri)
+                if not result.ok:
+                    return change, 'new target %s is broken (%s)' % \
+                        (new_uri, result.status or result.error)
+            if self.args.dry_run:
+                return change, None
+            try:
+                change.apply(pidclient)
+            except RequestException as err:
+                return change, err
+            return change, None
+
+        progress = self.start_progress()
+        pool = None
+        if checker is not None:
+            # schedule by new target host, so checks don't overload any one host
+            results = checker.scheduler.imap(update, self.changes(pidclient),
+                host=lambda change: url_host(change.fields['target_uri']))
+        else:
+            pool = WorkerPool(self.args.workers)
+            results = pool.imap(update, self.changes(pidclient), ordered=False)
+        try:
+            for change, err in results:
+                if err is not None:
+                    print('Error updating %s: %s' % (change.noid, err), file=sys.stderr)
+                elif self.args.dry_run:
+                    print(change.describe())
+                progress.update(errors=0 if err is None else 1)
+        finally:
+            if pool is not None:
+                pool.close()
+        self.finish_progress()
+        if not self.args.quiet:
+            print('%d targets already up to date' % self.unchanged, file=sys.stderr)
+        return 1 if progress.errors else 0
+
+
+class TargetCommand(Command):
+    '''Base class for subcommands that operate on a list of pids or
+    targets read from a file, one per line.'''
+    config_options = Command.config_options + [
+        (Command.pid_cfg, 'type', 'type'),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids',
+            help='File with one ARK, PURL or noid per line (- for standard input)')
+        parser.add_argument('--type', '-t', choices=['ark', 'purl'], default=None,
+            help='Type of pids listed (default: ark)')
+
+    def process(self, pidclient, noid, qualifier):
+        '''Process a single pid or target.  Called from worker threads.
+
+        :returns: None on success, or an exception on failure
+        '''
+        raise NotImplementedError
+
+    def failed(self, noid, qualifier, err):
+        '''Report a pid or target that could not be processed.'''
+        print('Error processing %s: %s' %
+            ('/'.join([noid, qualifier]) if qualifier else noid, err), file=sys.stderr)
+
+    def handle(self):
+        self.args.type = (self.args.type or 'ark').lower()
+        pidclient = self.get_client()
+
+        def process(item):
+            noid, qualifier = item
+            return noid, qualifier, self.process(pidclient, noid, qualifier)
+
+        progress = self.start_progress()
+        with WorkerPool(self.args.workers) as pool:
+            for noid, qualifier, err in pool.imap(process, read_pids(self.args.pids),
+                                                  ordered=False):
+                if err is not None:
+                    self.failed(noid, qualifier, err)
+                progress.update(errors=0 if err is None else 1)
+        self.finish_progress()
+        return 1 if progress.errors else 0
+
+
+class Deactivate(TargetCommand):
+    '''Mark targets as inactive, so they will no longer be resolved.
+    Qualified ARKs deactivate the qualified target; otherwise, the
+    unqualified target is deactivated.  Targets that are already inactive
+    are not updated; with ``--dry-run``, targets that would be deactivated
+    are output instead.'''
+    name = 'deactivate'
+    help = 'mark targets inactive'
+    requires_auth = True
+
+    def add_arguments(self, parser):
+        super(Deactivate, self).add_arguments(parser)
+        add_dry_run_argument(parser)
+
+    def process(self, pidclient, noid, qualifier):
+        from requests.exceptions import RequestException
+        from pidservices.planner import plan_target
+        try:
+            target = pidclient.get_target(self.args.type, noid, qualifier)
+            change = plan_target(self.args.type, noid, qualifier, target, active=False)
+            if change is None:
+                return
+            if self.args.dry_run:
+                print(change.describe())
+            else:
+                change.apply(pidclient)
+        except RequestException as err:
+            return err
+
+
+class Verify(TargetCommand):
+    '''Check that every listed pid exists in the Pid Manager (e.g., to
+    check a batch of allocated pids).  Pids that could not be found are
+    output, one per line.'''
+    name = 'verify'
+    help = 'check that listed pids exist'
+
+    def process(self, pidclient, noid, qualifier):
+        from requests.exceptions import RequestException
+        try:
+            if qualifier:
+                pidclient.get_target(self.args.type, noid, qualifier)
+            else:
+                pidclient.get_pid(self.args.type, noid)
+        except RequestException as err:
+            return err
+
+    def failed(self, noid, qualifier, err):
+        print('/'.join([noid, qualifier]) if qualifier else noid)
+
+
+class CheckTargets(Command):
+    '''Check target URIs of all pids matching a search for broken links,
+    optionally deactivating broken targets.  Broken targets are output
+    one per line, as tab-separated noid, qualifier, status (or error),
+    and target URI.'''
+    name = 'check-targets'
+    help = 'check target URIs for broken links'
+    search_options = True
+
+    def add_arguments(self, parser):
+        self.add_host_arguments(parser)
+        parser.add_argument('--include-inactive', default=False, action='store_true',
+            dest='include_inactive', help='Check inactive targets too')
+        parser.add_argument('--deactivate', default=False, action='store_true',
+            help='Deactivate broken targets (requires credentials)')
+        parser.add_argument('--pidman-user', dest='pidman_user', default=None,
+            help='PID Manager username (for --deactivate)')
+        parser.add_argument('--pidman-password', '-p', dest='pidman_password',
+            metavar='PASSWORD', default=None, action=PasswordAction,
+            help='Password for the specified Pid Manager user (leave blank to be prompted)')
+
+    def handle(self):
+        if not self.args.type:
+            return self.error('type is required')
+        if self.args.deactivate and not all([self.args.pidman_user,
+                                             self.args.pidman_password]):
+            return self.error('PID manager credentials are required to deactivate targets')
+        pidclient = self.get_client(auth=self.args.deactivate)
+
+        checker = self.get_checker(pidclient)
+        progress = self.start_progress()
+        statuses = checker.check_search(include_inactive=self.args.include_inactive,
+            repair=self.args.deactivate, count=self.args.page_size, **self.search_opts())
+        for status in statuses:
+            result = status.result
+            if not result.ok:
+                print('\t'.join([status.pid['pid'], status.target.get('qualifier') or '',
+                                 str(result.status or result.error), result.url]))
+            progress.update(errors=0 if result.ok else 1)
+        self.finish_progress()
+        return 1 if progress.errors else 0
+
+
+class Benchmark(Command):
+    '''Measure API request throughput with each of the selected
+    transports, making concurrent requests to a Pid Manager or (by
+    default) a local stand-in server; see :mod:`pidservices.benchmark`.
+    Outputs one line per transport with requests, errors, seconds and
+    requests per second.'''
+    name = 'benchmark'
+    help = 'compare API request throughput of transports'
+    requires_url = False
+
+    def add_arguments(self, parser):
+        bench_args = parser.add_argument_group('Benchmark options')
+        bench_args.add_argument('--requests', '-n', type=int, default=1000, metavar='N',
+            help='Number of requests to make with each transport (default: %(default)s)')
+        bench_args.add_argument('--operation', choices=['get', 'search'], default='get',
+            help='API call to benchmark (default: %(default)s)')
+        bench_args.add_argument('--compare', action='append', choices=TRANSPORTS,
+            metavar='TRANSPORT', help='Transport to benchmark; may be repeated '
+                '(default: %s)' % ', '.join(TRANSPORTS))
+        bench_args.add_argument('--delay', type=float, default=0.005, metavar='SECONDS',
+            help='Response delay for the stand-in server (default: %(default)s)')
+
+    def handle(self):
+        from pidservices.benchmark import benchmark, StandInServer
+        server = None
+        if not self.args.pidman_url:
+            server = StandInServer(delay=self.args.delay).start()
+            self.args.pidman_url = server.url
+        try:
+            for name in self.args.compare or TRANSPORTS:
+                try:
+                    # the stand-in server is plain http, so the http2
+                    # transport must use HTTP/2 with prior knowledge
+                    transport = self.get_transport(name, http1=not (server and server.http2))
+                except Exception as err:
+                    return self.error(err)
+                client = PidmanRestClient(self.args.pidman_url, transport=transport,
+                                          metrics=self.get_metrics(), tracer=self.get_tracer())
+                result = benchmark(client, self.args.operation, self.args.requests,
+                                   self.args.workers)
+                client.session.close()
+                print('%-10s %8d %6d %8.2f %10.1f' % (name, result.requests, result.errors,
+                                                      result.elapsed, result.rate))
+        finally:
+            if server is not None:
+                server.stop()
+
+
+class Diff(Command):
+    '''Compare the pids and targets matching a search on two Pid Manager
+    instances, or in two snapshot files saved with ``pidman search --json``,
+    and output the pids and targets added, removed and changed; see
+    :mod:`pidservices.diff`.  With ``--record`` or ``--replay``, requests
+    to each Pid Manager are recorded in (or replayed from) a separate
+    file, named with ``.old`` or ``.new`` before the extension.'''
+    name = 'diff'
+    help = 'compare pids and targets on two Pid Managers or in snapshot files'
+    requires_url = False
+    search_options = True
+
+    def add_arguments(self, parser):
+        parser.add_argument('old',
+            help='Pid Manager URL or snapshot file with the old pids, e.g. production')
+        parser.add_argument('new',
+            help='Pid Manager URL or snapshot file with the new pids, e.g. testpid')
+        parser.add_argument('--json', default=False, action='store_true',
+            help='Output differences as JSON lines')
+        parser.add_argument('--chunk-size', type=int, default=100000, dest='chunk_size',
+            metavar='N', help='Number of pids sorted in memory at a time (default: %(default)s)')
+
+    def source(self, location, progress, side):
+        from pidservices.diff import file_source
+        if location.startswith('http://') or location.startswith('https://'):
+            client = PidmanRestClient(location, transport=self.get_transport(suffix=side),
+                                      metrics=self.get_metrics(), tracer=self.get_tracer())
+            pids = client.iter_search_pids(self.args.workers, count=self.args.page_size,
+                                           **self.search_opts())
+        else:
+            pids = file_source(location)
+        # progress counts pids read from both sides
+        for pid in pids:
+            progress.update()
+            yield pid
+
+    def handle(self):
+        from requests.exceptions import RequestException
+        from pidservices.diff import DomainDiff
+        progress = self.start_progress()
+        diff = DomainDiff(self.source(self.args.old, progress, 'old'),
+                          self.source(self.args.new, progress, 'new'),
+                          chunk_size=self.args.chunk_size)
+        try:
+            for difference in diff:
+                if self.args.json:
+                    print(json.dumps(difference.as_dict(), sort_keys=True))
+                else:
+                    print(difference.describe())
+        except (IOError, ValueError, RequestException) as err:
+            return self.error('comparing pids failed (%s)' % err)
+        self.finish_progress()
+        if not self.args.quiet:
+            print('Compared %d old and %d new pids: %s' %
+                  (diff.pids['old'], diff.pids['new'], diff.summary()), file=sys.stderr)
+
+
+#: available subcommands, in the order they are listed in help
+COMMANDS = [Allocate, Search, Export, Import, RewriteTargets, Deactivate, Verify,
+            CheckTargets, Diff, Benchmark]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='pidman',
+        description='Command-line tools for the Pid Manager REST API.')
+    subparsers = parser.add_subparsers(title='subcommands', dest='command', required=True)
+    for command_cls in COMMANDS:
+        command = command_cls()
+        subparser = subparsers.add_parser(command.name, help=command.help,
+                                          description=command.__doc__)
+        command.add_common_arguments(subparser)
+        command.add_arguments(subparser)
+        subparser.set_defaults(command_obj=command)
+    return parser
+
+
+def main(argv=None):
+    '''Entry point for the ``pidman`` command.'''
+    args = get_parser().parse_args(argv)
+    sys.exit(args.command_obj.run(args))
@@ -6,15 +6,21 @@ Module contains classes that build clients to interact with the Pidman Applicati
 via services.
 '''
 
+import contextlib
+from http import HTTPStatus
 import json
 import logging
 import re
-import urllib
-from urlparse import urlparse
-import requests
+import threading
+import time
+from urllib.parse import quote, urlparse
 
 from pidservices import __version__
 
+# NOTE: requests is imported when a client makes its first API call rather
+# than at module import, so that importing pidservices (e.g., in short-lived
+# command-line jobs that only print help or fail validation) stays fast
+
 logger = logging.getLogger(__name__)
 
 # characters expected to be present in NOID portion of ARKs and PURLs (noid template .zek)
@@ -49,6 +55,15 @@ def parse_ark(ark):
     if matches is not None:
         return matches.groupdict()
 
+def pid_noid(pid):
+    '''Get the noid from a pid in resolvable form, as returned by
+    :meth:`PidmanRestClient.create_pid`: the noid of an ARK (qualifiers are
+    ignored), or the last path segment of a PURL.'''
+    parsed = parse_ark(pid)
+    if parsed is not None:
+        return parsed['noid']
+    return pid.rstrip('/').split('/')[-1]
+
 
 class PidmanRestClient(object):
     """
@@ -65,6 +80,12 @@ class PidmanRestClient(object):
                     ``http://my.domain.com/pidserver``
     :param username: optional username for REST API access
     :param password: optional password
+    :param transport: optional transport used to send requests instead of
+        a :class:`requests.Session`; see :mod:`pidservices.transports`
+    :param metrics: optional :class:`~pidservices.metrics.ClientMetrics`
+        for recording request times
+    :param tracer: optional :class:`~pidservices.tracing.Tracer` for
+        recording a tracing span for each API call
 
     """
     baseurl = {
@@ -73,38 +94,70 @@ class PidmanRestClient(object):
         'path': None,
     }
     _auth = None
-    headers = {
-        'User-Agent': 'PidmanRestClient/%s (python-requests/%s)' % \
-            (__version__, requests.__version__),
-        'verify': True # veryify SSL certs by default
-    }
+    _session = None
+    metrics = None
+    tracer = None
+    #: :class:`~pidservices.writebuffer.WriteBuffer` queueing updates,
+    #: while buffering; see :meth:`buffer_writes`
+    write_buffer = None
+    #: seconds before the :attr:`domains` cache is refreshed
+    domain_ttl = 300
+    _domains = None
+    # guards creating the session and domain tree on first use, so that
+    # worker threads starting at once share the same ones
+    _lazy_lock = threading.Lock()
 
     pid_types = ['ark', 'purl']
     # pattern for generating a REST api url for pid create/access/update
     # - no trailing slash here (used to distinguish unqualified target)
-    _rest_pid_uri = '%(base_url)s/%(type)s/%(noid)s'
+    # - relative to the base url; see :meth:`absolute_url`
+    _rest_pid_uri = '%(type)s/%(noid)s'
     # pattern for generating REST api url for target access/update/delete
-    _rest_target_uri = '%(base_url)s/%(type)s/%(noid)s/%(qualifier)s'
+    _rest_target_uri = '%(type)s/%(noid)s/%(qualifier)s'
 
     # This token is used when creating arks for targets.
     # The portion of the url that contains this token should be replaced with a noid
     pid_token = '{%PID%}'
 
-    def __init__(self, url, username="", password=""):
+    def __init__(self, url, username="", password="", transport=None, metrics=None,
+                 tracer=None):
         self._set_baseurl(url)
-
-        # create a requests session to be used for all API calls
-        self.session = requests.Session()
-        # Set headers that should be passed with every request
-
-        self.session.headers = {
-            'User-Agent': 'pidmanclient/%s (python-requests/%s)' % \
-                (__version__, requests.__version__),
-            'verify': True,  # verify SSL certs by default
-        }
         # store auth if credentials were specified
         if username and password:
             self._auth = (username, password)
+        if transport is not None:
+            self.session = transport
+        self.metrics = metrics
+        self.tracer = tracer
+
+    def _new_session(self):
+        '''Create the requests session to be used for all API calls.'''
+        import requests
+        session = requests.Session()
+        # Set headers that should be passed with every request
+        session.headers['User-Agent'] = 'pidmanclient/%s (python-requests/%s)' % \
+            (__version__, requests.__version__)
+        session.verify = True  # verify SSL certs by default
+        return session
+
+    @property
+    def session(self):
+        '''The :class:`requests.Session` (or other transport) used for all
+        API calls; a session is created on first use.'''
+        if self._session is None:
+            with self._lazy_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    @session.deleter
+    def session(self):
+        # a new session will be created on next use
+        self._session = None
 
     def _set_baseurl(self, url):
         """
@@ -115,6 +168,8 @@ class PidmanRestClient(object):
 
         """
         obj = urlparse(url.rstrip('/'))
+        # per-instance copy, so clients for different servers don't share it
+        self.baseurl = dict(self.baseurl)
         self.baseurl['scheme'] = obj.scheme
         self.baseurl['host'] = obj.netloc
         self.baseurl['path'] = obj.path
@@ -148,7 +203,6 @@ class PidmanRestClient(object):
         '''
         self._check_pid_type(type)
         return self._rest_pid_uri % {
-            'base_url': self.baseurl['path'],
             'type': type,
             'noid': noid,
         }
@@ -163,20 +217,19 @@ class PidmanRestClient(object):
         '''
         self._check_pid_type(type)
         return self._rest_target_uri % {
-            'base_url': self.baseurl['path'],
             'type': type,
             'noid': noid,
             'qualifier': qualifier,
         }
 
     def _make_request(self, reqmeth, url, params=None, body=None,
-        expected_response=requests.codes.ok, accept="application/json"):
+        expected_response=HTTPStatus.OK, accept="application/json"):
         '''Make an API request.  Common functionality for making http requests
         and simple error handling.  Defaults are set so that simple access
         requests can specify very few parameters.
 
         Checks the returned response status code against the expected response,
-        and raises an :class:`urllib2.HTTPError` if they are not equal.  Otherwise,
+        and raises a :class:`requests.HTTPError` if they are not equal.  Otherwise,
         the response object is returned for any further processing.
 
         :param url: url to request
@@ -207,9 +260,7 @@ class PidmanRestClient(object):
             request_options['auth'] = self._auth
 
         # set headers that vary depending on the request
-
-        # - set content length based on the actual body
-        headers["Content-Length"] = len(body) if body is not None else 0
+        # (content length is calculated by requests from the encoded body)
 
         # - set content type based on the data being sent (if any)
         # for current implementation, we can make the following assumptions:
@@ -226,9 +277,41 @@ class PidmanRestClient(object):
         headers['Accept'] = accept
 
         # absolutize url based on configured pidman base url
-        url = self.absolute_url(url)
+        path, url = url, self.absolute_url(url)
         logger.debug('Request: %s %s %s <![BODY[%s]]>', method_name, url, headers, body)
-        response = reqmeth(url, headers=headers, **request_options)
+        tracer = self.tracer
+        if tracer is None:
+            response = self._send(reqmeth, method_name, path, url, headers, request_options)
+            return self._handle_response(response, expected_response, accept)
+
+        from pidservices.metrics import classify
+        from pidservices.tracing import CLIENT
+        operation, template = classify(method_name, path)
+        with tracer.span(operation, {'http.method': method_name, 'http.url': url,
+                                     'pidman.url_template': template}, kind=CLIENT) as span:
+            with tracer.span('transport'):
+                response = self._send(reqmeth, method_name, path, url, headers,
+                                      request_options)
+            span.set_attribute('http.status_code', response.status_code)
+            return self._handle_response(response, expected_response, accept, tracer)
+
+    def _send(self, reqmeth, method_name, path, url, headers, request_options):
+        # send a request, recording its time if metrics are enabled
+        metrics = self.metrics
+        if metrics is None:
+            response = reqmeth(url, headers=headers, **request_options)
+        else:
+            status = None
+            start = time.perf_counter()
+            try:
+                response = reqmeth(url, headers=headers, **request_options)
+                status = response.status_code
+            finally:
+                metrics.record(method_name, path, time.perf_counter() - start, status)
+        return response
+
+    def _handle_response(self, response, expected_response, accept, tracer=None):
+        # check the response status and decode the response
 
         # convert expected response code into list for simpler comparison
         if not isinstance(expected_response, list):
@@ -237,18 +320,22 @@ class PidmanRestClient(object):
         if response.status_code not in expected_response:
             # Some errors (e.g., bad request) include a more detailed error
             # message in response body - if present, add to error message detail
-            text = response.content
+            text = response.text
             if text is not None and len(text):
+                from requests.exceptions import HTTPError
                 detail = '%s: %s' % (response.status_code, text)
-                raise requests.exceptions.HTTPError(detail, response=response)
+                raise HTTPError(detail, response=response)
             else:
                 # otherwise let requests raise the error
                 response.raise_for_status()
 
         if accept == 'application/json':
+            if tracer is not None:
+                with tracer.span('decode'):
+                    return response.json()
             return response.json()
         elif accept == 'text/plain':
-            return response.content
+            return response.text
         else:
             return response
 
@@ -266,6 +353,18 @@ class PidmanRestClient(object):
 
     domain_url = '/domains/'
 
+    @property
+    def domains(self):
+        '''Cached :class:`~pidservices.domains.DomainTree` of the server's
+        domains, for looking up domains by name, URI or id and finding
+        parent and subdomains without further API requests.'''
+        if self._domains is None:
+            from pidservices.domains import DomainTree
+            with self._lazy_lock:
+                if self._domains is None:
+                    self._domains = DomainTree(self, ttl=self.domain_ttl)
+        return self._domains
+
     def list_domains(self):
         """
         Returns the default domain list from the rest server.
@@ -295,8 +394,11 @@ class PidmanRestClient(object):
             domain_info['parent'] =  parent
 
         # returns the URI for the newly-created domain on success
-        return self.post(self.domain_url, body=domain_info, expected_response=requests.codes.created,
-                         accept='text/plain')
+        uri = self.post(self.domain_url, body=domain_info, expected_response=HTTPStatus.CREATED,
+                        accept='text/plain')
+        if self._domains is not None:
+            self._domains.invalidate()
+        return uri
 
     def get_domain(self, domain_id):
         """
@@ -305,7 +407,7 @@ class PidmanRestClient(object):
         :param domain_id: ID of the domain to return.
 
         """
-        url = '%s%s/' % (self.domain_url, urllib.quote(str(domain_id)))
+        url = '%s%s/' % (self.domain_url, quote(str(domain_id)))
         return self.get(url)
 
     def update_domain(self, domain_id, name=None, policy=None, parent=None):
@@ -327,19 +429,24 @@ class PidmanRestClient(object):
             domain_info['parent'] = parent
 
         # Setup the data to pass in the request.
-        url = '%s%s/' % (self.domain_url, urllib.quote(str(domain_id)))
+        url = '%s%s/' % (self.domain_url, quote(str(domain_id)))
         body = json.dumps(domain_info)
 
         if not domain_info:
             raise Exception("No domain update data specified")
 
         # If successful the view returns the object just updated.
-        return self.put(url, body=body)
+        domain = self.put(url, body=body)
+        if self._domains is not None:
+            self._domains.invalidate()
+        return domain
 
     def search_pids(self, pid=None, type=None, target=None, domain=None,
             domain_uri=None, page=None, count=None):
         """
-        Queries the PID search api and returns the data results.
+        Queries the PID search api and returns the data results.  A domain
+        name is resolved with the cached :attr:`domains` tree and searched
+        by domain URI, as in :meth:`iter_search_pids`.
 
         :param domain: Exact domain name for pid
         :param domain_uri: URI of a domain.
@@ -349,14 +456,281 @@ class PidmanRestClient(object):
         :param page: Page number of results to return
         :param count: Number of results to return on a single page.
 
+        :raises ~pidservices.domains.DomainNotFound: if a domain name is
+            not found or is ambiguous
         """
+        if domain and not domain_uri:
+            domain_uri = self.domains.uri(domain)
+            domain = None
         # generate a dictionary with any parameters that are set
-        query = dict([(key, val) for key, val in locals().iteritems() if
+        query = dict([(key, val) for key, val in locals().items() if
                       key not in ['self'] and val])
 
         url = 'pids/'
         return self.get(url, params=query)
 
+    def iter_search_pids(self, workers=1, progress=None, **kwargs):
+        """
+        Iterate over every pid matching a search, across all pages of
+        results.  Takes the same search parameters as :meth:`search_pids`
+        (``page`` is ignored).  The first page is requested to find out how
+        many pages there are; with ``workers`` greater than 1, the remaining
+        pages are then requested concurrently, a few pages ahead of the
+        caller, so that only a bounded number of pages are held in memory.
+
+        Pids are yielded in the same order the server returns them.
+
+        With ``adaptive=True`` (or a
+        :class:`~pidservices.paging.PageSizeTuner`), the page size is
+        adjusted as the search runs; see :meth:`iter_search_pages_adaptive`.
+
+        With ``snapshot=True``, pids changed while the search runs are
+        still returned exactly once; see :mod:`pidservices.snapshot`.
+
+        To search several domains at once, pass a list of domain names
+        (``domain``) or URIs (``domain_uri``), and/or ``subdomains=True``
+        to include all of their subdomains; see
+        :meth:`iter_search_domain_pages`.
+
+        :param workers: number of pages to request concurrently
+        :param progress: optional
+            :class:`~pidservices.progress.ProgressReporter`, updated with
+            the number of pids and request time of each page; its total is
+            set from the number of search results, if not already set
+        :returns: generator of pid dictionaries, as returned in the
+            ``results`` of :meth:`search_pids`
+        """
+        for results in self.iter_search_pages(workers, progress, **kwargs):
+            for pid in results:
+                yield pid
+
+    def iter_search_pages(self, workers=1, progress=None, **kwargs):
+        """
+        Iterate over all pages of results for a search; see
+        :meth:`iter_search_pids`.  Domain names are resolved with the
+        cached :attr:`domains` tree and searched by domain URI.
+
+        :raises ~pidservices.domains.DomainNotFound: if a domain name is
+            not found or is ambiguous
+
+        :returns: generator of lists of pid dictionaries, one list per page
+        """
+        kwargs.pop('page', None)
+        if isinstance(kwargs.get('domain'), str) and not kwargs.get('domain_uri'):
+            # search by domain URI, resolving the name with the cached
+            # domain tree, rather than having the server match names
+            kwargs['domain_uri'] = self.domains.uri(kwargs.pop('domain'))
+        if kwargs.pop('snapshot', False):
+            from pidservices.snapshot import SearchSnapshot
+            for results in SearchSnapshot(self, workers, progress, **kwargs).pages():
+                yield results
+            return
+        adaptive = kwargs.pop('adaptive', None)
+        if adaptive:
+            if kwargs.get('subdomains') or isinstance(kwargs.get('domain'), (list, tuple)) or \
+                    isinstance(kwargs.get('domain_uri'), (list, tuple)):
+                raise Exception('Adaptive page sizes are not supported when searching '
+                                'several domains')
+            for results in self.iter_search_pages_adaptive(
+                    None if adaptive is True else adaptive, progress, **kwargs):
+                yield results
+            return
+        subdomains = kwargs.pop('subdomains', False)
+        domain, domain_uri = kwargs.get('domain'), kwargs.get('domain_uri')
+        if subdomains or isinstance(domain, (list, tuple)) or \
+                isinstance(domain_uri, (list, tuple)):
+            kwargs.pop('domain', None)
+            kwargs.pop('domain_uri', None)
+            domains = []
+            for value in (domain, domain_uri):
+                if isinstance(value, (list, tuple)):
+                    domains.extend(value)
+                elif value:
+                    domains.append(value)
+            for results in self.iter_search_domain_pages(domains, workers, progress,
+                                                         subdomains, **kwargs):
+                yield results
+            return
+
+        batch = self._start_batch('iter_search_pages', workers=workers, **kwargs)
+
+        def get_page(page):
+            start = time.perf_counter()
+            with self._in_batch(batch):
+                data = self.search_pids(page=page, **kwargs)
+            if progress is not None:
+                if progress.total is None:
+                    progress.total = data.get('results_count')
+                progress.update(len(data.get('results', [])),
+                                latency=time.perf_counter() - start)
+            return data
+
+        try:
+            first_page = get_page(1)
+            yield first_page.get('results', [])
+            page_count = first_page.get('page_count') or 1
+            if batch is not None:
+                batch.set_attribute('page_count', page_count)
+            if page_count < 2:
+                return
+
+            from pidservices.workers import WorkerPool
+            with WorkerPool(workers) as pool:
+                for data in pool.imap(get_page, range(2, page_count + 1)):
+                    yield data.get('results', [])
+        finally:
+            if batch is not None:
+                batch.end()
+
+    # statuses returned by servers and proxies when a request takes too long
+    _timeout_status = (HTTPStatus.BAD_GATEWAY, HTTPStatus.SERVICE_UNAVAILABLE,
+                       HTTPStatus.GATEWAY_TIMEOUT)
+
+    def iter_search_pages_adaptive(self, tuner=None, progress=None, **kwargs):
+        """
+        Iterate over all pages of results for a search, adjusting the page
+        size as the search runs to keep page requests near a target
+        latency and memory budget; see :mod:`pidservices.paging`.  Pages
+        are requested one at a time.  When a page request times out, it
+        is retried with a smaller page size.
+
+        :param tuner: :class:`~pidservices.paging.PageSizeTuner`; by
+            default, one with a starting page size of ``count``
+        :param progress: optional
+            :class:`~pidservices.progress.ProgressReporter`
+        :param kwargs: other search parameters, as for :meth:`search_pids`
+        :returns: generator of lists of pid dictionaries, one list per page
+        """
+        from requests.exceptions import HTTPError, Timeout
+        from pidservices.paging import PageSizeTuner
+        kwargs.pop('page', None)
+        count = kwargs.pop('count', None)
+        if tuner is None:
+            tuner = PageSizeTuner(initial=count or 1024)
+        batch = self._start_batch('iter_search_adaptive', **kwargs)
+        offset = 0
+        try:
+            while True:
+                size = tuner.next_size(offset)
+                page = offset // size + 1
+                start = time.perf_counter()
+                try:
+                    with self._in_batch(batch):
+                        data = self.search_pids(page=page, count=size, **kwargs)
+                except Timeout:
+                    if tuner.timeout(size) is None:
+                        raise
+                    continue
+                except HTTPError as err:
+                    status = err.response.status_code if err.response is not None else None
+                    if status == HTTPStatus.NOT_FOUND and offset:
+                        # pids were removed since the search started
+                        break
+                    if status not in self._timeout_status or tuner.timeout(size) is None:
+                        raise
+                    continue
+                latency = time.perf_counter() - start
+                results = data.get('results', [])
+                total = data.get('results_count') or 0
+                if results and len(results) < size and offset + len(results) < total:
+                    # the server has a smaller maximum page size, so pages
+                    # don't start where expected; retry with a size it allows
+                    tuner.limit(len(results))
+                    continue
+                tuner.observe(size, latency, results)
+                if progress is not None:
+                    if progress.total is None:
+                        progress.total = total
+                    progress.update(len(results), latency=latency)
+                if not results:
+                    break
+                yield results
+                offset += len(results)
+                if offset >= total:
+                    break
+            if batch is not None:
+                batch.set_attribute('page_count', tuner.pages)
+        finally:
+            if batch is not None:
+                batch.end()
+
+    def iter_search_domain_pages(self, domains, workers=4, progress=None, subdomains=False,
+                                 **kwargs):
+        """
+        Iterate over all pages of results for a search of several domains.
+        Domains may be given by name, URI or id; they are resolved with
+        the cached :attr:`domains` tree, and searched by domain URI.  The
+        first page for each domain is requested concurrently, then the
+        remaining pages for all domains; pages are yielded as they arrive,
+        so results for different domains are interleaved.
+
+        :param domains: list of domains to search
+        :param workers: number of pages to request concurrently
+        :param progress: optional
+            :class:`~pidservices.progress.ProgressReporter`; its total is
+            set from the number of search results, if not already set
+        :param subdomains: if True, also search all subdomains of the
+            domains, at any depth
+        :param kwargs: other search parameters, as for :meth:`search_pids`
+        :returns: generator of lists of pid dictionaries, one list per page
+        """
+        for key in ('page', 'domain', 'domain_uri'):
+            kwargs.pop(key, None)
+        uris = []
+        for domain in domains:
+            found = [self.domains.get(domain)]
+            if subdomains:
+                found.extend(self.domains.descendants(domain))
+            uris.extend(d.uri for d in found if d.uri not in uris)
+        set_total = progress is not None and progress.total is None
+        if set_total:
+            progress.total = 0
+        batch = self._start_batch('iter_search_domains', workers=workers, domains=len(uris),
+                                  **kwargs)
+
+        def get_page(item):
+            uri, page = item
+            start = time.perf_counter()
+            with self._in_batch(batch):
+                data = self.search_pids(domain_uri=uri, page=page, **kwargs)
+            if progress is not None:
+                progress.update(len(data.get('results', [])),
+                                latency=time.perf_counter() - start)
+            return uri, page, data
+
+        from pidservices.workers import WorkerPool
+        try:
+            with WorkerPool(workers) as pool:
+                remaining = []
+                for uri, page, data in pool.imap(get_page, [(uri, 1) for uri in uris],
+                                                 ordered=False):
+                    if set_total:
+                        progress.total += data.get('results_count') or 0
+                    remaining.extend((uri, page) for page in
+                                     range(2, (data.get('page_count') or 1) + 1))
+                    yield data.get('results', [])
+                if batch is not None:
+                    batch.set_attribute('page_count', len(uris) + len(remaining))
+                for uri, page, data in pool.imap(get_page, remaining, ordered=False):
+                    yield data.get('results', [])
+        finally:
+            if batch is not None:
+                batch.end()
+
+    def _start_batch(self, name, **attributes):
+        # start a tracing span for a batch operation, if tracing is enabled;
+        # the span is not made active, since the caller's code runs between
+        # the batch's generator steps, and API calls are added to it with
+        # _in_batch instead
+        if self.tracer is not None:
+            return self.tracer.start_span(name, dict((key, str(val)) for key, val
+                                                     in attributes.items()))
+
+    def _in_batch(self, batch):
+        if batch is None:
+            return contextlib.nullcontext()
+        return self.tracer.activate(batch)
+
     def create_pid(self, type, domain, target_uri, name=None, external_system=None,
                 external_system_key=None, policy=None, proxy=None,
                 qualifier=None):
@@ -395,9 +769,91 @@ class PidmanRestClient(object):
             pid_opts['qualifier'] = qualifier
 
         # on success, returns new purl or ark in resolvable form as plain text
-        return self.post(url, body=pid_opts, expected_response=requests.codes.created,
+        return self.post(url, body=pid_opts, expected_response=HTTPStatus.CREATED,
                          accept='text/plain')
 
+    def expand_pid_token(self, uri, noid):
+        '''Replace :attr:`pid_token` in a URI with a noid.'''
+        return uri.replace(self.pid_token, noid)
+
+    def create_templated_pid(self, type, domain, target_uri, **kwargs):
+        '''Create a new pid whose target URI includes the new noid, marked
+        in ``target_uri`` by :attr:`pid_token`.  The pid is created with
+        :meth:`create_pid`, and its target is then updated with the token
+        replaced by the noid of the new pid; if ``target_uri`` does not
+        include the token, this is the same as :meth:`create_pid`.  Takes
+        the same parameters as :meth:`create_pid`.
+
+        :returns: newly created ARK or PURL in resolvable form
+        :raises: if the pid is created but its target can't be updated, the
+            exception is raised with the new pid as its ``pid`` attribute,
+            so the update can be retried without creating another pid
+        '''
+        pid = self.create_pid(type, domain, target_uri, **kwargs)
+        try:
+            self._expand_target(type, pid, target_uri, kwargs.get('qualifier'))
+        except Exception as err:
+            err.pid = pid
+            raise
+        return pid
+
+    def _expand_target(self, type, pid, target_uri, qualifier=None):
+        # update the target of a new pid created with a templated target uri
+        if target_uri and self.pid_token in target_uri:
+            noid = pid_noid(pid)
+            self.update_target(type, noid, qualifier or '',
+                               target_uri=self.expand_pid_token(target_uri, noid))
+
+    def create_pids(self, type, domain, target_uris, workers=4, progress=None, **kwargs):
+        '''Create pids in bulk, one for each target URI, using
+        :meth:`create_templated_pid`.  With ``workers`` greater than 1,
+        pids are created concurrently, and each pid's target is updated as
+        soon as the pid is created, while other pids are still being
+        created, instead of creating all the pids and then updating all the
+        targets.  Target URIs are consumed lazily.
+
+        Errors don't stop the batch; for a templated target, a pid may be
+        created even though its target could not be updated, in which case
+        the error is returned along with the pid.
+
+        :param target_uris: iterable of target URIs, optionally including
+            :attr:`pid_token`
+        :param workers: number of pids to create concurrently
+        :param progress: optional
+            :class:`~pidservices.progress.ProgressReporter`, updated as
+            each pid is created
+        :param kwargs: other pid options, as for :meth:`create_pid`
+        :returns: generator of tuples of new pid (or None) and exception
+            (or None), in the same order as ``target_uris``
+        '''
+        from requests.exceptions import RequestException
+        self._check_pid_type(type)
+
+        batch = self._start_batch('create_pids', type=type, domain=domain, workers=workers)
+
+        def create(target_uri):
+            pid = err = None
+            start = time.perf_counter()
+            try:
+                with self._in_batch(batch):
+                    pid = self.create_pid(type, domain, target_uri, **kwargs)
+                    self._expand_target(type, pid, target_uri, kwargs.get('qualifier'))
+            except RequestException as error:
+                err = error
+            if progress is not None:
+                progress.update(errors=0 if err is None else 1,
+                                latency=time.perf_counter() - start)
+            return pid, err
+
+        from pidservices.workers import WorkerPool
+        try:
+            with WorkerPool(workers) as pool:
+                for result in pool.imap(create, target_uris):
+                    yield result
+        finally:
+            if batch is not None:
+                batch.end()
+
     def create_purl(self, *args, **kwargs):
         '''Convenience method to create a new PURL.  See :meth:`create_pid` for
         details and supported parameters.'''
@@ -461,7 +917,8 @@ class PidmanRestClient(object):
         :param external_system: external system name
         :param external_system_id: pid identifier in specified external system
         :param policy: policy title
-        :returns: a dictionary of information for the update pid
+        :returns: a dictionary of information for the update pid (None
+            when buffering writes; see :meth:`buffer_writes`)
         '''
         # rest url url for updating the requested pid
         url = self._pid_url(type, noid)       # also checks pid type
@@ -484,11 +941,31 @@ class PidmanRestClient(object):
         if not pid_info:
             raise Exception("No update data specified")
 
+        if self.write_buffer is not None:
+            return self.write_buffer.add(url, pid_info, HTTPStatus.OK)
+
         # Setup the data to pass in the request.
         data = json.dumps(pid_info)
         # If successful the view returns the object just updated.
         return self.put(url, body=data)
 
+    def buffer_writes(self, size=100, delay=5, workers=4):
+        '''Start buffering writes: until the returned
+        :class:`~pidservices.writebuffer.WriteBuffer` is closed (e.g., at
+        the end of a ``with`` block), :meth:`update_pid` and
+        :meth:`update_target` queue their updates, merging updates to the
+        same pid or target, and queued updates are sent concurrently in
+        batches.  See :mod:`pidservices.writebuffer`.
+
+        :param size: number of pids and targets with queued updates that
+            triggers sending them
+        :param delay: maximum number of seconds to hold an update
+        :param workers: number of updates to send concurrently
+        :returns: :class:`~pidservices.writebuffer.WriteBuffer`
+        '''
+        from pidservices.writebuffer import WriteBuffer
+        return WriteBuffer(self, size, delay, workers).start()
+
     def update_purl(self, *args, **kwargs):
         '''Convenience method to update an existing purl.  See :meth:`update_pid`
         for details and supported parameters.'''
@@ -512,7 +989,8 @@ class PidmanRestClient(object):
         :param proxy: name of the proxy that should be used to resolve the target
         :param active: boolean, indicating whether the target should be considered
             active (inactive targets will not be resolved)
-        :returns: dictionary of information about the updated target.
+        :returns: dictionary of information about the updated target (None
+            when buffering writes; see :meth:`buffer_writes`)
         '''
         # generate target url and check pid type
         url = self._target_url(type, noid, qualifier)
@@ -532,9 +1010,12 @@ class PidmanRestClient(object):
             raise Exception("No update data specified!")
 
         # for ARK, either 200 or 201 is valid (could actually create a new qualifier here)
-        success_codes = [requests.codes.ok]
+        success_codes = [HTTPStatus.OK]
         if type == 'ark':
-            success_codes.append(requests.codes.created)
+            success_codes.append(HTTPStatus.CREATED)
+
+        if self.write_buffer is not None:
+            return self.write_buffer.add(url, target_info, success_codes)
 
         # Setup the data to pass in the request.
         data = json.dumps(target_info)
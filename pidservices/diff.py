@@ -0,0 +1,259 @@
+'''
+*"Compare, contrast, and then decide."* - **Proverb**
+
+Module contains :class:`DomainDiff`, for finding the pids and targets
+that differ between two Pid Manager instances (e.g., testpid and
+production) or saved snapshots of their search results::
+
+    old = search_source(PidmanRestClient('https://pid.emory.edu/'),
+                        domain='Rushdie Collection')
+    new = search_source(PidmanRestClient('https://testpid.library.emory.edu/'),
+                        domain='Rushdie Collection')
+    for difference in DomainDiff(old, new):
+        print(difference.describe())
+
+Pids are matched by NOID.  Search results aren't sorted by NOID, so each
+side is sorted first, both at once: pids are read in chunks, and each
+chunk is sorted (by :func:`~pidservices.noids.encode_noid`) and written
+to a temporary file, so memory use is bounded by the chunk size no matter
+how many pids there are.  The sorted chunks are then merged, and the two
+sides compared in a single pass.
+
+Fields that are expected to differ between instances, like pid and
+domain URIs, are not compared; see :data:`PID_FIELDS` and
+:data:`TARGET_FIELDS`.  *pidman diff* compares two Pid Manager URLs or
+snapshot files, which are JSON lines of pid information as written by
+``pidman search --json`` (gzipped if the name ends in .gz).
+'''
+
+from collections import Counter, namedtuple
+import gzip
+import heapq
+import io
+import json
+from operator import itemgetter
+import os
+import shutil
+import tempfile
+
+from pidservices.noids import encode_noid
+from pidservices.planner import TARGET_FIELDS
+from pidservices.workers import WorkerPool
+
+#: pid fields compared, as named in search results; the domain is
+#: compared by name, since domain URIs differ between instances
+PID_FIELDS = ['name', 'domain', 'ext_system', 'ext_system_key', 'policy']
+
+#: status of each kind of difference
+ADDED, REMOVED, CHANGED = 'added', 'removed', 'changed'
+
+
+class Difference(namedtuple('Difference', ['status', 'noid', 'qualifier', 'old', 'new'])):
+    '''A difference between two sets of pids.
+
+    - **status** - ``added`` (only in the new pids), ``removed`` (only in
+      the old pids) or ``changed``
+    - **noid** - pid noid
+    - **qualifier** - target qualifier (empty for the unqualified
+      target), or None for a difference in the pid itself
+    - **old** - dictionary of the old values of the fields that differ
+      (all compared fields, for a removed pid or target), or None if added
+    - **new** - dictionary of the new values, or None if removed
+    '''
+    __slots__ = ()
+
+    def describe(self):
+        'One-line description of the difference.'
+        if self.qualifier is None:
+            name = 'pid %s' % self.noid
+        else:
+            name = 'target %s%s' % (self.noid, '/%s' % self.qualifier if self.qualifier else '')
+        if self.status != CHANGED:
+            return '%s %s' % (self.status, name)
+        return '%s %s: %s' % (self.status, name,
+                              ', '.join('%s %r -> %r' % (field, self.old.get(field), value)
+                                        for field, value in sorted(self.new.items())))
+
+    def as_dict(self):
+        return dict(self._asdict())
+
+
+def search_source(client, workers=4, **search_opts):
+    '''Pids to compare from a search, as for
+    :meth:`~pidservices.clients.PidmanRestClient.iter_search_pids`.'''
+    return client.iter_search_pids(workers, **search_opts)
+
+
+def file_source(path):
+    '''Pids to compare from a snapshot file: JSON lines of pid
+    information, gzipped if the name ends in .gz.'''
+    if path.endswith('.gz'):
+        infile = io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8')
+    else:
+        infile = open(path, encoding='utf-8')
+    with infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+
+def pid_record(pid, pid_fields=PID_FIELDS, target_fields=TARGET_FIELDS):
+    '''The parts of pid information that are compared: a dictionary with
+    noid, pid fields, and target fields by qualifier.'''
+    return {
+        'noid': pid['pid'],
+        'fields': dict((field, pid.get(field)) for field in pid_fields),
+        'targets': dict((target.get('qualifier') or '',
+                         dict((field, target.get(field)) for field in target_fields))
+                        for target in pid.get('targets') or []),
+    }
+
+
+def compare_records(old, new):
+    '''Differences between two records from :func:`pid_record` for the
+    same pid, or for a pid on only one side (None for the other).
+
+    :returns: generator of :class:`Difference`
+    '''
+    if old is None or new is None:
+        record = new if old is None else old
+        status = ADDED if old is None else REMOVED
+        fields = dict(record['fields'], targets=len(record['targets']))
+        yield Difference(status, record['noid'], None,
+                         None if old is None else fields, None if new is None else fields)
+        return
+    noid = old['noid']
+    changed = sorted(field for field in set(old['fields']) | set(new['fields'])
+                     if old['fields'].get(field) != new['fields'].get(field))
+    if changed:
+        yield Difference(CHANGED, noid, None,
+                         dict((field, old['fields'].get(field)) for field in changed),
+                         dict((field, new['fields'].get(field)) for field in changed))
+    for qualifier in sorted(set(old['targets']) | set(new['targets'])):
+        old_target = old['targets'].get(qualifier)
+        new_target = new['targets'].get(qualifier)
+        if old_target is None:
+            yield Difference(ADDED, noid, qualifier, None, new_target)
+        elif new_target is None:
+            yield Difference(REMOVED, noid, qualifier, old_target, None)
+        else:
+            changed = sorted(field for field in old_target
+                             if old_target.get(field) != new_target.get(field))
+            if changed:
+                yield Difference(CHANGED, noid, qualifier,
+                                 dict((field, old_target.get(field)) for field in changed),
+                                 dict((field, new_target.get(field)) for field in changed))
+
+
+class DomainDiff(object):
+    '''Compare two sets of pids; see module documentation.  Iterating
+    yields :class:`Difference` in NOID order.
+
+    :param old: iterable of old pid dictionaries, as returned by a search
+        (e.g., :func:`search_source` or :func:`file_source`)
+    :param new: iterable of new pid dictionaries
+    :param pid_fields: pid fields to compare
+    :param target_fields: target fields to compare
+    :param chunk_size: number of pids from each side sorted in memory at
+        a time
+    :param tmpdir: directory for sorted chunks; defaults to the system
+        temporary directory
+    '''
+
+    def __init__(self, old, new, pid_fields=PID_FIELDS, target_fields=TARGET_FIELDS,
+                 chunk_size=100000, tmpdir=None):
+        self.old = old
+        self.new = new
+        self.pid_fields = pid_fields
+        self.target_fields = target_fields
+        self.chunk_size = chunk_size
+        self.tmpdir = tmpdir
+        #: number of pids read from each side, by ``old`` and ``new``
+        self.pids = Counter()
+        #: number of pids listed more than once on a side (the last is used)
+        self.duplicates = 0
+        #: number of differences found, by status and by pids or targets,
+        #: e.g. ``counts['added', 'pid']``
+        self.counts = Counter()
+
+    def _write_run(self, chunk, directory):
+        chunk.sort(key=itemgetter(0))
+        fd, path = tempfile.mkstemp(suffix='.jsonl', dir=directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as run:
+            for item in chunk:
+                run.write(json.dumps(item) + '\n')
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, encoding='utf-8') as run:
+            for line in run:
+                yield json.loads(line)
+
+    def _sort(self, side, pids, directory):
+        # sort one side's pids by encoded noid: a sorted list if they fit
+        # in one chunk, otherwise sorted runs written to temporary files
+        runs, chunk = [], []
+        for pid in pids:
+            record = pid_record(pid, self.pid_fields, self.target_fields)
+            chunk.append((encode_noid(record['noid']), record))
+            self.pids[side] += 1
+            if len(chunk) >= self.chunk_size:
+                runs.append(self._write_run(chunk, directory))
+                chunk = []
+        if not runs:
+            chunk.sort(key=itemgetter(0))
+            return chunk
+        if chunk:
+            runs.append(self._write_run(chunk, directory))
+        return runs
+
+    def _sorted(self, sorted_side):
+        if not sorted_side or not isinstance(sorted_side[0], str):
+            items = iter(sorted_side)
+        else:
+            items = heapq.merge(*[self._read_run(path) for path in sorted_side],
+                                key=itemgetter(0))
+        # keep the last of any records for the same noid
+        previous = None
+        for item in items:
+            if previous is not None:
+                if previous[0] == item[0]:
+                    self.duplicates += 1
+                else:
+                    yield previous
+            previous = item
+        if previous is not None:
+            yield previous
+
+    def __iter__(self):
+        directory = tempfile.mkdtemp(prefix='pidman-diff-', dir=self.tmpdir)
+        try:
+            # read and sort both sides at once
+            with WorkerPool(2) as pool:
+                old = pool.submit(self._sort, 'old', self.old, directory)
+                new = pool.submit(self._sort, 'new', self.new, directory)
+                old, new = old.result(), new.result()
+            old, new = self._sorted(old), self._sorted(new)
+            old_item, new_item = next(old, None), next(new, None)
+            while old_item is not None or new_item is not None:
+                if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+                    differences = compare_records(old_item[1], None)
+                    old_item = next(old, None)
+                elif old_item is None or new_item[0] < old_item[0]:
+                    differences = compare_records(None, new_item[1])
+                    new_item = next(new, None)
+                else:
+                    differences = compare_records(old_item[1], new_item[1])
+                    old_item, new_item = next(old, None), next(new, None)
+                for difference in differences:
+                    self.counts[difference.status,
+                                'pid' if difference.qualifier is None else 'target'] += 1
+                    yield difference
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def summary(self):
+        '''One-line summary of the differences found.'''
+        return ', '.join('%d %s %ss' % (self.counts[status, kind], status, kind)
+                         for status in (ADDED, REMOVED, CHANGED) for kind in ('pid', 'target'))
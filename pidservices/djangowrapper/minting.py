@@ -0,0 +1,283 @@
+'''
+*"Make hay while the sun shines."* - **John Heywood**
+
+Module contains a background minting queue, so that Django apps can
+assign a pid to a new object without waiting on the pidman server::
+
+    from pidservices.djangowrapper.minting import get_queue
+
+    def save(self, *args, **kwargs):
+        if not self.ark:
+            self.ark = get_queue().mint(self.get_absolute_url(), name=self.title)
+        super(Item, self).save(*args, **kwargs)
+
+The queue keeps a small stock of pids that have already been created with
+a placeholder target, and hands them out immediately.  The real target
+(and any pid details, like name) are set in the background with
+:meth:`~pidservices.clients.PidmanRestClient.update_target`, and the
+stock is replenished in the background when it runs low.
+
+Assignments that fail with a connection error, timeout or server error
+are retried; assignments that still fail are logged, recorded in
+:attr:`MintingQueue.failed` and passed to an optional ``on_failure``
+callback.  The shared queue from :meth:`get_queue` waits for background
+assignments to finish when the process exits; other queues should be
+closed (or used as a context manager) so that pids handed out are not
+left with their placeholder target.
+
+Django settings used by :meth:`get_queue`:
+
+* PIDMAN_DOMAIN - domain URI for new pids (required)
+* PIDMAN_PLACEHOLDER_TARGET - target URI for pids that have not been
+  assigned yet (required); may include
+  :attr:`~pidservices.clients.PidmanRestClient.pid_token`, e.g.
+  ``https://my.app/pending/{%PID%}``
+* PIDMAN_MINT_STOCK - number of pids to keep in stock (default 10)
+* PIDMAN_MINT_WORKERS - number of background API calls to run at once
+  (default 2)
+'''
+
+import atexit
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+from pidservices.clients import pid_noid
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+STOCK = 10
+WORKERS = 2
+
+
+class MintingQueue(object):
+    '''Hand out pre-allocated pids, assigning their targets in the
+    background.
+
+    With ``workers=1``, no background threads are used: targets are
+    updated and the stock replenished before :meth:`mint` returns, which
+    can be useful for debugging.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient` with
+        credentials to create and update pids
+    :param domain: domain URI for new pids
+    :param placeholder: target URI for pids in stock
+    :param type: type of pids to create (ark or purl)
+    :param stock: number of pids to keep in stock
+    :param low_water: replenish the stock when it falls below this number;
+        defaults to half of ``stock``
+    :param workers: number of background API calls to run at once
+    :param retries: number of times to retry assigning a pid after a
+        connection error, timeout or server error
+    :param retry_delay: seconds to wait before the first retry; doubled
+        for each further retry
+    :param on_failure: optional function called with the pid, target URI
+        and exception when assigning a pid fails, after any retries
+    '''
+
+    def __init__(self, client, domain, placeholder, type='ark', stock=STOCK,
+                 low_water=None, workers=WORKERS, retries=2, retry_delay=1,
+                 on_failure=None):
+        self.client = client
+        self.domain = domain
+        self.placeholder = placeholder
+        self.type = type
+        self.stock = stock
+        self.low_water = stock // 2 if low_water is None else low_water
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_failure = on_failure
+        self.pool = WorkerPool(workers)
+        #: list of (pid, target URI, error) for pids whose target or
+        #: details could not be updated
+        self.failed = []
+        self._pids = deque()
+        self._allocating = 0
+        self._tasks = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        'Number of pids currently in stock.'
+        return len(self._pids)
+
+    def _create(self):
+        from requests.exceptions import RequestException
+        try:
+            return self.client.create_templated_pid(self.type, self.domain, self.placeholder)
+        except RequestException as err:
+            if getattr(err, 'pid', None) is None:
+                raise
+            # the pid was created; its placeholder target is replaced
+            # when the pid is assigned, so it can still be handed out
+            logger.warning('Error updating placeholder target of %s: %s', err.pid, err)
+            return err.pid
+
+    def _allocate(self):
+        from requests.exceptions import RequestException
+        try:
+            pid = self._create()
+        except RequestException as err:
+            pid = None
+            logger.error('Error creating pid for minting queue: %s', err)
+        with self._lock:
+            self._allocating -= 1
+            if pid is not None:
+                self._pids.append(pid)
+
+    def _submit(self, func, *args):
+        task = self.pool.submit(func, *args)
+        with self._lock:
+            self._tasks = [t for t in self._tasks if not t.done()]
+            if not task.done():
+                self._tasks.append(task)
+
+    def replenish(self):
+        '''Start creating enough pids in the background to fill the stock,
+        counting any that are already being created.'''
+        with self._lock:
+            needed = self.stock - len(self._pids) - self._allocating
+            if needed <= 0:
+                return
+            self._allocating += needed
+        for i in range(needed):
+            self._submit(self._allocate)
+
+    @staticmethod
+    def _retryable(err):
+        # errors that may succeed if tried again
+        from requests.exceptions import ConnectionError, HTTPError, Timeout
+        if isinstance(err, (ConnectionError, Timeout)):
+            return True
+        response = getattr(err, 'response', None)
+        return isinstance(err, HTTPError) and response is not None and \
+            response.status_code >= 500
+
+    def _assign(self, pid, target_uri, pid_opts):
+        from requests.exceptions import RequestException
+        noid = pid_noid(pid)
+        target_uri = self.client.expand_pid_token(target_uri, noid)
+        for attempt in range(self.retries + 1):
+            try:
+                self.client.update_target(self.type, noid, target_uri=target_uri)
+                if pid_opts:
+                    self.client.update_pid(self.type, noid, **pid_opts)
+                return
+            except RequestException as err:
+                if attempt < self.retries and self._retryable(err):
+                    logger.warning('Error assigning pid %s to %s (retrying): %s',
+                                   pid, target_uri, err)
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                logger.error('Error assigning pid %s to %s: %s', pid, target_uri, err)
+                with self._lock:
+                    self.failed.append((pid, target_uri, err))
+                if self.on_failure is not None:
+                    self.on_failure(pid, target_uri, err)
+                return
+
+    def mint(self, target_uri, **pid_opts):
+        '''Get a pid for a new object.  A pid from the stock is returned
+        immediately (if the stock is empty, a new pid is created), and its
+        target is updated in the background.
+
+        :param target_uri: URI the pid should resolve to; may include
+            :attr:`~pidservices.clients.PidmanRestClient.pid_token`
+        :param pid_opts: optional pid details to update, as supported by
+            :meth:`~pidservices.clients.PidmanRestClient.update_pid`, e.g.
+            name or external_system_key
+        :returns: new pid, in resolvable form
+        '''
+        with self._lock:
+            pid = self._pids.popleft() if self._pids else None
+            low = len(self._pids) + self._allocating < self.low_water
+        if pid is None:
+            pid = self._create()
+            low = True
+        if low:
+            self.replenish()
+        self._submit(self._assign, pid, target_uri, pid_opts)
+        return pid
+
+    def join(self):
+        '''Wait for all background API calls to finish.'''
+        while True:
+            with self._lock:
+                tasks, self._tasks = self._tasks, []
+            if not tasks:
+                return
+            for task in tasks:
+                task.result()
+
+    def close(self):
+        '''Wait for background API calls to finish and stop the worker
+        threads.  Pids still in stock are left with their placeholder
+        target.'''
+        self.join()
+        self.pool.close()
+        if self.failed:
+            logger.error('%d pids handed out by the minting queue could not be '
+                         'assigned: %s', len(self.failed),
+                         ', '.join(pid for pid, target_uri, err in self.failed))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_queue = None
+_queue_pid = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    '''Get a :class:`MintingQueue` shared by the whole process, configured
+    from Django settings and using
+    :meth:`~pidservices.djangowrapper.shortcuts.get_client`.  The queue is
+    created (and starts filling its stock) on first use.  As with the
+    shared client, a forked child process gets its own queue, so the same
+    pid is never handed out by two processes.'''
+    global _queue, _queue_pid
+    queue = _queue
+    if queue is not None and _queue_pid == os.getpid():
+        return queue
+    with _queue_lock:
+        if _queue is None or _queue_pid != os.getpid():
+            from django.conf import settings
+            from pidservices.djangowrapper.shortcuts import get_client
+            try:
+                domain = settings.PIDMAN_DOMAIN
+                placeholder = settings.PIDMAN_PLACEHOLDER_TARGET
+            except AttributeError:
+                raise RuntimeError('Configuration Error!  PIDMAN_DOMAIN and '
+                    'PIDMAN_PLACEHOLDER_TARGET must be set in django settings '
+                    'to use the minting queue.')
+            queue = MintingQueue(get_client(), domain, placeholder,
+                stock=getattr(settings, 'PIDMAN_MINT_STOCK', STOCK),
+                workers=getattr(settings, 'PIDMAN_MINT_WORKERS', WORKERS))
+            queue.replenish()
+            _queue, _queue_pid = queue, os.getpid()
+        return _queue
+
+
+@atexit.register
+def _close_queue():
+    # finish assigning pids already handed out before the process exits;
+    # a forked child never closes its parent's queue
+    queue = _queue
+    if queue is not None and _queue_pid == os.getpid():
+        queue.close()
+
+
+def _after_fork():
+    global _queue, _queue_pid, _queue_lock
+    _queue_lock = threading.Lock()
+    # the parent's stock and worker threads don't belong to this process
+    _queue, _queue_pid = None, None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
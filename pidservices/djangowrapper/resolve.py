@@ -0,0 +1,143 @@
+'''
+*"Ask, and it shall be given you."* - **Matthew 7:7**
+
+Module contains helpers for resolving the ARKs of many Django objects at
+once, e.g. for a listing page, instead of calling
+:meth:`~pidservices.clients.PidmanRestClient.get_ark` once per object
+while rendering::
+
+    items = prefetch_arks(Item.objects.all()[:50], 'ark')
+    for item in items:
+        print(item.ark_info['name'])
+
+ARK information is cached with the Django cache framework, and ARKs that
+are not cached are requested concurrently using the shared client from
+:meth:`~pidservices.djangowrapper.shortcuts.get_client`.  ARKs that could
+not be retrieved are cached too, for a shorter time, so a broken ARK on a
+page isn't requested again every time the page is rendered.
+
+Optional Django settings:
+
+* PIDMAN_CACHE - name of the cache to use (default ``default``)
+* PIDMAN_CACHE_TIMEOUT - seconds to cache ARK information (default 300)
+* PIDMAN_CACHE_ERROR_TIMEOUT - seconds to remember that an ARK could not
+  be retrieved (default 60)
+* PIDMAN_WORKERS - number of ARKs to request concurrently (default 4)
+'''
+
+import logging
+
+from pidservices.clients import pid_noid
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'pidman:ark:%s'
+CACHE_TIMEOUT = 300
+CACHE_ERROR_TIMEOUT = 60
+# cached for ARKs that could not be retrieved (the cache returns None for
+# keys that aren't cached)
+NOT_FOUND = False
+WORKERS = 4
+
+
+def ark_noid(ark):
+    '''Get the noid for an ARK, in resolvable or short form (qualifiers are
+    ignored), or a bare noid; see
+    :func:`~pidservices.clients.pid_noid`.  Returns None for empty
+    values.'''
+    if not ark:
+        return None
+    return pid_noid(str(ark).strip())
+
+
+def _get_cache():
+    from django.conf import settings
+    from django.core.cache import caches
+    return caches[getattr(settings, 'PIDMAN_CACHE', 'default')]
+
+
+def resolve_arks(arks, client=None, workers=None):
+    '''Get information about a batch of ARKs with as few API calls as
+    possible: cached ARKs are looked up in a single cache request, and the
+    rest are requested concurrently and then cached.
+
+    :param arks: iterable of ARKs or noids; duplicates and empty values are
+        ignored
+    :param client: :class:`~pidservices.clients.PidmanRestClient` to use;
+        defaults to :meth:`~pidservices.djangowrapper.shortcuts.get_client`
+    :param workers: number of ARKs to request concurrently; defaults to the
+        PIDMAN_WORKERS setting
+    :returns: dictionary mapping noid to ARK information as returned by
+        :meth:`~pidservices.clients.PidmanRestClient.get_ark`, or None for
+        ARKs that could not be retrieved
+    '''
+    from django.conf import settings
+    noids = []
+    for ark in arks:
+        noid = ark_noid(ark)
+        if noid and noid not in noids:
+            noids.append(noid)
+    if not noids:
+        return {}
+
+    cache = _get_cache()
+    cached = cache.get_many([CACHE_KEY % noid for noid in noids])
+    info = dict((noid, cached.get(CACHE_KEY % noid)) for noid in noids)
+    missing = [noid for noid in noids if info[noid] is None]
+    for noid in noids:
+        if info[noid] is NOT_FOUND:
+            info[noid] = None
+    if not missing:
+        return info
+
+    if client is None:
+        from pidservices.djangowrapper.shortcuts import get_client
+        client = get_client()
+    if workers is None:
+        workers = getattr(settings, 'PIDMAN_WORKERS', WORKERS)
+
+    from requests.exceptions import RequestException
+
+    def get_ark(noid):
+        try:
+            return noid, client.get_ark(noid)
+        except RequestException as err:
+            # a broken link shouldn't break the page it is displayed on
+            logger.warning('Error retrieving ark %s: %s', noid, err)
+            return noid, None
+
+    found, not_found = {}, {}
+    with WorkerPool(min(workers, len(missing))) as pool:
+        for noid, ark_info in pool.imap(get_ark, missing, ordered=False):
+            info[noid] = ark_info
+            if ark_info is not None:
+                found[CACHE_KEY % noid] = ark_info
+            else:
+                not_found[CACHE_KEY % noid] = NOT_FOUND
+    if found:
+        cache.set_many(found, getattr(settings, 'PIDMAN_CACHE_TIMEOUT', CACHE_TIMEOUT))
+    if not_found:
+        cache.set_many(not_found, getattr(settings, 'PIDMAN_CACHE_ERROR_TIMEOUT',
+                                          CACHE_ERROR_TIMEOUT))
+    return info
+
+
+def prefetch_arks(objects, attr='ark', to_attr='ark_info', client=None, workers=None):
+    '''Resolve the ARKs for a list or queryset of objects in one batch (see
+    :meth:`resolve_arks`), and store the ARK information on each object.
+    Like :meth:`~django.db.models.query.QuerySet.prefetch_related`, this
+    replaces one pidman API call per object with a single batch lookup.
+
+    :param objects: list or queryset of objects
+    :param attr: name of the attribute with the ARK or noid for each object
+    :param to_attr: name of the attribute to set with the ARK information
+        (None if the object has no ARK or it could not be retrieved)
+    :returns: list of objects
+    '''
+    objects = list(objects)
+    info = resolve_arks([getattr(obj, attr, None) for obj in objects],
+                        client=client, workers=workers)
+    for obj in objects:
+        setattr(obj, to_attr, info.get(ark_noid(getattr(obj, attr, None))))
+    return objects
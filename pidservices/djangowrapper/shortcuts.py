@@ -1,10 +1,14 @@
 # To change this template, choose Tools | Templates
 # and open the template in the editor.
 
-from django.conf import settings
+import os
+import threading
 
 from pidservices.clients import PidmanRestClient
 
+# default number of connections to keep open to the pidman server
+POOL_SIZE = 10
+
 class DjangoPidmanRestClient(PidmanRestClient):
     """
     Wraps :class:`PidmanRestClient` to use Pidman host and connection
@@ -18,15 +22,26 @@ class DjangoPidmanRestClient(PidmanRestClient):
                 ``http://pid.emory.edu/`` 
            * PIDMAN_USER = '' # Username for authentication to the pidman app.
            * PIDMAN_PASSWORD = '' # Pasword for username above.
+
+           Optionally, PIDMAN_POOL_SIZE may be set to the number of
+           connections to keep open to the pidman server (default 10), and
+           PIDMAN_SLOW_REQUEST to a number of seconds, to record request
+           times (see :mod:`pidservices.metrics`) and log slower requests.
            
     """
 
     def __init__(self):
+        # imported here so importing this module doesn't load django
+        from django.conf import settings
         try:
             baseurl = settings.PIDMAN_HOST
             username = settings.PIDMAN_USER
             password = settings.PIDMAN_PASSWORD
             super(DjangoPidmanRestClient, self).__init__(baseurl, username, password)
+            slow = getattr(settings, 'PIDMAN_SLOW_REQUEST', None)
+            if slow is not None:
+                from pidservices.metrics import ClientMetrics
+                self.metrics = ClientMetrics(slow=slow)
         except AttributeError: # Raise error if values do not exist.
             errmsg = """
             Configuration Error!  The following values must be set in django 
@@ -34,4 +49,62 @@ class DjangoPidmanRestClient(PidmanRestClient):
 
             See pidmanclient documentation for more information.
             """
-            raise RuntimeError(errmsg)
\ No newline at end of file
+            raise RuntimeError(errmsg)
+
+    def _new_session(self):
+        from django.conf import settings
+        import requests
+        session = super(DjangoPidmanRestClient, self)._new_session()
+        # keep enough connections open for all the threads of a web server
+        pool_size = getattr(settings, 'PIDMAN_POOL_SIZE', POOL_SIZE)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    '''Get a :class:`DjangoPidmanRestClient` shared by the whole process,
+    so that views can reuse open connections to the pidman server instead
+    of creating a new client (and session) for every request.  The client
+    is created on first use, and is safe to use from multiple threads.
+
+    Each process gets its own client: after a fork (e.g., gunicorn or uwsgi
+    worker processes started from a preloaded application), the child
+    creates a new client rather than sharing connections with its parent.
+    '''
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = DjangoPidmanRestClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+def reset_client():
+    '''Discard the shared client, e.g. after changing pidman settings; a new
+    one is created on the next call to :meth:`get_client`.'''
+    global _client, _client_pid
+    with _client_lock:
+        _client = None
+        _client_pid = None
+
+
+def _after_fork():
+    # the lock may have been held by another thread when the process forked
+    global _client_lock
+    _client_lock = threading.Lock()
+    reset_client()
+
+# the process id check in get_client covers platforms without register_at_fork
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,39 @@
+'''
+*"Forewarned is forearmed."* - **Proverb**
+
+Template tags for displaying pid information; add
+``pidservices.djangowrapper`` to INSTALLED_APPS to use them.  Resolve all
+the ARKs for a listing in one batch before the loop that displays them::
+
+    {% load pidman %}
+    {% prefetch_arks object_list 'ark' %}
+    {% for obj in object_list %}
+        {{ obj.ark_info.name }}
+    {% endfor %}
+
+ARK information is cached (see :mod:`pidservices.djangowrapper.resolve`),
+so the ``ark_info`` filter, e.g. ``{{ obj.ark|ark_info }}``, makes no API
+calls for ARKs that have already been prefetched.
+'''
+
+from django import template
+
+from pidservices.djangowrapper.resolve import ark_noid, prefetch_arks as _prefetch_arks, \
+    resolve_arks
+
+register = template.Library()
+
+
+@register.simple_tag
+def prefetch_arks(objects, attr='ark', to_attr='ark_info'):
+    '''Resolve the ARKs for a list or queryset of objects in one batch,
+    storing the ARK information on each object as ``to_attr``.  Outputs
+    nothing.'''
+    _prefetch_arks(objects, attr, to_attr)
+    return ''
+
+
+@register.filter
+def ark_info(ark):
+    '''Information about a single ARK or noid (None if not found).'''
+    return resolve_arks([ark]).get(ark_noid(ark))
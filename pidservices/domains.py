@@ -0,0 +1,184 @@
+'''
+*"A place for everything, and everything in its place."* - **Samuel Smiles**
+
+Module contains :class:`DomainTree`, a local cache of the Pid Manager's
+domains and their hierarchy, built from
+:meth:`~pidservices.clients.PidmanRestClient.list_domains`.  Every client
+has one, as :attr:`PidmanRestClient.domains
+<pidservices.clients.PidmanRestClient.domains>`::
+
+    domain = client.domains.get('Rushdie Collection')
+    print(domain.uri, domain.id)
+    for subdomain in client.domains.descendants(domain):
+        ...
+
+Domains can be looked up by URI, numeric id or (unique) name without any
+further API requests.  The cache is refreshed when it is older than its
+time-to-live, and after the client creates or updates a domain.
+
+Domains may be listed by the API either as a flat list with ``parent``
+URIs, or as top-level domains with nested ``collections`` (or
+``subdomains``); both are understood.
+'''
+
+from collections import namedtuple
+import re
+import threading
+import time
+
+_ID_REGEXP = re.compile(r'/domains/(?P<id>[^/]+)/?$')
+
+
+class DomainNotFound(KeyError):
+    '''Raised when a domain can't be found, or a domain name matches more
+    than one domain.'''
+
+    def __str__(self):
+        return self.args[0] if self.args else ''
+
+
+class Domain(namedtuple('Domain', ['id', 'uri', 'name', 'policy', 'parent'])):
+    '''A Pid Manager domain: id, URI, name, policy, and parent domain
+    URI (None for a top-level domain).'''
+    __slots__ = ()
+
+
+class DomainTree(object):
+    '''Cached index of domains and their parent/child relations.  Safe to
+    use from multiple threads.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param ttl: seconds before the cache is refreshed; None to keep it
+        until :meth:`invalidate` is called
+    '''
+
+    def __init__(self, client, ttl=300):
+        self.client = client
+        self.ttl = ttl
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._by_uri = {}
+        self._by_id = {}
+        self._by_name = {}
+        self._children = {}
+
+    def invalidate(self):
+        '''Discard the cache; domains are listed again on next use.'''
+        self._loaded = None
+
+    def refresh(self):
+        '''List domains from the API and rebuild the cache.'''
+        by_uri, by_id, by_name, children = {}, {}, {}, {}
+
+        def add(info, parent=None):
+            uri = info.get('uri')
+            id = info.get('id')
+            if id is None and uri:
+                match = _ID_REGEXP.search(uri)
+                id = match.group('id') if match else None
+            domain = Domain(str(id) if id is not None else None, uri, info.get('name'),
+                            info.get('policy'), info.get('parent') or parent)
+            by_uri[uri] = domain
+            if domain.id is not None:
+                by_id[domain.id] = domain
+            by_name.setdefault(domain.name, []).append(domain)
+            for subdomain in info.get('collections') or info.get('subdomains') or []:
+                add(subdomain, uri)
+
+        for info in self.client.list_domains():
+            add(info)
+        for domain in by_uri.values():
+            children.setdefault(domain.parent, []).append(domain)
+        with self._lock:
+            self._by_uri, self._by_id, self._by_name, self._children = \
+                by_uri, by_id, by_name, children
+            self._loaded = time.time()
+
+    def _check(self):
+        loaded = self._loaded
+        if loaded is None or (self.ttl is not None and time.time() - loaded > self.ttl):
+            self.refresh()
+
+    def get(self, domain):
+        '''Look up a domain.
+
+        :param domain: domain URI (with or without a trailing slash), id
+            (number or string of digits), name, or :class:`Domain`
+        :returns: :class:`Domain`
+        :raises DomainNotFound: if there is no such domain, or more than
+            one domain has the name
+        '''
+        if isinstance(domain, Domain):
+            return domain
+        self._check()
+        key = str(domain)
+        if key in self._by_uri:
+            return self._by_uri[key]
+        if key in self._by_id:
+            return self._by_id[key]
+        match = _ID_REGEXP.search(key)
+        if match:
+            # a URI written differently, e.g. without the trailing slash
+            for uri in (key.rstrip('/'), key.rstrip('/') + '/'):
+                if uri in self._by_uri:
+                    return self._by_uri[uri]
+            if match.group('id') in self._by_id:
+                return self._by_id[match.group('id')]
+        matches = self._by_name.get(key)
+        if not matches:
+            raise DomainNotFound('Domain %s not found' % key)
+        if len(matches) > 1:
+            raise DomainNotFound('Domain name %s is ambiguous (%s)' %
+                                 (key, ', '.join(d.uri for d in matches)))
+        return matches[0]
+
+    def __contains__(self, domain):
+        try:
+            self.get(domain)
+        except DomainNotFound:
+            return False
+        return True
+
+    def __iter__(self):
+        'All domains.'
+        self._check()
+        return iter(list(self._by_uri.values()))
+
+    def __len__(self):
+        self._check()
+        return len(self._by_uri)
+
+    def uri(self, domain):
+        'URI of a domain; see :meth:`get`.'
+        return self.get(domain).uri
+
+    def parent(self, domain):
+        'Parent :class:`Domain`, or None for a top-level domain.'
+        parent = self.get(domain).parent
+        return self._by_uri.get(parent) if parent is not None else None
+
+    def children(self, domain=None):
+        '''Direct subdomains of a domain, or top-level domains if domain
+        is None.'''
+        self._check()
+        uri = self.get(domain).uri if domain is not None else None
+        return list(self._children.get(uri, []))
+
+    def descendants(self, domain):
+        'All subdomains of a domain, at any depth (parents first).'
+        found = []
+        queue = self.children(domain)
+        while queue:
+            subdomain = queue.pop(0)
+            found.append(subdomain)
+            queue.extend(self._children.get(subdomain.uri, []))
+        return found
+
+    def ancestors(self, domain):
+        'Parent, grandparent, etc. of a domain, nearest first.'
+        found = []
+        parent = self.parent(domain)
+        while parent is not None and parent not in found:
+            found.append(parent)
+            parent = self._by_uri.get(parent.parent) if parent.parent else None
+        return found
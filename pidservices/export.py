@@ -0,0 +1,232 @@
+'''
+*"The palest ink is better than the best memory."* - **Chinese proverb**
+
+Module contains functions for exporting an inventory of pids and their
+targets (e.g., all the pids in a domain) to a file, one row per target.
+
+Search results are requested a page at a time, with pages fetched
+concurrently and written out as they arrive, so memory use is bounded by
+the number of pages in flight rather than the size of the domain.
+Supported output formats are CSV, JSON lines, and (if `pyarrow
+<http://arrow.apache.org/>`_ is installed) Parquet.  Text formats can
+optionally be gzip or bzip2 compressed.
+'''
+
+import bz2
+import csv
+import gzip
+import io
+import json
+import sys
+
+# pid-level and target-level fields included in an export by default
+PID_FIELDS = ['pid', 'name', 'domain', 'ext_system', 'ext_system_key', 'policy']
+TARGET_FIELDS = ['qualifier', 'target_uri', 'access_uri', 'proxy', 'active']
+DEFAULT_FIELDS = PID_FIELDS + TARGET_FIELDS
+
+# default number of pids to request per page of search results
+PAGE_SIZE = 5000
+
+FORMATS = ['csv', 'jsonl', 'parquet']
+COMPRESSION = ['gzip', 'bz2']
+
+
+def pid_rows(pid, fields=DEFAULT_FIELDS):
+    '''Flatten a pid, as returned by
+    :meth:`~pidservices.clients.PidmanRestClient.search_pids`, into one
+    row per target.  A pid with no targets results in a single row with
+    empty target fields.
+
+    :param pid: dictionary of pid information
+    :param fields: list of fields to include in each row
+    :returns: list of dictionaries
+    '''
+    base = dict((field, pid.get(field)) for field in fields
+                if field not in TARGET_FIELDS)
+    targets = pid.get('targets') or [{}]
+    rows = []
+    for target in targets:
+        row = base.copy()
+        for field in fields:
+            if field in TARGET_FIELDS:
+                row[field] = target.get(field)
+        rows.append(row)
+    return rows
+
+
+def open_output(path, compression=None):
+    '''Open a UTF-8 text output file for writing, optionally compressed.
+    Gzip output is written without a timestamp in the header, so exporting
+    the same data twice results in identical files.
+
+    :param path: file name, or ``-`` for standard output
+    :param compression: None, ``gzip`` or ``bz2``
+    '''
+    if compression is not None and compression not in COMPRESSION:
+        raise Exception("Compression '%s' is not supported" % compression)
+
+    if path == '-':
+        if compression == 'gzip':
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer,
+                mode='wb', mtime=0), encoding='utf-8', newline='')
+        if compression == 'bz2':
+            raise Exception('bz2 compression is not supported for standard output')
+        return sys.stdout
+
+    if compression == 'gzip':
+        return io.TextIOWrapper(gzip.GzipFile(path, mode='wb', mtime=0),
+                                encoding='utf-8', newline='')
+    if compression == 'bz2':
+        return bz2.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+class CsvWriter(object):
+    '''Write export rows as CSV, with a header row.'''
+
+    def __init__(self, fileobj, fields=DEFAULT_FIELDS):
+        self.fileobj = fileobj
+        self.fields = fields
+        self.writer = csv.DictWriter(fileobj, fields)
+        self.writer.writerow(dict((f, f) for f in fields))
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        if self.fileobj is not sys.stdout:
+            self.fileobj.close()
+
+
+class JsonLinesWriter(object):
+    '''Write export rows as JSON lines, one JSON object per row, with
+    keys sorted for reproducible output.'''
+
+    def __init__(self, fileobj, fields=DEFAULT_FIELDS):
+        self.fileobj = fileobj
+        self.fields = fields
+
+    def writerows(self, rows):
+        for row in rows:
+            self.fileobj.write(json.dumps(row, sort_keys=True))
+            self.fileobj.write('\n')
+
+    def close(self):
+        if self.fileobj is not sys.stdout:
+            self.fileobj.close()
+
+
+class ParquetWriter(object):
+    '''Write export rows to a Parquet file.  Rows are buffered by column
+    and written out one row group at a time, so no more than
+    ``row_group_size`` rows are held in memory.  Requires :mod:`pyarrow`.
+
+    :param path: output file name
+    :param fields: list of fields (columns) to write
+    :param compression: Parquet compression codec, e.g. ``snappy`` or
+        ``gzip``
+    :param row_group_size: number of rows to buffer per row group
+    '''
+
+    def __init__(self, path, fields=DEFAULT_FIELDS, compression=None,
+                 row_group_size=100000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception('Parquet export requires pyarrow')
+        self.pyarrow = pyarrow
+        self.fields = fields
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([
+            (field, pyarrow.bool_() if field == 'active' else pyarrow.string())
+            for field in fields])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema,
+            compression=compression or 'none')
+        self._reset()
+
+    def _reset(self):
+        self.columns = dict((field, []) for field in self.fields)
+        self.buffered = 0
+
+    def writerows(self, rows):
+        for row in rows:
+            for field in self.fields:
+                self.columns[field].append(row.get(field))
+            self.buffered += 1
+            if self.buffered >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        table = self.pyarrow.Table.from_arrays(
+            [self.pyarrow.array(self.columns[field], type=self.schema.field(field).type)
+             for field in self.fields],
+            schema=self.schema)
+        self.writer.write_table(table)
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def get_writer(format, path, fields=DEFAULT_FIELDS, compression=None):
+    '''Initialize an export writer for the requested format.
+
+    :param format: one of :data:`FORMATS`
+    :param path: output file name, or ``-`` for standard output (not
+        supported for Parquet)
+    :param fields: list of fields to write
+    :param compression: for text formats, one of :data:`COMPRESSION`; for
+        Parquet, a Parquet compression codec
+    '''
+    if format == 'parquet':
+        if path == '-':
+            raise Exception('Parquet export requires an output file')
+        return ParquetWriter(path, fields, compression)
+    if format == 'csv':
+        return CsvWriter(open_output(path, compression), fields)
+    if format == 'jsonl':
+        return JsonLinesWriter(open_output(path, compression), fields)
+    raise Exception("Export format '%s' is not recognized" % format)
+
+
+def export_pids(client, path, format='csv', compression=None, fields=None,
+                workers=4, count=PAGE_SIZE, progress=None, **search_opts):
+    '''Export all pids matching a search to a file, one row per target.
+    Search options are passed to
+    :meth:`~pidservices.clients.PidmanRestClient.iter_search_pages`, e.g.::
+
+        export_pids(client, 'rushdie.csv.gz', compression='gzip',
+                    domain='Rushdie Collection', type='ark')
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param path: output file name, or ``-`` for standard output
+    :param format: output format; one of :data:`FORMATS`
+    :param compression: output compression; see :meth:`get_writer`
+    :param fields: list of fields to include; defaults to
+        :data:`DEFAULT_FIELDS`
+    :param workers: number of pages of search results to request
+        concurrently
+    :param count: number of pids to request per page
+    :param progress: optional
+        :class:`~pidservices.progress.ProgressReporter`, updated with the
+        number of pids exported
+    :returns: number of rows written
+    '''
+    fields = fields or DEFAULT_FIELDS
+    writer = get_writer(format, path, fields, compression)
+    total = 0
+    try:
+        for results in client.iter_search_pages(workers, progress=progress, count=count,
+                                                **search_opts):
+            rows = []
+            for pid in results:
+                rows.extend(pid_rows(pid, fields))
+            writer.writerows(rows)
+            total += len(rows)
+    finally:
+        writer.close()
+    return total
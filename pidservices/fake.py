@@ -0,0 +1,370 @@
+'''
+*"If it looks like a duck, and quacks like a duck, we have at least to
+consider the possibility that we have a small aquatic bird."* - **Douglas Adams**
+
+Module contains :class:`FakePidman`, an in-memory implementation of the
+Pid Manager REST API, used as a client transport (see
+:mod:`pidservices.transports`)::
+
+    fake = FakePidman()
+    client = PidmanRestClient(fake.url, 'user', 'pass', transport=fake)
+    domain = client.create_domain('Test')
+    ark = client.create_ark(domain, 'http://example.com/item/1')
+
+The fake supports domains, ARKs with qualified targets, PURLs, and
+paginated pid searches, with the same URLs, status codes and response
+formats as the Pid Manager, but without any networking; requests are
+answered at memory speed.  This makes it possible to test and benchmark
+bulk features (imports, exports, pid pools) with many thousands of pids.
+Large data sets can be loaded directly with :meth:`FakePidman.add_pid`.
+
+Only the behavior the client relies on is implemented: there are no
+users or permissions (any credentials are accepted for changes, unless
+specific ones are required), policies and proxies are stored as given,
+and pids are never deleted.
+'''
+
+from collections import Counter, OrderedDict
+import json
+import threading
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from pidservices.clients import NOID_CHARACTERS
+from pidservices.transports import Response, Transport
+
+
+class FakePidman(Transport):
+    '''In-memory Pid Manager, used as a transport by
+    :class:`~pidservices.clients.PidmanRestClient`.  Safe to use from
+    multiple threads.
+
+    :param url: base URL of the fake API; requests for other URLs get a 404
+    :param credentials: optional tuple of username and password required
+        for changes; by default, any credentials are accepted
+    :param resolver: base URL of the resolver for new pids
+    :param naan: Name Assigning Authority Number for new ARKs
+    :param page_size: default number of search results per page
+    :param max_page_size: optional maximum number of search results per page
+    '''
+
+    def __init__(self, url='http://pidman.example.com/', credentials=None,
+                 resolver='http://pid.example.com/', naan='25593', page_size=10,
+                 max_page_size=None):
+        self.url = url.rstrip('/') + '/'
+        self.credentials = credentials
+        self.resolver = resolver.rstrip('/') + '/'
+        self.naan = naan
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        #: number of requests answered, by HTTP method
+        self.requests = Counter()
+        self.domains = OrderedDict()
+        #: pids keyed by type and noid, in the order they were created
+        self.pids = OrderedDict()
+        self._minted = 0
+        self._base = urlparse(self.url)
+        # search results are cached until the next change
+        self._version = 0
+        self._searches = {}
+        self._lock = threading.RLock()
+
+    # data access, also used to load test data directly
+
+    def mint(self):
+        '''Generate a new noid.  Noids are sequential, so results are
+        repeatable, and are shared by ARKs and PURLs, as in the Pid Manager.'''
+        with self._lock:
+            self._minted += 1
+            n = self._minted + len(NOID_CHARACTERS) ** 2
+        noid = ''
+        while n:
+            n, digit = divmod(n, len(NOID_CHARACTERS))
+            noid = NOID_CHARACTERS[digit] + noid
+        return noid
+
+    def domain_uri(self, id):
+        return '%sdomains/%s/' % (self.url, id)
+
+    def add_domain(self, name, policy=None, parent=None):
+        '''Add a domain.
+
+        :param parent: optional URI of the parent domain
+        :returns: URI of the new domain
+        '''
+        with self._lock:
+            if parent is not None and self._find_domain(parent) is None:
+                raise ValueError('Parent domain %s not found' % parent)
+            id = len(self.domains) + 1
+            self.domains[id] = {'id': id, 'uri': self.domain_uri(id), 'name': name,
+                                'policy': policy, 'parent': parent}
+            self._changed()
+            return self.domain_uri(id)
+
+    def _find_domain(self, uri):
+        for domain in self.domains.values():
+            if domain['uri'] == uri:
+                return domain
+
+    def add_pid(self, type, domain, target_uri, name=None, external_system=None,
+                external_system_key=None, policy=None, proxy=None, qualifier=''):
+        '''Add a pid with a single target.
+
+        :param type: ark or purl
+        :param domain: domain URI
+        :returns: noid of the new pid
+        '''
+        if type not in ('ark', 'purl'):
+            raise ValueError('Pid type %r is not recognized' % type)
+        with self._lock:
+            if self._find_domain(domain) is None:
+                raise ValueError('Domain %s not found' % domain)
+            noid = self.mint()
+            self.pids[(type, noid)] = {
+                'type': type, 'noid': noid, 'domain': domain, 'name': name,
+                'ext_system': external_system, 'ext_system_key': external_system_key,
+                'policy': policy,
+                'targets': OrderedDict([(qualifier or '', {
+                    'target_uri': target_uri, 'proxy': proxy, 'active': True})]),
+            }
+            self._changed()
+            return noid
+
+    def _changed(self):
+        self._version += 1
+        self._searches = {}
+
+    def pid_uri(self, type, noid, qualifier=''):
+        'Resolvable form of a pid or target.'
+        if type == 'ark':
+            uri = '%sark:/%s/%s' % (self.resolver, self.naan, noid)
+            return '%s/%s' % (uri, qualifier) if qualifier else uri
+        return '%s%s' % (self.resolver, noid)
+
+    def pid_data(self, pid):
+        'Pid information in the format returned by the API.'
+        domain = self._find_domain(pid['domain'])
+        return {
+            'pid': pid['noid'],
+            'uri': self.pid_uri(pid['type'], pid['noid']),
+            'name': pid['name'],
+            'domain': domain['name'],
+            'domain_uri': domain['uri'],
+            'ext_system': pid['ext_system'],
+            'ext_system_key': pid['ext_system_key'],
+            'policy': pid['policy'],
+            'targets': [self.target_data(pid, qualifier) for qualifier in pid['targets']],
+        }
+
+    def target_data(self, pid, qualifier):
+        'Target information in the format returned by the API.'
+        target = pid['targets'][qualifier]
+        return {
+            'qualifier': qualifier,
+            'target_uri': target['target_uri'],
+            'access_uri': self.pid_uri(pid['type'], pid['noid'], qualifier),
+            'proxy': target['proxy'],
+            'active': target['active'],
+        }
+
+    # transport
+
+    def request(self, method, url, headers=None, params=None, data=None, auth=None):
+        parsed = urlparse(url)
+        params = dict(params or {}, **dict(parse_qsl(parsed.query)))
+        with self._lock:
+            self.requests[method] += 1
+            if (parsed.scheme, parsed.netloc) != (self._base.scheme, self._base.netloc) \
+                    or not parsed.path.startswith(self._base.path):
+                status, body = 404, 'Not Found'
+            elif method in ('PUT', 'POST', 'DELETE') and not self._authorized(auth):
+                status, body = 401, 'Authorization Required'
+            else:
+                path = parsed.path[len(self._base.path):]
+                try:
+                    status, body = self._route(method, path, params, data)
+                except _Error as err:
+                    status, body = err.args
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return Response(status, body, url=url)
+
+    def _authorized(self, auth):
+        if self.credentials is None:
+            return auth is not None
+        return tuple(auth or ()) == tuple(self.credentials)
+
+    def _route(self, method, path, params, data):
+        parts = path.split('/')
+        if parts[0] == 'domains':
+            if parts[1:] == ['']:
+                return self._domains(method, data)
+            if len(parts) == 3 and parts[2] == '':
+                return self._domain(method, parts[1], data)
+        elif parts == ['pids', '']:
+            if method != 'GET':
+                raise _Error(405, 'Method Not Allowed')
+            return self._search(params)
+        elif parts[0] in ('ark', 'purl'):
+            if parts[1:] == ['']:
+                if method != 'POST':
+                    raise _Error(405, 'Method Not Allowed')
+                return self._create(parts[0], data)
+            if len(parts) == 2:
+                return self._pid(method, parts[0], parts[1], data)
+            return self._target(method, parts[0], parts[1], '/'.join(parts[2:]), data)
+        raise _Error(404, 'Not Found')
+
+    def _domains(self, method, data):
+        if method == 'GET':
+            return 200, list(self.domains.values())
+        if method != 'POST':
+            raise _Error(405, 'Method Not Allowed')
+        data = data or {}
+        if not data.get('name'):
+            raise _Error(400, 'Error: name is required')
+        try:
+            uri = self.add_domain(data['name'], data.get('policy'), data.get('parent'))
+        except ValueError as err:
+            raise _Error(400, 'Error: %s' % err)
+        return 201, uri
+
+    def _domain(self, method, id, data):
+        try:
+            domain = self.domains[int(id)]
+        except (ValueError, KeyError):
+            raise _Error(404, 'Domain not found')
+        if method == 'GET':
+            return 200, domain
+        if method != 'PUT':
+            raise _Error(405, 'Method Not Allowed')
+        info = _json(data)
+        parent = info.get('parent')
+        if parent is not None and (parent == domain['uri'] or self._find_domain(parent) is None):
+            raise _Error(400, 'Error: Parent domain %s not valid' % parent)
+        for field in ('name', 'policy', 'parent'):
+            if field in info:
+                domain[field] = info[field]
+        self._changed()
+        return 200, domain
+
+    def _search(self, params):
+        try:
+            page = int(params.get('page') or 1)
+            count = int(params.get('count') or self.page_size)
+        except ValueError:
+            raise _Error(400, 'Error: page and count must be numbers')
+        if self.max_page_size:
+            count = min(count, self.max_page_size)
+        filters = tuple((key, params.get(key))
+                        for key in ('pid', 'type', 'target', 'domain', 'domain_uri'))
+        results = self._searches.get(filters)
+        if results is None:
+            results = self._searches[filters] = [pid for pid in self.pids.values()
+                                                 if self._matches(pid, dict(filters))]
+        page_count = max(1, (len(results) + count - 1) // count)
+        if page < 1 or page > page_count:
+            raise _Error(404, 'Page not found')
+        query = [(key, val) for key, val in filters if val] + [('count', count)]
+        link = '%spids/?%s&page=' % (self.url, urlencode(query))
+        start = (page - 1) * count
+        return 200, {
+            'results_count': len(results),
+            'page': page,
+            'page_count': page_count,
+            'first_page_link': '%s1' % link,
+            'last_page_link': '%s%d' % (link, page_count),
+            'results': [self.pid_data(pid) for pid in results[start:start + count]],
+        }
+
+    def _matches(self, pid, filters):
+        if filters['pid'] and pid['noid'] != filters['pid']:
+            return False
+        if filters['type'] and pid['type'] != filters['type'].lower():
+            return False
+        if filters['domain_uri'] and pid['domain'] != filters['domain_uri']:
+            return False
+        if filters['domain'] and self._find_domain(pid['domain'])['name'] != filters['domain']:
+            return False
+        if filters['target'] and filters['target'] not in \
+                [target['target_uri'] for target in pid['targets'].values()]:
+            return False
+        return True
+
+    def _create(self, type, data):
+        data = data or {}
+        if not data.get('target_uri'):
+            raise _Error(400, 'Error: target_uri is required')
+        if type == 'purl' and data.get('qualifier'):
+            raise _Error(400, 'Error: PURLs do not support qualifiers')
+        if self._find_domain(data.get('domain')) is None:
+            raise _Error(400, 'Error: Could not resolve domain URI %s' % data.get('domain'))
+        noid = self.add_pid(type, data['domain'], data['target_uri'], data.get('name'),
+                            data.get('external_system_id'), data.get('external_system_key'),
+                            data.get('policy'), data.get('proxy'), data.get('qualifier'))
+        return 201, self.pid_uri(type, noid, data.get('qualifier') or '')
+
+    def _get_pid(self, type, noid):
+        try:
+            return self.pids[(type, noid)]
+        except KeyError:
+            raise _Error(404, '%s %s not found' % (type.upper(), noid))
+
+    def _pid(self, method, type, noid, data):
+        pid = self._get_pid(type, noid)
+        if method == 'PUT':
+            info = _json(data)
+            if 'domain' in info and self._find_domain(info['domain']) is None:
+                raise _Error(400, 'Error: Could not resolve domain URI %s' % info['domain'])
+            for field, key in (('domain', 'domain'), ('name', 'name'),
+                               ('external_system_id', 'ext_system'),
+                               ('external_system_key', 'ext_system_key'),
+                               ('policy', 'policy')):
+                if field in info:
+                    pid[key] = info[field]
+            self._changed()
+        elif method != 'GET':
+            raise _Error(405, 'Method Not Allowed')
+        return 200, self.pid_data(pid)
+
+    def _target(self, method, type, noid, qualifier, data):
+        pid = self._get_pid(type, noid)
+        if type == 'purl' and qualifier:
+            raise _Error(404, 'PURLs do not support qualifiers')
+        exists = qualifier in pid['targets']
+        if method == 'GET':
+            if not exists:
+                raise _Error(404, 'Target not found')
+            return 200, self.target_data(pid, qualifier)
+        if method == 'DELETE':
+            if type == 'purl':
+                raise _Error(405, 'Method Not Allowed')
+            if not exists:
+                raise _Error(404, 'Target not found')
+            del pid['targets'][qualifier]
+            self._changed()
+            return 200, ''
+        if method != 'PUT':
+            raise _Error(405, 'Method Not Allowed')
+        info = _json(data)
+        if not exists:
+            if type == 'purl':
+                raise _Error(404, 'Target not found')
+            pid['targets'][qualifier] = {'target_uri': None, 'proxy': None, 'active': True}
+        target = pid['targets'][qualifier]
+        for field in ('target_uri', 'proxy', 'active'):
+            if field in info:
+                target[field] = info[field]
+        self._changed()
+        return 200 if exists else 201, self.target_data(pid, qualifier)
+
+
+class _Error(Exception):
+    # error response: status code and message
+    pass
+
+
+def _json(data):
+    try:
+        return json.loads(data or '{}')
+    except ValueError:
+        raise _Error(400, 'Error: request body is not valid JSON')
@@ -0,0 +1,250 @@
+'''
+*"Well begun is half done."* - **Aristotle**
+
+Module contains a bulk importer for creating pids from a manifest file.
+
+A manifest is a CSV or JSON lines file with one pid per row.  Recognized
+fields are ``target_uri`` (required), ``name``, ``external_system_key``,
+``domain`` (overrides the importer default) and qualified ARK targets.
+In a JSON lines manifest, qualified targets are given as a ``qualifiers``
+object mapping qualifier to target URI; in a CSV manifest, as columns
+named ``qualifier:<qualifier>``::
+
+    name,target_uri,external_system_key,qualifier:PDF
+    Letter 1,http://example.com/1,ms-1,http://example.com/1.pdf
+
+Rows are created concurrently, and each row is written to an output
+manifest (with the ``pid`` and resolvable ``uri`` that were assigned) as
+soon as it is done.  If an import is interrupted, running it again with
+the same output manifest skips the rows that were already created.
+'''
+
+import csv
+import json
+import logging
+import os
+import time
+
+from pidservices.clients import pid_noid
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# prefix for CSV manifest columns with qualified target URIs
+QUALIFIER_PREFIX = 'qualifier:'
+
+# import status values recorded in the output manifest
+CREATED = 'created'
+PARTIAL = 'partial'     # pid created, but one or more target updates failed
+ERROR = 'error'
+
+
+def read_manifest(path):
+    '''Read a CSV or JSON lines manifest, one row at a time.  The format
+    is determined by file extension (``.csv`` for CSV, anything else is
+    treated as JSON lines).  Qualified targets are normalized into a
+    ``qualifiers`` dictionary for both formats.
+
+    :param path: manifest file name
+    :returns: generator of dictionaries, one per row
+    '''
+    with open(path, encoding='utf-8', newline='') as manifest:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(manifest):
+                qualifiers = {}
+                for key in list(row.keys()):
+                    if key.startswith(QUALIFIER_PREFIX):
+                        uri = row.pop(key)
+                        if uri:
+                            qualifiers[key[len(QUALIFIER_PREFIX):]] = uri
+                row['qualifiers'] = qualifiers
+                yield row
+        else:
+            for line in manifest:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class ManifestWriter(object):
+    '''Append rows to an output manifest, in CSV or JSON lines format
+    (by file extension, as for :meth:`read_manifest`).  Each row is
+    flushed as soon as it is written, so that an interrupted import can
+    be resumed.'''
+
+    fields = ['row', 'status', 'pid', 'uri', 'name', 'target_uri',
+              'external_system_key', 'error']
+
+    def __init__(self, path):
+        self.csv = path.endswith('.csv')
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.fileobj = open(path, 'a', encoding='utf-8', newline='')
+        if self.csv:
+            self.writer = csv.DictWriter(self.fileobj, self.fields,
+                                         extrasaction='ignore')
+            if not exists:
+                self.writer.writerow(dict((f, f) for f in self.fields))
+
+    def write(self, row):
+        if self.csv:
+            self.writer.writerow(row)
+        else:
+            self.fileobj.write(json.dumps(row, sort_keys=True))
+            self.fileobj.write('\n')
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+
+class PidImporter(object):
+    '''Create pids in bulk from a manifest; see module documentation for
+    the manifest format.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient` with
+        credentials for creating pids
+    :param type: type of pids to create (ark or purl); qualified targets
+        are only supported for ARKs
+    :param domain: default domain URI for new pids
+    :param external_system: external system name for new pids
+    :param policy: policy title for new pids
+    :param workers: number of pids to create concurrently
+    '''
+
+    def __init__(self, client, type='ark', domain=None, external_system=None,
+                 policy=None, workers=4):
+        client._check_pid_type(type)
+        self.client = client
+        self.type = type
+        self.domain = domain
+        self.external_system = external_system
+        self.policy = policy
+        self.workers = workers
+        self._target_pool = None
+
+    def completed_rows(self, path):
+        '''Read a previous output manifest and find rows that were already
+        imported.
+
+        :returns: dictionary of row number to output manifest row, for
+            every row with a pid assigned (including partial imports)
+        '''
+        done = {}
+        if os.path.exists(path):
+            for row in read_manifest(path):
+                if row.get('pid') and row.get('row') not in (None, ''):
+                    done[int(row['row'])] = row
+        return done
+
+    def import_row(self, item):
+        '''Create a single pid and its qualified targets.  Errors are
+        logged and recorded in the returned output row instead of raised,
+        so one bad row does not stop an import.
+
+        :param item: tuple of row number, manifest row, and previous output
+            row (if the pid was already created)
+        :returns: output manifest row
+        '''
+        from requests.exceptions import RequestException
+        index, row, previous = item
+        result = {
+            'row': index,
+            'name': row.get('name'),
+            'target_uri': row.get('target_uri'),
+            'external_system_key': row.get('external_system_key'),
+        }
+        errors = []
+        if previous is not None:
+            # pid was created on an earlier run; only targets need retrying
+            result['pid'] = previous['pid']
+            result['uri'] = previous.get('uri')
+            target_uri = row.get('target_uri') or ''
+            if self.client.pid_token in target_uri:
+                # the templated target may not have been updated
+                try:
+                    self.client.update_target(self.type, result['pid'], '',
+                        target_uri=self.client.expand_pid_token(target_uri, result['pid']))
+                except RequestException as err:
+                    errors.append(str(err))
+        elif not row.get('target_uri'):
+            result.update({'status': ERROR, 'error': 'No target_uri specified'})
+            return result
+        else:
+            try:
+                uri = self.client.create_templated_pid(self.type,
+                    row.get('domain') or self.domain, row['target_uri'],
+                    name=row.get('name'), external_system=self.external_system,
+                    external_system_key=row.get('external_system_key'),
+                    policy=self.policy)
+            except RequestException as err:
+                uri = getattr(err, 'pid', None)
+                if uri is None:
+                    logger.error('Error creating pid for row %d: %s', index, err)
+                    result.update({'status': ERROR, 'error': str(err)})
+                    return result
+                # pid created, but its target was not updated; record the
+                # pid so the update is retried instead of creating another
+                errors.append(str(err))
+            result['uri'] = uri
+            result['pid'] = pid_noid(uri)
+
+        # fan out qualified targets concurrently
+        qualifiers = row.get('qualifiers') or {}
+        tasks = [self._target_pool.submit(self.client.update_ark_target, result['pid'],
+                     qualifier, target_uri=self.client.expand_pid_token(uri, result['pid']))
+                 for qualifier, uri in sorted(qualifiers.items())]
+        for task in tasks:
+            try:
+                task.result()
+            except RequestException as err:
+                errors.append(str(err))
+        if errors:
+            logger.error('Error creating targets for row %d: %s', index, errors)
+            result.update({'status': PARTIAL, 'error': '; '.join(errors)})
+        else:
+            result['status'] = CREATED
+        return result
+
+    def run(self, manifest, output, progress=None):
+        '''Import all the rows in a manifest, writing results to an output
+        manifest.  Rows recorded in the output manifest as already created
+        are skipped; partially imported rows only have their target updates
+        retried.
+
+        :param manifest: input manifest file name
+        :param output: output manifest file name
+        :param progress: optional
+            :class:`~pidservices.progress.ProgressReporter`, updated as
+            each row is imported; partially imported rows count as errors
+        :returns: dictionary of counts by status, plus ``skipped``
+        '''
+        done = self.completed_rows(output)
+        counts = {CREATED: 0, PARTIAL: 0, ERROR: 0, 'skipped': 0}
+
+        def items():
+            for index, row in enumerate(read_manifest(manifest)):
+                if index in done and done[index].get('status') != PARTIAL:
+                    counts['skipped'] += 1
+                    continue
+                if row.get('qualifiers') and self.type != 'ark':
+                    raise Exception('Qualified targets are only supported for ARKs')
+                yield index, row, done.get(index)
+
+        def import_row(item):
+            start = time.perf_counter()
+            result = self.import_row(item)
+            if progress is not None:
+                progress.update(errors=0 if result['status'] == CREATED else 1,
+                                latency=time.perf_counter() - start)
+            return result
+
+        writer = ManifestWriter(output)
+        try:
+            with WorkerPool(self.workers) as pool:
+                with WorkerPool(self.workers) as self._target_pool:
+                    for result in pool.imap(import_row, items()):
+                        writer.write(result)
+                        counts[result['status']] += 1
+        finally:
+            writer.close()
+            self._target_pool = None
+        return counts
@@ -0,0 +1,233 @@
+'''
+*"Trust, but verify."* - **Russian proverb**
+
+Module contains a link checker for auditing pid targets: target URIs are
+streamed from a pid search and probed concurrently, and broken targets can
+optionally be deactivated or pointed somewhere else.
+
+Probes use ``HEAD`` requests, falling back to a ranged ``GET`` (requesting
+only the first byte) for servers that don't support ``HEAD``, so no
+response bodies are downloaded.  Results are cached by URL, so a URL used
+by many targets is only probed once; the least recently used results are
+dropped once the cache is full, so memory stays bounded on long sweeps.
+Probes are scheduled with a
+:class:`~pidservices.scheduler.HostScheduler`, which limits concurrency and
+request rate per host while keeping every host busy.
+'''
+
+from collections import OrderedDict, namedtuple
+import logging
+import threading
+import time
+
+import requests
+
+from pidservices import __version__
+from pidservices.scheduler import HostScheduler, url_host
+from pidservices.workers import Task
+
+logger = logging.getLogger(__name__)
+
+# status codes that indicate a server doesn't support HEAD requests
+HEAD_NOT_SUPPORTED = [405, 501]
+
+# status code for a range that can't be served, e.g. of an empty response
+RANGE_NOT_SATISFIABLE = 416
+
+
+class ProbeResult(namedtuple('ProbeResult', ['url', 'status', 'error', 'method', 'elapsed'])):
+    '''Result of probing a single URL: HTTP status code (None if the
+    request failed), error message (if any), the HTTP method that
+    determined the result, and time taken in seconds.'''
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        'True if the URL could be retrieved (status code below 400).'
+        return self.status is not None and self.status < 400
+
+
+class TargetStatus(namedtuple('TargetStatus', ['pid', 'target', 'result'])):
+    '''Result of checking a single target: the pid and target dictionaries
+    as returned by :meth:`~pidservices.clients.PidmanRestClient.search_pids`,
+    and the :class:`ProbeResult` for the target URI.'''
+    __slots__ = ()
+
+
+class TargetChecker(object):
+    '''Check pid targets for broken links.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`, used to
+        search for pids and (with credentials) update broken targets
+    :param type: type of pids being checked (ark or purl); needed to
+        update targets
+    :param workers: number of URLs to probe concurrently
+    :param per_host: maximum number of concurrent probes to any one host
+    :param rate: maximum number of probes per second to any one host;
+        None for no limit
+    :param timeout: timeout in seconds for each probe
+    :param session: optional :class:`requests.Session` to use for probes
+    :param scheduler: optional :class:`~pidservices.scheduler.HostScheduler`
+        (e.g., with limits for specific hosts); overrides ``workers``,
+        ``per_host`` and ``rate``
+    :param cache_size: maximum number of probe results to cache
+    '''
+
+    def __init__(self, client, type='ark', workers=8, per_host=2, rate=None,
+                 timeout=10, session=None, scheduler=None, cache_size=100000):
+        self.client = client
+        self.type = type
+        self.timeout = timeout
+        if scheduler is None:
+            scheduler = HostScheduler(workers, per_host, rate)
+        self.scheduler = scheduler
+        workers = scheduler.workers
+        if session is None:
+            session = requests.Session()
+            # keep a connection open for every worker thread
+            adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                                    pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = 'pidmanclient/%s (link checker)' % __version__
+        self.session = session
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _request(self, url):
+        start = time.time()
+        method = 'HEAD'
+        try:
+            response = self.session.head(url, timeout=self.timeout,
+                                         allow_redirects=True)
+            if response.status_code in HEAD_NOT_SUPPORTED:
+                method = 'GET'
+                # only ask for the first byte; don't download the body
+                response = self.session.get(url, timeout=self.timeout,
+                    allow_redirects=True, stream=True, headers={'Range': 'bytes=0-0'})
+                response.close()
+                if response.status_code == RANGE_NOT_SATISFIABLE:
+                    # the URL exists but has no first byte (e.g., it is
+                    # empty); ask again without a range, still without
+                    # downloading the body
+                    response = self.session.get(url, timeout=self.timeout,
+                                                allow_redirects=True, stream=True)
+                    response.close()
+        except requests.exceptions.RequestException as err:
+            return ProbeResult(url, None, str(err), method, time.time() - start)
+        return ProbeResult(url, response.status_code, None, method,
+                           time.time() - start)
+
+    def probe(self, url):
+        '''Probe a single URL.  Results are cached; concurrent probes of
+        the same URL share a single request.
+
+        :returns: :class:`ProbeResult`
+        '''
+        with self._lock:
+            cached = self._cache.get(url)
+            owner = cached is None
+            if owner:
+                cached = self._cache[url] = Task(self._request, (url,))
+                self._evict()
+            else:
+                self._cache.move_to_end(url)
+        if isinstance(cached, ProbeResult):
+            return cached
+        if owner:
+            cached.run()
+            result = cached.result()
+            # cache the bare result, not the task and its lock
+            with self._lock:
+                self._cache[url] = result
+                self._evict()
+            return result
+        return cached.result()
+
+    def _evict(self):
+        # drop the least recently used results; called with the lock held
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def check_target(self, item):
+        '''Probe the target URI for a single pid target.
+
+        :param item: tuple of pid and target dictionaries
+        :returns: :class:`TargetStatus`
+        '''
+        pid, target = item
+        return TargetStatus(pid, target, self.probe(target['target_uri']))
+
+    def targets(self, pids, include_inactive=False):
+        '''Generate the (pid, target) pairs to be checked from a sequence
+        of pids.  Targets without a URI, and (by default) inactive targets,
+        are skipped.'''
+        for pid in pids:
+            for target in pid.get('targets') or []:
+                if not target.get('target_uri'):
+                    continue
+                if not include_inactive and target.get('active') is False:
+                    continue
+                yield pid, target
+
+    def check(self, pids, include_inactive=False, repair=False, retarget=None):
+        '''Check all the targets of a sequence of pids, e.g. from
+        :meth:`~pidservices.clients.PidmanRestClient.iter_search_pids`.
+        Targets are probed concurrently, scheduled by target host; pids
+        are consumed lazily, so any number of pids can be checked with
+        bounded memory.
+
+        :param include_inactive: check inactive targets too
+        :param repair: if True, update broken targets as they are found;
+            see :meth:`repair`
+        :param retarget: optional function used to find a new URI for a
+            broken target; see :meth:`repair`
+        :returns: generator of :class:`TargetStatus`, in completion order
+        '''
+        def check_target(item):
+            status = self.check_target(item)
+            if repair and not status.result.ok:
+                try:
+                    self.repair(status, retarget)
+                except requests.exceptions.RequestException as err:
+                    logger.error('Error updating target %s for %s: %s',
+                        status.target.get('qualifier') or '', status.pid['pid'], err)
+            return status
+
+        return self.scheduler.imap(check_target, self.targets(pids, include_inactive),
+                                   host=lambda item: url_host(item[1]['target_uri']))
+
+    def check_search(self, page_workers=2, include_inactive=False, repair=False,
+                     retarget=None, **search_opts):
+        '''Check the targets of all pids matching a search.  Search options
+        are passed to
+        :meth:`~pidservices.clients.PidmanRestClient.iter_search_pids`;
+        other options are as for :meth:`check`.
+
+        :param page_workers: number of pages of search results to request
+            concurrently
+        :returns: generator of :class:`TargetStatus`
+        '''
+        pids = self.client.iter_search_pids(page_workers, **search_opts)
+        return self.check(pids, include_inactive, repair, retarget)
+
+    def repair(self, status, retarget=None):
+        '''Update a broken target.  If ``retarget`` is specified, it is
+        called with the :class:`TargetStatus` and may return a new target
+        URI; otherwise (or if it returns None), the target is deactivated.
+        '''
+        target_uri = retarget(status) if retarget is not None else None
+        if target_uri:
+            return self.retarget(status, target_uri)
+        return self.deactivate(status)
+
+    def deactivate(self, status):
+        '''Mark the target for a :class:`TargetStatus` as inactive.'''
+        return self.client.update_target(self.type, status.pid['pid'],
+            status.target.get('qualifier') or '', active=False)
+
+    def retarget(self, status, target_uri):
+        '''Update the target for a :class:`TargetStatus` to a new URI.'''
+        return self.client.update_target(self.type, status.pid['pid'],
+            status.target.get('qualifier') or '', target_uri=target_uri)
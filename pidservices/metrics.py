@@ -0,0 +1,247 @@
+'''
+*"What gets measured gets managed."* - **Peter Drucker**
+
+Module contains latency metrics for
+:class:`~pidservices.clients.PidmanRestClient` API calls.  A client
+created with a :class:`ClientMetrics` records the time taken by every
+request in a :class:`LatencyHistogram` for its logical operation
+(``get_pid``, ``search_pids``, ``update_target``, etc.), and logs requests
+slower than a threshold::
+
+    metrics = ClientMetrics(slow=2.0)
+    client = PidmanRestClient(url, user, password, metrics=metrics)
+    ...
+    print(metrics.snapshot()['search_pids']['p99'])
+
+Snapshots can be written to a file as JSON lines, periodically in a
+background thread with :meth:`ClientMetrics.start` or on demand with
+:meth:`ClientMetrics.export`; *pidman* commands do this with ``--metrics
+FILE``.  Clients without metrics (the default) don't time requests at all.
+'''
+
+from collections import OrderedDict
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: percentiles included in snapshots
+PERCENTILES = [50, 90, 99, 99.9]
+
+# logical operations for API requests, as method, path pattern (relative
+# to the base url), operation name and url template
+_OPERATIONS = [(method, re.compile(pattern), operation, template)
+               for method, pattern, operation, template in [
+    ('GET', r'^domains/$', 'list_domains', 'domains/'),
+    ('POST', r'^domains/$', 'create_domain', 'domains/'),
+    ('GET', r'^domains/[^/]+/$', 'get_domain', 'domains/{id}/'),
+    ('PUT', r'^domains/[^/]+/$', 'update_domain', 'domains/{id}/'),
+    ('GET', r'^pids/$', 'search_pids', 'pids/'),
+    ('POST', r'^(ark|purl)/$', 'create_pid', '{type}/'),
+    ('GET', r'^(ark|purl)/[^/]+$', 'get_pid', '{type}/{noid}'),
+    ('PUT', r'^(ark|purl)/[^/]+$', 'update_pid', '{type}/{noid}'),
+    ('GET', r'^(ark|purl)/[^/]+/', 'get_target', '{type}/{noid}/{qualifier}'),
+    ('PUT', r'^(ark|purl)/[^/]+/', 'update_target', '{type}/{noid}/{qualifier}'),
+    ('DELETE', r'^(ark|purl)/[^/]+/', 'delete_target', '{type}/{noid}/{qualifier}'),
+]]
+
+
+def classify(method, path):
+    '''Identify the logical operation of an API request.
+
+    :param method: HTTP method
+    :param path: request path, relative to the API base url
+    :returns: tuple of operation name and url template, e.g.
+        ``('get_pid', '{type}/{noid}')``
+    '''
+    path = path.lstrip('/')
+    for op_method, pattern, operation, template in _OPERATIONS:
+        if method == op_method and pattern.match(path):
+            return operation, template
+    return method.lower(), path
+
+
+class LatencyHistogram(object):
+    '''Histogram of request times with HDR-style log-linear buckets:
+    values are recorded in microseconds, with buckets no wider than
+    1/128 of their value, so percentiles are accurate to within 1% for
+    any latency, using a few kilobytes of memory.  Safe to use from
+    multiple threads.'''
+
+    # values below 2**_bits microseconds get a bucket each; each doubling
+    # above that is split into 2**(_bits - 1) buckets
+    _bits = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        'Discard all recorded values.'
+        with self._lock:
+            self.buckets = {}
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = None
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self._bits)
+        if not shift:
+            return value
+        return (shift << (self._bits - 1)) + (value >> shift)
+
+    def _value(self, index):
+        # lowest value in a bucket
+        if index < 1 << self._bits:
+            return index
+        shift = (index >> (self._bits - 1)) - 1
+        return (index - (shift << (self._bits - 1))) << shift
+
+    def record(self, seconds):
+        '''Record a request time.
+
+        :param seconds: time in seconds
+        '''
+        value = int(seconds * 1000000)
+        index = self._index(value)
+        with self._lock:
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        '''Time in seconds that the given percentage of recorded times do
+        not exceed (highest value in the bucket containing the
+        percentile, but no more than the maximum recorded time); None if
+        nothing has been recorded.'''
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(round(self.count * percent / 100.0)))
+            seen = 0
+            for index in sorted(self.buckets):
+                seen += self.buckets[index]
+                if seen >= rank:
+                    break
+            return min(self._value(index + 1) - 1, self.max) / 1000000.0
+
+    def snapshot(self):
+        '''Summary of recorded times, in seconds: count, min, mean, max,
+        and percentiles as ``p50``, ``p99``, ``p99.9``, etc.'''
+        info = OrderedDict([('count', self.count)])
+        if not self.count:
+            return info
+        info['min'] = self.min / 1000000.0
+        info['mean'] = self.total / self.count / 1000000.0
+        for percent in PERCENTILES:
+            info['p%g' % percent] = self.percentile(percent)
+        info['max'] = self.max / 1000000.0
+        return info
+
+
+class ClientMetrics(object):
+    '''Latency histograms and error counts for a client's API calls, by
+    logical operation (see :func:`classify`).
+
+    :param slow: optional threshold in seconds; requests taking longer are
+        logged as warnings, with their operation, url template and time
+    '''
+
+    def __init__(self, slow=None):
+        self.slow = slow
+        self.histograms = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, method, path, seconds, status=None):
+        '''Record an API request; called by
+        :class:`~pidservices.clients.PidmanRestClient`.
+
+        :param method: HTTP method
+        :param path: request path, relative to the API base url
+        :param seconds: time taken by the request
+        :param status: response status code; None if no response was
+            received
+        '''
+        operation, template = classify(method, path)
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(operation, LatencyHistogram())
+        histogram.record(seconds)
+        if status is None or status >= 400:
+            with self._lock:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+        if self.slow is not None and seconds > self.slow:
+            logger.warning('Slow request: %s %s %s took %.3fs (status %s)',
+                           operation, method, template, seconds, status)
+
+    def snapshot(self, reset=False):
+        '''Summary of request times for each operation; see
+        :meth:`LatencyHistogram.snapshot`.  Also includes the number of
+        errors for each operation.
+
+        :param reset: start over after taking the snapshot
+        :returns: dictionary of operation name and summary
+        '''
+        info = OrderedDict()
+        with self._lock:
+            operations = sorted(self.histograms.items())
+            errors, self.errors = self.errors, ({} if reset else self.errors)
+        for operation, histogram in operations:
+            info[operation] = histogram.snapshot()
+            info[operation]['errors'] = errors.get(operation, 0)
+            if reset:
+                histogram.reset()
+        return info
+
+    def export(self, file, reset=False):
+        '''Write a snapshot to a file as a line of JSON, with the current
+        time.
+
+        :param file: file name to append to, or open file object
+        '''
+        line = json.dumps(OrderedDict([
+            ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('operations', self.snapshot(reset)),
+        ])) + '\n'
+        if hasattr(file, 'write'):
+            file.write(line)
+            file.flush()
+        else:
+            with open(file, 'a') as outfile:
+                outfile.write(line)
+
+    def _run(self, file, interval, reset):
+        while not self._stop.wait(interval):
+            self.export(file, reset)
+
+    def start(self, file, interval=60, reset=False):
+        '''Export snapshots every ``interval`` seconds in a background
+        thread, until :meth:`stop` is called.
+
+        :param reset: reset the histograms after each snapshot, so each
+            snapshot covers one interval rather than all requests so far
+        '''
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(file, interval, reset),
+                                        name='pidservices-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop exporting snapshots.'''
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,196 @@
+'''
+*"Little by little, one travels far."* - **J. R. R. Tolkien**
+
+Module contains a compact integer encoding of NOIDs, and
+:class:`NoidSet`, a set of NOIDs stored as a sorted array of 64-bit
+integers.  A Python set of millions of NOID strings takes over 100 bytes
+per NOID; a :class:`NoidSet` takes 8, and supports fast membership
+tests, unions and differences.  Used to track pids in
+:mod:`pidservices.snapshot`, and to sort pids in :mod:`pidservices.diff`::
+
+    seen = NoidSet()
+    seen.add('1fx')
+    '1fx' in seen
+
+NOIDs are encoded in `bijective base-29
+<https://en.wikipedia.org/wiki/Bijective_numeration>`_ over
+:data:`~pidservices.clients.NOID_CHARACTERS`, so every NOID (with or
+without leading zeros) has exactly one integer, and integers sort NOIDs
+by length and then alphabetically.  NOIDs of up to 13 characters fit in
+64 bits.
+'''
+
+from array import array
+from bisect import bisect_left
+
+from pidservices.clients import NOID_CHARACTERS
+
+_BASE = len(NOID_CHARACTERS)
+_DIGITS = dict((char, i + 1) for i, char in enumerate(NOID_CHARACTERS))
+_DIGITS.update((char.upper(), i + 1) for i, char in enumerate(NOID_CHARACTERS))
+
+#: longest NOID that can be encoded in 64 bits
+MAX_NOID_LENGTH = 13
+
+
+def encode_noid(noid):
+    '''Encode a NOID as an integer.  Upper and lower case characters are
+    treated the same, as in :data:`~pidservices.clients.ARK_REGEXP`.
+
+    :raises ValueError: if the NOID is empty, too long or has characters
+        that are not in :data:`~pidservices.clients.NOID_CHARACTERS`
+    '''
+    if not noid or len(noid) > MAX_NOID_LENGTH:
+        raise ValueError('Not a valid NOID: %r' % noid)
+    n = 0
+    try:
+        for char in noid:
+            n = n * _BASE + _DIGITS[char]
+    except KeyError:
+        raise ValueError('Not a valid NOID: %r' % noid)
+    return n
+
+
+def decode_noid(n):
+    '''Decode an integer from :func:`encode_noid` back to a NOID.'''
+    if n < 1:
+        raise ValueError('Not an encoded NOID: %r' % n)
+    chars = []
+    while n:
+        n, digit = divmod(n - 1, _BASE)
+        chars.append(NOID_CHARACTERS[digit])
+    return ''.join(reversed(chars))
+
+
+def noid_key(noid):
+    '''Sort key for NOIDs, in the order of their integer encoding.'''
+    return encode_noid(noid)
+
+
+class NoidSet(object):
+    '''Set of NOIDs, stored as a sorted array of encoded NOIDs.  Added
+    NOIDs are buffered and merged into the array in batches, so adding
+    NOIDs one at a time stays fast.  Iterating over the set yields NOIDs
+    in sorted order (see :func:`noid_key`).
+
+    Not safe to update from multiple threads without a lock.
+
+    :param noids: optional iterable of NOIDs to add
+    '''
+
+    #: smallest number of buffered NOIDs merged into the array at once
+    batch_size = 4096
+
+    def __init__(self, noids=None):
+        self._array = array('Q')
+        self._pending = set()
+        if noids is not None:
+            self.update(noids)
+
+    @classmethod
+    def _from_sorted(cls, values):
+        noids = cls()
+        noids._array = values
+        return noids
+
+    def _compact(self):
+        # merge buffered NOIDs into the sorted array
+        if not self._pending:
+            return
+        # (add only buffers NOIDs that aren't in the array already)
+        new = sorted(self._pending)
+        self._pending = set()
+        if not self._array or new[0] > self._array[-1]:
+            self._array.extend(new)
+        else:
+            self._array = _merge(self._array, array('Q', new))
+
+    def _in_array(self, n):
+        i = bisect_left(self._array, n)
+        return i < len(self._array) and self._array[i] == n
+
+    def add(self, noid):
+        'Add a NOID.'
+        n = encode_noid(noid)
+        if not self._in_array(n):
+            self._pending.add(n)
+            if len(self._pending) >= max(self.batch_size, len(self._array) // 8):
+                self._compact()
+
+    def update(self, noids):
+        'Add NOIDs from an iterable.'
+        for noid in noids:
+            self.add(noid)
+
+    def __contains__(self, noid):
+        try:
+            n = encode_noid(noid)
+        except ValueError:
+            return False
+        return n in self._pending or self._in_array(n)
+
+    def __len__(self):
+        self._compact()
+        return len(self._array)
+
+    def __iter__(self):
+        self._compact()
+        return (decode_noid(n) for n in self._array)
+
+    def __eq__(self, other):
+        if not isinstance(other, NoidSet):
+            return NotImplemented
+        self._compact()
+        other._compact()
+        return self._array == other._array
+
+    def union(self, other):
+        'New set of NOIDs in either set.'
+        self._compact()
+        other._compact()
+        return self._from_sorted(_merge(self._array, other._array))
+
+    def difference(self, other):
+        'New set of NOIDs in this set but not the other.'
+        self._compact()
+        other._compact()
+        return self._from_sorted(array('Q', (n for n in self._array if not other._in_array(n))))
+
+    def intersection(self, other):
+        'New set of NOIDs in both sets.'
+        self._compact()
+        other._compact()
+        small, large = sorted([self, other], key=lambda noids: len(noids._array))
+        return self._from_sorted(array('Q', (n for n in small._array if large._in_array(n))))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
+    @property
+    def nbytes(self):
+        'Approximate memory used by the set of NOIDs, in bytes.'
+        self._compact()
+        return self._array.buffer_info()[1] * self._array.itemsize
+
+
+def _merge(a, b):
+    # merge two sorted arrays of unique values, without duplicates
+    merged = array('Q')
+    i = j = 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        x, y = a[i], b[j]
+        if x < y:
+            merged.append(x)
+            i += 1
+        elif y < x:
+            merged.append(y)
+            j += 1
+        else:
+            merged.append(x)
+            i += 1
+            j += 1
+    merged.extend(a[i:])
+    merged.extend(b[j:])
+    return merged
@@ -0,0 +1,136 @@
+'''
+*"Moderation in all things."* - **Proverb**
+
+Module contains :class:`PageSizeTuner`, which adjusts the page size of a
+search sweep as it runs.  Small pages waste time on round trips, while
+very large pages take long enough that the server or a proxy may time
+out, and hold more results in memory than needed; the best size depends
+on the server, the network and the pids being searched.  The tuner
+measures the latency and size of each page and picks the next page size
+to keep requests near a target latency, within a memory budget::
+
+    tuner = PageSizeTuner(target_latency=2, max_bytes=50 * 1024 * 1024)
+    for results in client.iter_search_pages(adaptive=tuner, domain='LSDI'):
+        ...
+
+Page sizes are powers of two, and a page size is only used when the
+number of results already read is a multiple of it, so that the page
+number for the new size starts exactly where the previous page ended.
+Sweeps with a tuner request one page at a time; see
+:meth:`~pidservices.clients.PidmanRestClient.iter_search_pages_adaptive`.
+*pidman* search commands use a tuner with ``--page-latency``.
+'''
+
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def power_of_two(n):
+    '''Largest power of two not greater than ``n`` (and at least 1).'''
+    return 1 << max(int(n), 1).bit_length() - 1
+
+
+def aligned_size(size, offset):
+    '''Largest power of two, no larger than ``size``, that ``offset`` is a
+    multiple of; the page size to use at ``offset`` results into a search.'''
+    size = power_of_two(size)
+    while offset % size:
+        size //= 2
+    return size
+
+
+class PageSizeTuner(object):
+    '''Choose search page sizes from the latency and size of previous
+    pages.  Page sizes are powers of two; the page size at most doubles
+    from one page to the next, but drops as far as needed at once when a
+    page is too slow or too large.
+
+    :param target_latency: target time in seconds to request a page
+    :param max_bytes: optional limit on the approximate size of a page of
+        results, in bytes
+    :param min_size: smallest page size
+    :param max_size: largest page size
+    :param initial: page size for the first page
+    '''
+
+    #: number of results used to estimate the size of a page
+    sample = 10
+
+    def __init__(self, target_latency=2.0, max_bytes=None, min_size=16, max_size=65536,
+                 initial=1024):
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.min_size = power_of_two(min_size)
+        self.max_size = max(power_of_two(max_size), self.min_size)
+        self.size = self._clamp(initial)
+        #: number of pages observed
+        self.pages = 0
+        #: number of page requests that timed out
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def _clamp(self, size):
+        return min(max(power_of_two(size), self.min_size), self.max_size)
+
+    def next_size(self, offset=0):
+        '''Page size to request at ``offset`` results into a search.'''
+        return aligned_size(self.size, offset)
+
+    @staticmethod
+    def result_bytes(results, sample=10):
+        '''Approximate size in bytes of a list of search results, from the
+        JSON size of the first few.'''
+        if not results:
+            return 0
+        head = results[:sample]
+        return len(json.dumps(head)) * len(results) // len(head)
+
+    def observe(self, size, latency, results=None, nbytes=None):
+        '''Record a page request and update the page size.
+
+        :param size: page size requested
+        :param latency: seconds taken to request the page
+        :param results: list of results on the page, used to estimate its
+            size if ``nbytes`` is not given
+        :param nbytes: size of the page in bytes, if known
+        :returns: new page size
+        '''
+        if nbytes is None and results is not None:
+            nbytes = self.result_bytes(results, self.sample)
+        with self._lock:
+            self.pages += 1
+            desired = size * 2
+            if latency > 0:
+                desired = min(desired, size * self.target_latency / latency)
+            count = len(results) if results is not None else size
+            if self.max_bytes and nbytes and count:
+                desired = min(desired, self.max_bytes * count / nbytes)
+            self.size = self._clamp(desired)
+            return self.size
+
+    def timeout(self, size):
+        '''Record a page request that timed out, and halve the page size.
+        Larger page sizes are not tried again.
+
+        :returns: new page size, or None if the page size can't be reduced
+        '''
+        with self._lock:
+            self.timeouts += 1
+            if size <= self.min_size:
+                return None
+            self.max_size = min(self.max_size, max(power_of_two(size) // 2, self.min_size))
+            self.size = self._clamp(size // 2)
+            logger.warning('Search page of %d results timed out; reducing page size to %d',
+                           size, self.size)
+            return self.size
+
+    def limit(self, size):
+        '''Lower the largest page size, e.g. to a maximum enforced by the
+        server.'''
+        with self._lock:
+            self.max_size = max(power_of_two(size), 1)
+            self.min_size = min(self.min_size, self.max_size)
+            self.size = self._clamp(self.size)
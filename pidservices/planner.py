@@ -0,0 +1,220 @@
+'''
+*"Measure twice, cut once."* - **Proverb**
+
+Module contains a planner for idempotent bulk updates: instead of
+updating every pid or target a job touches, compare the desired values
+with the current values (e.g., from search results) and update only what
+actually differs::
+
+    plan = ChangePlan()
+    for pid in client.iter_search_pids(domain='LSDI', type='ark'):
+        for target in pid['targets']:
+            plan.add(plan_target('ark', pid['pid'], target['qualifier'], target,
+                                 target_uri=new_uri(target), active=True))
+    plan.report(sys.stdout)          # dry run
+    for change, err in plan.apply(client, workers=8):
+        ...
+
+Re-running a migration then only writes the targets that still need to
+change.  *pidman rewrite-targets* and *pidman deactivate* plan their
+updates this way, and report planned changes without making them with
+``--dry-run``.
+'''
+
+from collections import namedtuple, OrderedDict
+import sys
+import time
+
+from pidservices.workers import WorkerPool
+
+#: target fields that can be updated, as accepted by
+#: :meth:`~pidservices.clients.PidmanRestClient.update_target`
+TARGET_FIELDS = ['target_uri', 'proxy', 'active']
+
+#: pid fields that can be updated, as accepted by
+#: :meth:`~pidservices.clients.PidmanRestClient.update_pid`, and the
+#: corresponding keys in pid information returned by the API
+PID_FIELDS = OrderedDict([
+    ('domain', 'domain_uri'),
+    ('name', 'name'),
+    ('external_system', 'ext_system'),
+    ('external_system_key', 'ext_system_key'),
+    ('policy', 'policy'),
+])
+
+
+class Change(namedtuple('Change', ['type', 'noid', 'qualifier', 'fields', 'current'])):
+    '''A planned update to a pid or target.
+
+    - **type** - pid type (ark or purl)
+    - **noid** - pid noid
+    - **qualifier** - target qualifier (empty for the unqualified
+      target), or None for a change to the pid itself
+    - **fields** - dictionary of fields to update and their new values
+    - **current** - dictionary of the current values of those fields, or
+      None if the target does not exist yet
+    '''
+    __slots__ = ()
+
+    @property
+    def is_target(self):
+        return self.qualifier is not None
+
+    def describe(self):
+        'One-line description of the change, for dry-run reports.'
+        if self.is_target:
+            name = '%s %s%s' % (self.type, self.noid,
+                                '/%s' % self.qualifier if self.qualifier else '')
+        else:
+            name = '%s %s (pid)' % (self.type, self.noid)
+        if self.current is None:
+            return '%s: create %s' % (name, ', '.join('%s %r' % item
+                                                      for item in sorted(self.fields.items())))
+        return '%s: %s' % (name, ', '.join('%s %r -> %r' % (field, self.current.get(field), value)
+                                           for field, value in sorted(self.fields.items())))
+
+    def apply(self, client):
+        '''Make the change with
+        :meth:`~pidservices.clients.PidmanRestClient.update_target` or
+        :meth:`~pidservices.clients.PidmanRestClient.update_pid`.'''
+        if self.is_target:
+            return client.update_target(self.type, self.noid, self.qualifier, **self.fields)
+        return client.update_pid(self.type, self.noid, **self.fields)
+
+
+def find_target(pid, qualifier=''):
+    '''Find a target in pid information returned by the API.
+
+    :returns: target dictionary, or None if the pid has no target with
+        that qualifier
+    '''
+    for target in pid.get('targets') or []:
+        if (target.get('qualifier') or '') == (qualifier or ''):
+            return target
+
+
+def plan_target(type, noid, qualifier, target, **desired):
+    '''Plan an update to a target.
+
+    :param type: pid type (ark or purl)
+    :param noid: pid noid
+    :param qualifier: target qualifier; empty for the unqualified target
+    :param target: current target information, as returned by the API
+        (e.g., from :func:`find_target`), or None if there is no such
+        target yet
+    :param desired: desired values for any of :data:`TARGET_FIELDS`;
+        values of None are ignored
+    :returns: :class:`Change`, or None if the target already has the
+        desired values
+    '''
+    desired = dict((field, value) for field, value in desired.items() if value is not None)
+    unknown = set(desired) - set(TARGET_FIELDS)
+    if unknown:
+        raise Exception('Unknown target fields: %s' % ', '.join(sorted(unknown)))
+    if target is None:
+        return Change(type, noid, qualifier or '', desired, None) if desired else None
+    fields = dict((field, value) for field, value in desired.items()
+                  if target.get(field) != value)
+    if fields:
+        return Change(type, noid, qualifier or '', fields,
+                      dict((field, target.get(field)) for field in fields))
+
+
+def plan_pid(type, pid, **desired):
+    '''Plan an update to a pid.
+
+    :param type: pid type (ark or purl)
+    :param pid: current pid information, as returned by the API
+    :param desired: desired values for any of the keys of
+        :data:`PID_FIELDS`; values of None are ignored.  If the pid
+        information doesn't include the current value of a field, the
+        field is always updated.
+    :returns: :class:`Change`, or None if the pid already has the
+        desired values
+    '''
+    desired = dict((field, value) for field, value in desired.items() if value is not None)
+    unknown = set(desired) - set(PID_FIELDS)
+    if unknown:
+        raise Exception('Unknown pid fields: %s' % ', '.join(sorted(unknown)))
+    fields = dict((field, value) for field, value in desired.items()
+                  if PID_FIELDS[field] not in pid or pid[PID_FIELDS[field]] != value)
+    if fields:
+        return Change(type, pid['pid'], None, fields,
+                      dict((field, pid.get(PID_FIELDS[field])) for field in fields))
+
+
+def apply_changes(client, changes, workers=4, progress=None):
+    '''Make planned changes concurrently.  Changes are consumed lazily, so
+    they can be planned while earlier changes are being made.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param changes: iterable of :class:`Change` (None values are skipped)
+    :param workers: number of changes to make concurrently
+    :param progress: optional
+        :class:`~pidservices.progress.ProgressReporter`
+    :returns: generator of tuples of change and exception (or None), in
+        completion order
+    '''
+    from requests.exceptions import RequestException
+
+    def apply(change):
+        err = None
+        start = time.perf_counter()
+        try:
+            change.apply(client)
+        except RequestException as error:
+            err = error
+        if progress is not None:
+            progress.update(errors=0 if err is None else 1,
+                            latency=time.perf_counter() - start)
+        return change, err
+
+    with WorkerPool(workers) as pool:
+        for result in pool.imap(apply, (change for change in changes if change is not None),
+                                ordered=False):
+            yield result
+
+
+class ChangePlan(object):
+    '''A set of planned changes.  Changes to the same pid or target are
+    merged, so each is updated at most once.'''
+
+    def __init__(self):
+        self.changes = OrderedDict()
+        #: number of pids or targets checked that needed no change
+        self.unchanged = 0
+
+    def add(self, change):
+        '''Add a change, as returned by :func:`plan_target` or
+        :func:`plan_pid`; None is counted as unchanged.'''
+        if change is None:
+            self.unchanged += 1
+            return
+        key = (change.type, change.noid, change.qualifier)
+        previous = self.changes.get(key)
+        if previous is not None:
+            fields = dict(previous.fields, **change.fields)
+            current = None if previous.current is None else \
+                dict(change.current or {}, **previous.current)
+            change = previous._replace(fields=fields, current=current)
+        self.changes[key] = change
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes.values())
+
+    def report(self, stream=None):
+        '''Write the planned changes, one per line, followed by a summary.
+
+        :param stream: file-like object; defaults to standard output
+        '''
+        stream = stream if stream is not None else sys.stdout
+        for change in self:
+            stream.write(change.describe() + '\n')
+        stream.write('%d changes planned, %d unchanged\n' % (len(self), self.unchanged))
+
+    def apply(self, client, workers=4, progress=None):
+        '''Make the planned changes; see :func:`apply_changes`.'''
+        return apply_changes(client, self, workers, progress)
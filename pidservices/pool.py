@@ -0,0 +1,238 @@
+'''
+*"A penny saved is a penny earned."* - **Benjamin Franklin**
+
+Module contains :class:`PidPool`, a persistent local stock of pids that
+have been allocated in the Pid Manager (e.g., with a placeholder target)
+but not yet assigned to anything.  High-rate ingest processes take pids
+from the pool instead of calling
+:meth:`~pidservices.clients.PidmanRestClient.create_pid` for every item::
+
+    pool = PidPool('pids.db', client, domain, 'http://my.app/pending/',
+                   stock=1000)
+    for item in items:
+        item.ark = pool.take()[0]
+        # ... update target and name once the item has been ingested
+
+The stock is kept in a SQLite database, so it survives restarts and can
+be shared by any number of processes on the same machine: each pid is
+handed out exactly once.  When the stock falls below a low-water mark,
+the pool is refilled in a background thread, creating pids concurrently;
+only one process refills a given pool at a time.  Pids allocated with
+``pidman allocate --pool`` (or added from a file with :meth:`PidPool.add`)
+go into the same stock.
+'''
+
+from contextlib import closing
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class PidPool(object):
+    '''Persistent stock of allocated but unassigned pids.
+
+    :param path: SQLite database file for the stock; created if it does
+        not exist
+    :param client: :class:`~pidservices.clients.PidmanRestClient` with
+        credentials to create pids; without a client, pids can only be
+        taken from the existing stock
+    :param domain: domain URI for new pids
+    :param target_uri: placeholder target URI for new pids
+    :param type: type of pids to create (ark or purl)
+    :param name: optional default name for new pids
+    :param stock: number of pids to keep in stock
+    :param low_water: refill the pool when the stock falls below this
+        number; defaults to a quarter of ``stock``
+    :param workers: number of pids to create concurrently when refilling
+    :param timeout: seconds to wait for another process holding a lock on
+        the database
+    '''
+
+    #: seconds another process waits before taking over refilling a pool
+    #: from a process that stopped making progress
+    lease_time = 300
+
+    def __init__(self, path, client=None, domain=None, target_uri=None, type='ark',
+                 name=None, stock=1000, low_water=None, workers=4, timeout=30):
+        self.path = path
+        self.client = client
+        self.domain = domain
+        self.target_uri = target_uri
+        self.type = type
+        self.name = name
+        self.stock = stock
+        self.low_water = stock // 4 if low_water is None else low_water
+        self.workers = workers
+        self.timeout = timeout
+        self._refill_thread = None
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS pids ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, pid TEXT UNIQUE NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS lease ('
+                         'name TEXT PRIMARY KEY, owner TEXT, expires REAL)')
+
+    @property
+    def _owner(self):
+        # identifies the refilling pool to other processes (and to a child
+        # process after a fork)
+        return '%d:%d' % (os.getpid(), id(self))
+
+    def _connect(self):
+        # a new connection for every operation, so the pool can be used
+        # from any thread, and in child processes after a fork; closing a
+        # connection rolls back any transaction left open by an error
+        return closing(sqlite3.connect(self.path, timeout=self.timeout,
+                                       isolation_level=None))
+
+    def __len__(self):
+        'Number of pids in stock.'
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM pids').fetchone()[0]
+
+    def add(self, pids):
+        '''Add allocated pids to the stock, e.g. the output of ``pidman
+        allocate``; pids already in stock are ignored.
+
+        :param pids: iterable of pids
+        :returns: number of pids added
+        '''
+        pids = [pid.strip() for pid in pids if pid.strip()]
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO pids (pid) VALUES (?)',
+                             [(pid,) for pid in pids])
+            conn.execute('COMMIT')
+            return conn.total_changes - before
+
+    def take(self, count=1):
+        '''Take pids from the stock.  Pids are removed from the stock as
+        they are handed out, so no other process or thread gets the same
+        pids.  If the stock doesn't have enough pids, the rest are created
+        immediately; if the stock is running low, it is refilled in the
+        background.
+
+        :param count: number of pids to take
+        :returns: list of pids
+        '''
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT id, pid FROM pids ORDER BY id LIMIT ?',
+                                (count,)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM pids WHERE id <= ?', (rows[-1][0],))
+            remaining = conn.execute('SELECT COUNT(*) FROM pids').fetchone()[0]
+            conn.execute('COMMIT')
+        pids = [pid for id, pid in rows]
+        if len(pids) < count and self.client is not None:
+            pids.extend(self._create(count - len(pids)))
+        if len(pids) < count:
+            # put back what we took, so the pids aren't lost
+            self.add(pids)
+            raise Exception('Not enough pids available in pool %s (%d of %d)'
+                            % (self.path, len(pids), count))
+        if remaining < self.low_water and self.client is not None:
+            self.refill()
+        return pids
+
+    def _create_pid(self, i):
+        from requests.exceptions import RequestException
+        try:
+            return self.client.create_pid(self.type, self.domain, self.target_uri,
+                                          self.name)
+        except RequestException as err:
+            logger.error('Error creating pid for pool %s: %s', self.path, err)
+
+    def _create(self, count):
+        # generate new pids, created concurrently
+        with WorkerPool(self.workers) as pool:
+            for pid in pool.imap(self._create_pid, range(count), ordered=False):
+                if pid is not None:
+                    yield pid
+
+    def fill(self, count):
+        '''Create pids and add them to the stock.  Pids are stored as they
+        are created, so an interrupted fill loses at most a few pids.
+
+        :param count: number of pids to create
+        :returns: number of pids added
+        '''
+        added = 0
+        batch = []
+        for pid in self._create(count):
+            batch.append(pid)
+            if len(batch) >= max(self.workers, 10):
+                added += self.add(batch)
+                batch = []
+                self._renew_lease()
+        if batch:
+            added += self.add(batch)
+        return added
+
+    def _acquire_lease(self):
+        # only one process should refill the pool at a time
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT owner, expires FROM lease WHERE name = 'refill'").fetchone()
+            if row is not None and row[0] != self._owner and row[1] > now:
+                conn.execute('COMMIT')
+                return False
+            conn.execute("INSERT OR REPLACE INTO lease (name, owner, expires) "
+                         "VALUES ('refill', ?, ?)", (self._owner, now + self.lease_time))
+            conn.execute('COMMIT')
+            return True
+
+    def _renew_lease(self):
+        with self._connect() as conn:
+            conn.execute("UPDATE lease SET expires = ? WHERE name = 'refill' AND owner = ?",
+                         (time.time() + self.lease_time, self._owner))
+
+    def _release_lease(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM lease WHERE name = 'refill' AND owner = ?",
+                         (self._owner,))
+
+    def _refill(self):
+        try:
+            needed = self.stock - len(self)
+            if needed > 0:
+                self.fill(needed)
+        finally:
+            self._release_lease()
+
+    def refill(self, wait=False):
+        '''Fill the stock up to :attr:`stock` pids in a background thread,
+        unless this or another process is already refilling it.
+
+        :param wait: if True, wait for the refill to finish
+        :returns: True if this process started a refill
+        '''
+        with self._lock:
+            if self._refill_thread is not None and self._refill_thread.is_alive():
+                started = False
+            elif not self._acquire_lease():
+                started = False
+            else:
+                started = True
+                self._refill_thread = threading.Thread(target=self._refill,
+                    name='pidservices-pool-refill')
+                self._refill_thread.daemon = True
+                self._refill_thread.start()
+            thread = self._refill_thread
+        if wait and thread is not None:
+            thread.join()
+        return started
+
+    def join(self):
+        '''Wait for any refill started by this pool to finish.'''
+        thread = self._refill_thread
+        if thread is not None:
+            thread.join()
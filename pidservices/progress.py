@@ -0,0 +1,177 @@
+'''
+*"Whatever you do, do with all your might."* - **P. T. Barnum**
+
+Module contains a progress reporter for long-running batch operations,
+reporting items processed, errors, throughput, average latency and
+estimated time remaining.
+
+A :class:`ProgressReporter` can be passed to the bulk methods of
+:class:`~pidservices.clients.PidmanRestClient` (e.g.
+:meth:`~pidservices.clients.PidmanRestClient.create_pids`),
+:func:`~pidservices.export.export_pids` and
+:class:`~pidservices.importer.PidImporter`, or updated directly from a
+script::
+
+    progress = ProgressReporter('migrate', total=len(pids), interval=10)
+    for pid in pids:
+        start = time.time()
+        ok = migrate(pid)
+        progress.update(errors=0 if ok else 1, latency=time.time() - start)
+    progress.finish()
+
+With ``format='json'``, each report is a line of JSON (see
+:meth:`ProgressReporter.snapshot`), for monitoring tools.  Throughput and
+ETA are based on the last :attr:`~ProgressReporter.window` seconds, so the
+effect of a change (e.g., in server load or concurrency) shows up
+quickly.
+'''
+
+from collections import deque
+import json
+import sys
+import threading
+import time
+
+
+class ProgressReporter(object):
+    '''Track and periodically report progress of a batch operation.
+    Safe to update from multiple threads.
+
+    Call :meth:`update` as items are processed; a progress line is
+    written at most every ``interval`` seconds.  Call :meth:`finish` when
+    done to write a throughput summary.
+
+    :param label: label for the operation, e.g. ``allocate``
+    :param total: total number of items expected, if known
+    :param interval: minimum number of seconds between progress reports;
+        None to disable periodic reports
+    :param stream: file-like object to write reports to; defaults to
+        standard error
+    :param format: ``text`` for human-readable reports, or ``json`` for
+        JSON lines
+    :param window: number of seconds of recent progress used for the
+        current rate and ETA
+    '''
+
+    #: weight of the newest value in the moving average latency
+    smoothing = 0.1
+
+    def __init__(self, label='', total=None, interval=5, stream=None, format='text',
+                 window=30):
+        if format not in ('text', 'json'):
+            raise Exception("Progress format '%s' is not recognized" % format)
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.format = format
+        self.window = window
+        self.count = 0
+        self.errors = 0
+        #: moving average latency per item (or batch) in seconds, if
+        #: latencies have been reported
+        self.latency = None
+        self.start = time.time()
+        self._last_report = self.start
+        # (time, count) samples, at most one a second, for the recent rate
+        self._samples = deque([(self.start, 0)])
+        self._lock = threading.Lock()
+
+    def update(self, count=1, errors=0, latency=None):
+        '''Record items processed.
+
+        :param count: number of items processed
+        :param errors: number of those items that failed
+        :param latency: optional time in seconds taken to process the
+            items (e.g., an API call)
+        '''
+        with self._lock:
+            self.count += count
+            self.errors += errors
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self.smoothing * (latency - self.latency)
+            now = time.time()
+            if now - self._samples[-1][0] >= 1:
+                self._samples.append((now, self.count))
+                while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+                    self._samples.popleft()
+            if self.interval is not None and now - self._last_report >= self.interval:
+                self._last_report = now
+                self.report()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        'Items processed per second so far.'
+        elapsed = self.elapsed
+        return self.count / elapsed if elapsed else 0.0
+
+    @property
+    def current_rate(self):
+        'Items processed per second over the last :attr:`window` seconds.'
+        since, count = self._samples[0]
+        elapsed = time.time() - since
+        return (self.count - count) / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self):
+        '''Estimated seconds until all items are processed, at the
+        current rate; None if the total is not known.'''
+        rate = self.current_rate
+        if not self.total or not rate:
+            return None
+        return max(self.total - self.count, 0) / rate
+
+    def snapshot(self):
+        '''Current progress, as a dictionary with label, count, total,
+        errors, elapsed, rate, current_rate, latency and eta.'''
+        return {
+            'label': self.label, 'count': self.count, 'total': self.total,
+            'errors': self.errors, 'elapsed': round(self.elapsed, 3),
+            'rate': round(self.rate, 3), 'current_rate': round(self.current_rate, 3),
+            'latency': None if self.latency is None else round(self.latency, 6),
+            'eta': None if self.eta is None else round(self.eta, 1),
+        }
+
+    def _write(self, line):
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def report(self):
+        'Write a progress line.'
+        if self.format == 'json':
+            return self._write(json.dumps(self.snapshot(), sort_keys=True))
+        if self.total:
+            done = '%d/%d' % (self.count, self.total)
+        else:
+            done = '%d' % self.count
+        line = '%s: %s items, %d errors, %.1f items/sec' % (self.label, done,
+                                                            self.errors, self.current_rate)
+        if self.latency is not None:
+            line += ', %.0f ms avg latency' % (self.latency * 1000)
+        eta = self.eta
+        if eta is not None:
+            line += ', ETA %s' % format_duration(eta)
+        self._write(line)
+
+    def finish(self):
+        'Write a summary of the completed operation.'
+        if self.format == 'json':
+            info = self.snapshot()
+            info['finished'] = True
+            return self._write(json.dumps(info, sort_keys=True))
+        self._write('%s: %d items (%d errors) in %.1f seconds, %.1f items/sec' %
+                    (self.label, self.count, self.errors, self.elapsed, self.rate))
+
+
+def format_duration(seconds):
+    '''Format a number of seconds as ``H:MM:SS``.'''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
@@ -0,0 +1,189 @@
+'''
+*"Haste makes waste."* - **Benjamin Franklin**
+
+Module contains a scheduler for running work concurrently while being
+polite to the hosts involved.
+
+Pid targets tend to be concentrated on a few hosts (e.g., a Fedora
+repository or a single web application), so a plain thread pool checking or
+migrating targets in search order ends up with every worker hitting the
+same host while other hosts sit idle.  :class:`HostScheduler` queues work
+separately for each host, and hands it to workers round-robin across hosts,
+subject to a per-host concurrency limit and an optional per-host rate
+limit.
+'''
+
+from collections import deque
+import contextvars
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+
+def url_host(url):
+    'Default host key for a work item that is a URL: its network location.'
+    return urlparse(url).netloc.lower()
+
+
+class _HostQueue(object):
+    # pending work and scheduling state for a single host
+    __slots__ = ['items', 'active', 'next_start', 'per_host', 'interval']
+
+    def __init__(self, per_host, interval):
+        self.items = deque()
+        self.active = 0
+        self.next_start = 0
+        self.per_host = per_host
+        self.interval = interval
+
+
+class HostScheduler(object):
+    '''Run a function over work items concurrently, grouping items by host.
+
+    :param workers: total number of worker threads
+    :param per_host: maximum number of items for the same host to run at
+        once
+    :param rate: maximum number of items per second to start for the same
+        host; None for no limit
+    :param host_limits: optional dictionary of per-host overrides, mapping
+        host to a tuple of (per_host, rate)
+    '''
+
+    def __init__(self, workers=8, per_host=2, rate=None, host_limits=None):
+        self.workers = max(int(workers or 1), 1)
+        self.per_host = max(int(per_host or 1), 1)
+        self.rate = rate
+        self.host_limits = host_limits or {}
+
+    def _host_queue(self, host):
+        per_host, rate = self.host_limits.get(host, (self.per_host, self.rate))
+        return _HostQueue(per_host, 1.0 / rate if rate else 0)
+
+    def imap(self, func, items, host=url_host, window=None):
+        '''Apply ``func`` to every item, yielding results in completion
+        order.  Items are consumed lazily, with no more than ``window``
+        items queued or running at once.
+
+        :param func: function taking a single item
+        :param items: iterable of work items
+        :param host: function returning the host key for an item; by
+            default, items are treated as URLs
+        :param window: maximum number of items pending at once; defaults
+            to 50 per worker, so that enough work is queued to find an idle
+            host
+        '''
+        if window is None:
+            window = self.workers * 50
+        run = _ScheduledRun(self, func, host)
+        items = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and run.pending < window:
+                    try:
+                        run.add(next(items))
+                    except StopIteration:
+                        exhausted = True
+                if exhausted and run.pending == 0:
+                    break
+                yield run.next_result()
+        finally:
+            run.stop()
+
+
+class _ScheduledRun(object):
+    # state for a single call to HostScheduler.imap
+
+    def __init__(self, scheduler, func, host):
+        self.scheduler = scheduler
+        self.func = func
+        self.host = host
+        self.hosts = {}
+        # hosts with queued items, in round-robin order
+        self.ready = deque()
+        self.pending = 0
+        self.results = deque()
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.threads = []
+        for i in range(scheduler.workers):
+            thread = threading.Thread(target=self._work, name='pidservices-host-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def add(self, item):
+        key = self.host(item)
+        with self.cond:
+            queue = self.hosts.get(key)
+            if queue is None:
+                queue = self.hosts[key] = self.scheduler._host_queue(key)
+            if not queue.items:
+                self.ready.append(key)
+            # run the item in a copy of the caller's context (e.g., with
+            # the active tracing span), as WorkerPool tasks do
+            queue.items.append((item, contextvars.copy_context()))
+            self.pending += 1
+            self.cond.notify()
+
+    def _take(self):
+        # find the next host that is allowed to start an item; must be
+        # called with the lock held.  Returns (host, item) or, if nothing
+        # can start yet, (None, seconds to wait or None)
+        now = time.time()
+        wait = None
+        for i in range(len(self.ready)):
+            key = self.ready[0]
+            self.ready.rotate(-1)
+            queue = self.hosts[key]
+            if queue.active >= queue.per_host:
+                continue
+            if queue.next_start > now:
+                delay = queue.next_start - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            item = queue.items.popleft()
+            if not queue.items:
+                self.ready.remove(key)
+            queue.active += 1
+            queue.next_start = now + queue.interval
+            return key, item
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopped:
+                        return
+                    key, item = self._take()
+                    if key is not None:
+                        break
+                    self.cond.wait(item)
+            item, context = item
+            try:
+                result = (True, context.run(self.func, item))
+            except Exception:
+                result = (False, sys.exc_info())
+            with self.cond:
+                self.hosts[key].active -= 1
+                self.results.append(result)
+                self.cond.notify_all()
+
+    def next_result(self):
+        with self.cond:
+            while not self.results:
+                self.cond.wait()
+            success, value = self.results.popleft()
+            self.pending -= 1
+        if not success:
+            raise value[1].with_traceback(value[2])
+        return value
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
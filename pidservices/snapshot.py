@@ -0,0 +1,199 @@
+'''
+*"You can't step in the same river twice."* - **Heraclitus**
+
+Module contains :class:`SearchSnapshot`, for reading every pid matching
+a search exactly once while pids are being changed, e.g. by a migration
+updating the pids it reads.
+
+Search results are paged by page number, so when pids are added,
+removed or reordered during a search, later pages shift: some pids show
+up on two pages and others on none.  A pid is missed when it moves (or
+is pushed back by a removal) from a page that hasn't been read yet onto
+one that has; the pages read after the change then show it, with a pid
+already seen on an earlier page, or a different number of search
+results.  A snapshot skips pids it has already returned, and notes the
+last page that showed a change.  When the search is done, only the pages
+up to that one are read again, returning pids not seen before, until a
+pass shows no changes (or a maximum number of passes)::
+
+    snapshot = SearchSnapshot(client, workers=8, domain='LSDI', type='ark')
+    for pid in snapshot:
+        ...
+    if not snapshot.complete:
+        ...
+
+Pages are still requested concurrently, so a large sweep doesn't have to
+fall back to reading one page at a time to be correct.  Searches can also
+be run as snapshots with ``snapshot=True``; see
+:meth:`~pidservices.clients.PidmanRestClient.iter_search_pages`, and the
+``--snapshot`` option of *pidman* search commands.
+'''
+
+import logging
+import time
+
+from pidservices.noids import NoidSet
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class SearchSnapshot(object):
+    '''Iterate over every pid matching a search once, even if pids change
+    while the search runs; see module documentation.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param workers: number of pages to request concurrently
+    :param progress: optional
+        :class:`~pidservices.progress.ProgressReporter`, updated during the
+        first pass
+    :param passes: maximum number of times to run the search
+    :param search_opts: search parameters, as for
+        :meth:`~pidservices.clients.PidmanRestClient.iter_search_pages`;
+        ``count`` is the page size
+    '''
+
+    def __init__(self, client, workers=4, progress=None, passes=3, **search_opts):
+        search_opts.pop('page', None)
+        search_opts.pop('snapshot', None)
+        if search_opts.get('subdomains') or \
+                isinstance(search_opts.get('domain'), (list, tuple)) or \
+                isinstance(search_opts.get('domain_uri'), (list, tuple)):
+            raise Exception('Search snapshots are not supported when searching '
+                            'several domains')
+        if search_opts.pop('adaptive', None):
+            # pages are re-read by number, so the page size can't change
+            raise Exception('Search snapshots are not supported with adaptive '
+                            'page sizes')
+        if isinstance(search_opts.get('domain'), str) and not search_opts.get('domain_uri'):
+            search_opts['domain_uri'] = client.domains.uri(search_opts.pop('domain'))
+        self.client = client
+        self.workers = workers
+        self.progress = progress
+        self.max_passes = passes
+        self.search_opts = search_opts
+        #: noids of the pids returned so far, as a
+        #: :class:`~pidservices.noids.NoidSet`
+        self.seen = NoidSet()
+        #: number of pids skipped because they were already returned
+        self.duplicates = 0
+        #: number of pids missed by the first pass, and found by later passes
+        self.recovered = 0
+        #: number of pids the search matched when last checked
+        self.expected = None
+        #: number of passes run
+        self.passes = 0
+        #: number of pages read in each pass
+        self.pages_read = []
+        self._consistent = False
+
+    @property
+    def complete(self):
+        '''True if the last pass read its pages without any sign of pids
+        changing, and as many pids have been found as the search
+        matches.'''
+        return self._consistent and len(self.seen) >= self.expected
+
+    def results_count(self):
+        '''Current number of pids matching the search.'''
+        opts = dict((key, val) for key, val in self.search_opts.items() if key != 'count')
+        return self.client.search_pids(page=1, count=1, **opts).get('results_count') or 0
+
+    def _read(self, last_page, progress, batch):
+        # read pages 1 to last_page (all pages if None) in order, as
+        # tuples of page number and search results
+        def get_page(page):
+            start = time.perf_counter()
+            with self.client._in_batch(batch):
+                data = self.client.search_pids(page=page, **self.search_opts)
+            if progress is not None:
+                if progress.total is None:
+                    progress.total = data.get('results_count')
+                progress.update(len(data.get('results', [])),
+                                latency=time.perf_counter() - start)
+            return page, data
+
+        first = get_page(1)
+        yield first
+        page_count = first[1].get('page_count') or 1
+        if last_page is not None:
+            page_count = min(page_count, last_page)
+        if page_count > 1:
+            with WorkerPool(self.workers) as pool:
+                for page in pool.imap(get_page, range(2, page_count + 1)):
+                    yield page
+
+    def _pass(self, last_page, progress, batch):
+        # one pass over the search results; yields lists of new pids, and
+        # returns the last page that showed pids changing (None if none
+        # did; all pages if the number of results changed afterwards)
+        first_pass = self.passes == 1
+        in_pass = NoidSet() if not first_pass else self.seen
+        changed = None
+        count = None
+        pages = 0
+        for page, data in self._read(last_page, progress, batch):
+            pages += 1
+            if count is None:
+                count = data.get('results_count')
+            shifted = data.get('results_count') != count
+            new = []
+            for pid in data.get('results', []):
+                noid = pid['pid']
+                if noid in in_pass:
+                    # on an earlier page of this pass too: pages shifted
+                    shifted = True
+                    if first_pass:
+                        self.duplicates += 1
+                    continue
+                in_pass.add(noid)
+                if not first_pass:
+                    if noid in self.seen:
+                        continue
+                    self.recovered += 1
+                self.seen.add(noid)
+                new.append(pid)
+            if shifted:
+                changed = page if changed is None else max(changed, page)
+            if new:
+                yield new
+        self.pages_read.append(pages)
+        self.expected = self.results_count()
+        if self.expected != count:
+            # changed after the last pages were read; any page may be affected
+            changed = 0
+        return changed
+
+    def pages(self):
+        '''Generator of lists of pids not returned before, one list per
+        page of search results.'''
+        batch = self.client._start_batch('search_snapshot', workers=self.workers,
+                                         **self.search_opts)
+        last_page = None
+        try:
+            for n in range(self.max_passes):
+                self.passes += 1
+                changed = yield from self._pass(last_page, self.progress if n == 0 else None,
+                                                batch)
+                self._consistent = changed is None
+                if self.complete:
+                    return
+                # re-read the pages up to the last one that showed a change
+                last_page = changed or None
+                logger.warning('Search found %d of %d pids, with pids changing through %s; '
+                               'searching again for missed pids', len(self.seen), self.expected,
+                               'page %d' % last_page if last_page else 'the last page')
+            logger.warning('Search incomplete after %d passes: found %d of %d pids',
+                           self.passes, len(self.seen), self.expected)
+        finally:
+            if batch is not None:
+                batch.end()
+
+    def __iter__(self):
+        for results in self.pages():
+            for pid in results:
+                yield pid
+
+    def __len__(self):
+        'Number of pids returned so far.'
+        return len(self.seen)
@@ -0,0 +1,277 @@
+'''
+*"Not all those who wander are lost."* - **J. R. R. Tolkien**
+
+Module contains lightweight tracing for profiling pidman jobs end to end,
+modeled on `OpenTelemetry <https://opentelemetry.io/>`_ spans but without
+any dependencies.  A :class:`~pidservices.clients.PidmanRestClient`
+created with a :class:`Tracer` records a span for every API call (named
+for the logical operation, e.g. ``get_pid``; see
+:func:`pidservices.metrics.classify`), with child spans for sending the
+request (``transport``) and decoding the response (``decode``).  Batch
+and paginated operations, like
+:meth:`~pidservices.clients.PidmanRestClient.create_pids` and
+:meth:`~pidservices.clients.PidmanRestClient.iter_search_pages`, record
+a parent span for all of their API calls::
+
+    tracer = Tracer(FileExporter('trace.jsonl'))
+    client = PidmanRestClient(url, user, password, tracer=tracer)
+    with tracer.span('nightly import'):
+        ...
+    tracer.close()
+
+The active span is kept in a :mod:`contextvars` variable, which
+:class:`~pidservices.workers.WorkerPool` tasks inherit from the code that
+submitted them, so API calls made by worker threads are recorded in the
+right place.  Spans for API requests have kind :data:`CLIENT`; all
+other spans (batches, commands, and the steps of a request) are
+:data:`INTERNAL`.  Finished spans are passed to an exporter:
+:class:`FileExporter` writes JSON lines, and :class:`OTLPExporter` sends
+batches to an OpenTelemetry collector with OTLP/HTTP JSON.  *pidman*
+commands record a trace with ``--trace FILE`` or ``--trace URL``.
+'''
+
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_active = contextvars.ContextVar('pidservices_span', default=None)
+
+#: kind of span for an operation within the application
+INTERNAL = 'internal'
+#: kind of span for a request to a remote service
+CLIENT = 'client'
+
+# OpenTelemetry SpanKind values (SPAN_KIND_INTERNAL, SPAN_KIND_CLIENT)
+_OTLP_KINDS = {INTERNAL: 1, CLIENT: 3}
+
+
+def current_span():
+    '''The active :class:`Span` in this context, if any.'''
+    return _active.get()
+
+
+class Span(object):
+    '''A timed operation in a trace.  Created by :class:`Tracer`.
+
+    :param tracer: :class:`Tracer` the span belongs to
+    :param name: name of the operation
+    :param parent: parent span, if any
+    :param attributes: optional dictionary of attributes
+    :param kind: :data:`INTERNAL` or :data:`CLIENT`
+    '''
+
+    def __init__(self, tracer, name, parent=None, attributes=None, kind=INTERNAL):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start = time.time()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        '''Finish the span and export it; only the first call has any
+        effect.
+
+        :param error: exception that ended the operation, if any
+        '''
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.error = '%s: %s' % (type(error).__name__, error)
+        self.tracer._export(self)
+
+    @property
+    def duration(self):
+        'Duration in seconds, once the span has ended.'
+        if self.end_time is not None:
+            return self.end_time - self.start
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id, 'span_id': self.span_id,
+            'parent_id': self.parent_id, 'name': self.name, 'kind': self.kind,
+            'start': self.start, 'end': self.end_time,
+            'duration': self.duration, 'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Tracer(object):
+    '''Create spans and pass them to an exporter when they end.  Safe to
+    use from multiple threads.
+
+    :param exporter: object with ``export(spans)`` and ``close()`` methods,
+        e.g. :class:`FileExporter`; spans are kept in :attr:`spans`
+        if no exporter is given
+    '''
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        #: finished spans, when there is no exporter
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name, attributes=None, parent=None, kind=INTERNAL):
+        '''Start a span, without making it active; call
+        :meth:`Span.end` when the operation is done.
+
+        :param parent: parent span; defaults to the active span
+        :param kind: :data:`INTERNAL` or :data:`CLIENT`
+        '''
+        return Span(self, name, parent if parent is not None else _active.get(),
+                    attributes, kind)
+
+    @contextmanager
+    def activate(self, span):
+        '''Make a span the active span (the parent of new spans) for the
+        duration of a ``with`` block.'''
+        token = _active.set(span)
+        try:
+            yield span
+        finally:
+            _active.reset(token)
+
+    @contextmanager
+    def span(self, name, attributes=None, parent=None, kind=INTERNAL):
+        '''Record a span for the duration of a ``with`` block, as a child
+        of the active span (or of ``parent``).  Exceptions raised in the
+        block are recorded on the span.'''
+        span = self.start_span(name, attributes, parent, kind)
+        token = _active.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.end(err)
+            raise
+        finally:
+            _active.reset(token)
+            span.end()
+
+    def _export(self, span):
+        if self.exporter is None:
+            with self._lock:
+                self.spans.append(span)
+            return
+        try:
+            self.exporter.export([span])
+        except Exception as err:
+            # tracing should never break the job being traced
+            logger.error('Error exporting trace span %s: %s', span.name, err)
+
+    def close(self):
+        '''Flush and close the exporter.'''
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class FileExporter(object):
+    '''Write finished spans to a file, one JSON object per line.
+
+    :param path: file name; appended to if it exists
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.as_dict()) + '\n' for span in spans)
+        with self._lock:
+            self._file.write(lines)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OTLPExporter(object):
+    '''Send finished spans to an OpenTelemetry collector, using the OTLP
+    JSON encoding over HTTP.  Spans are sent in batches, from the thread
+    that ends the span that fills a batch, and when the exporter is
+    closed.
+
+    :param endpoint: collector URL, e.g. ``http://localhost:4318/v1/traces``
+    :param service: service name reported to the collector
+    :param batch_size: number of spans to send at once
+    :param timeout: request timeout in seconds
+    '''
+
+    def __init__(self, endpoint, service='pidmanclient', batch_size=100, timeout=10):
+        self.endpoint = endpoint
+        self.service = service
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._pending.extend(spans)
+            if len(self._pending) < self.batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self.send(batch)
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def encode(self, spans):
+        '''OTLP JSON request body for a list of spans.'''
+        otlp_spans = []
+        for span in spans:
+            info = {
+                'traceId': span.trace_id, 'spanId': span.span_id, 'name': span.name,
+                'kind': _OTLP_KINDS.get(span.kind, 1),
+                'startTimeUnixNano': str(int(span.start * 1e9)),
+                'endTimeUnixNano': str(int(span.end_time * 1e9)),
+                'attributes': [self._attribute(key, val)
+                               for key, val in sorted(span.attributes.items())],
+                # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+                'status': {'code': 2, 'message': span.error} if span.error else {},
+            }
+            if span.parent_id is not None:
+                info['parentSpanId'] = span.parent_id
+            otlp_spans.append(info)
+        return json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [self._attribute('service.name', self.service)]},
+            'scopeSpans': [{'scope': {'name': 'pidservices'}, 'spans': otlp_spans}],
+        }]})
+
+    def send(self, spans):
+        import requests
+        response = requests.post(self.endpoint, data=self.encode(spans), timeout=self.timeout,
+                                 headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+
+    def close(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            try:
+                self.send(batch)
+            except Exception as err:
+                # as in Tracer, tracing should never break the job being traced
+                logger.error('Error sending %d trace spans to %s: %s',
+                             len(batch), self.endpoint, err)
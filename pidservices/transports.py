@@ -0,0 +1,254 @@
+'''
+*"The medium is the message."* - **Marshall McLuhan**
+
+Module contains transports for :class:`~pidservices.clients.PidmanRestClient`:
+the objects that actually send HTTP requests to the Pid Manager.
+
+By default, a client uses a :class:`requests.Session`.  Any object with
+the same ``get``, ``put``, ``post`` and ``delete`` methods can be passed
+to the client as its ``transport`` instead; :class:`Transport` is a
+convenient base class, which only requires :meth:`Transport.request`.
+Transports accept the ``headers``, ``params``, ``data`` and ``auth``
+keyword arguments used by the client, and return a response with
+``status_code``, ``text``, ``json()`` and ``raise_for_status()`` (raising
+:class:`requests.exceptions.HTTPError`), like a :class:`requests.Response`.
+
+:class:`HTTP2Transport` uses `httpx <https://www.python-httpx.org/>`_
+(if installed) to multiplex concurrent requests from all worker threads
+over a single HTTP/2 connection, instead of opening a TLS connection per
+thread::
+
+    client = PidmanRestClient(url, user, password, transport=HTTP2Transport())
+
+:class:`RecordingTransport` saves every request and response made through
+another transport to a file (JSON lines, gzipped if the file name ends in
+``.gz``), and :class:`ReplayTransport` answers requests from such a file,
+optionally with synthetic latency.  A trace recorded once from a real
+server (e.g., a full search sweep with ``pidman export --record``) can
+then be replayed quickly and repeatably, to measure client-side overhead
+separately from server latency.  Credentials are not recorded.
+'''
+
+import gzip
+import io
+import itertools
+import json
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+
+class Response(object):
+    '''Response returned by transports that don't use :mod:`requests`.'''
+
+    def __init__(self, status_code, text='', headers=None, url=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.url = url
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        'Raise :class:`requests.exceptions.HTTPError` for an error status.'
+        if self.status_code >= 400:
+            from requests.exceptions import HTTPError
+            raise HTTPError('%s Error for url: %s' % (self.status_code, self.url),
+                            response=self)
+
+
+class Transport(object):
+    '''Base class for transports.  Subclasses implement :meth:`request`.'''
+
+    def request(self, method, url, headers=None, params=None, data=None, auth=None):
+        '''Send a request and return the response.
+
+        :param method: HTTP method, e.g. ``GET``
+        :param url: absolute URL
+        :param headers: dictionary of request headers
+        :param params: dictionary of query string parameters
+        :param data: request body: a dictionary of form data, or a string
+        :param auth: tuple of username and password for basic
+            authentication, if any
+        :returns: response object; see module documentation
+        '''
+        raise NotImplementedError
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        'Release any resources (e.g., open connections) held by the transport.'
+        pass
+
+
+class HTTP2Transport(Transport):
+    '''Transport using an :class:`httpx.Client` with HTTP/2 enabled.
+    Requests from any number of threads share a single multiplexed
+    connection to an HTTP/2 server (which in practice means an ``https``
+    pidman URL); with an HTTP/1.1 server, this falls back to a pool of
+    keep-alive connections.  Requires ``httpx`` with HTTP/2 support
+    (``pip install httpx[http2]``).
+
+    :param http2: enable HTTP/2
+    :param http1: allow HTTP/1.1; with ``http1=False``, HTTP/2 is used
+        with prior knowledge, even for ``http`` URLs (cleartext HTTP/2,
+        e.g. with :class:`~pidservices.benchmark.StandInServer`)
+    :param max_connections: maximum number of connections to open
+    :param timeout: request timeout in seconds
+    :param verify: verify SSL certificates
+    :param client: optional preconfigured :class:`httpx.Client`; overrides
+        other options
+    '''
+
+    def __init__(self, http2=True, max_connections=10, timeout=30, verify=True,
+                 client=None, http1=True):
+        try:
+            import httpx
+        except ImportError:
+            raise Exception('HTTP/2 transport requires httpx (pip install httpx[http2])')
+        self.httpx = httpx
+        if client is None:
+            from pidservices import __version__
+            client = httpx.Client(http1=http1, http2=http2, timeout=timeout, verify=verify,
+                limits=httpx.Limits(max_connections=max_connections),
+                headers={'User-Agent': 'pidmanclient/%s (httpx/%s)'
+                         % (__version__, httpx.__version__)})
+        self.client = client
+
+    def request(self, method, url, headers=None, params=None, data=None, auth=None):
+        from requests import exceptions
+        options = {}
+        if isinstance(data, dict):
+            options['data'] = data
+        elif data is not None:
+            options['content'] = data
+        try:
+            response = self.client.request(method, url, headers=headers, params=params,
+                                           auth=auth, **options)
+        # convert errors to the requests exceptions callers expect
+        except self.httpx.TimeoutException as err:
+            raise exceptions.Timeout(str(err))
+        except self.httpx.TransportError as err:
+            raise exceptions.ConnectionError(str(err))
+        return Response(response.status_code, response.text, response.headers,
+                        str(response.url))
+
+    def close(self):
+        self.client.close()
+
+
+def _open(path, mode):
+    # text file, gzipped if the name ends in .gz
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.GzipFile(path, mode + 'b', mtime=0),
+                                encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def request_key(method, url, params=None, data=None):
+    '''Normalized form of a request, used to match replayed requests to
+    recorded ones: method, URL with query string parameters in sorted
+    order, and request body (form data in sorted order).'''
+    parsed = urlparse(url)
+    query = sorted(parse_qsl(parsed.query) + [(key, str(val)) for key, val
+                                              in (params or {}).items()])
+    url = urlunparse(parsed._replace(query=urlencode(query)))
+    if isinstance(data, dict):
+        data = urlencode(sorted((key, str(val)) for key, val in data.items()))
+    return method, url, data or ''
+
+
+class RecordingTransport(Transport):
+    '''Transport that records requests and responses to a file, for
+    :class:`ReplayTransport`, while passing them through to another
+    transport.  Call :meth:`close` to finish writing the file.
+
+    :param path: file to record to; gzipped if the name ends in ``.gz``
+    :param transport: transport (or :class:`requests.Session`) to send
+        requests with; by default, a new :class:`requests.Session`
+    '''
+
+    def __init__(self, path, transport=None):
+        if transport is None:
+            import requests
+            transport = requests.Session()
+        self.transport = transport
+        self.path = path
+        self._file = _open(path, 'w')
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None, auth=None):
+        start = time.time()
+        response = getattr(self.transport, method.lower())(url, headers=headers,
+            params=params, data=data, auth=auth)
+        elapsed = time.time() - start
+        method, url, body = request_key(method, url, params, data)
+        record = json.dumps({'method': method, 'url': url, 'body': body,
+                             'status': response.status_code, 'text': response.text,
+                             'elapsed': round(elapsed, 6)})
+        with self._lock:
+            self._file.write(record + '\n')
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    '''Transport that answers requests with the responses saved by
+    :class:`RecordingTransport`.  Requests are matched by method, URL,
+    query string and body (see :func:`request_key`); if the same request
+    was recorded more than once, the recorded responses are returned in
+    order, starting over when they run out, so a trace can be replayed
+    any number of times.  A request that was not recorded raises an
+    exception.
+
+    :param path: recorded file
+    :param latency: seconds to wait before each response
+    :param scale: also wait this fraction of the time each response took
+        when it was recorded, e.g. 1 to replay at the recorded speed
+    '''
+
+    def __init__(self, path, latency=0, scale=0):
+        self.path = path
+        self.latency = latency
+        self.scale = scale
+        recorded = {}
+        with _open(path, 'r') as trace:
+            for line in trace:
+                record = json.loads(line)
+                key = (record['method'], record['url'], record['body'])
+                recorded.setdefault(key, []).append(
+                    (Response(record['status'], record['text'], url=record['url']),
+                     record.get('elapsed', 0)))
+        #: number of recorded requests
+        self.recorded = sum(len(responses) for responses in recorded.values())
+        self._responses = dict((key, itertools.cycle(responses))
+                               for key, responses in recorded.items())
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, params=None, data=None, auth=None):
+        key = request_key(method, url, params, data)
+        try:
+            responses = self._responses[key]
+        except KeyError:
+            raise Exception('No recorded response for %s %s' % key[:2])
+        with self._lock:
+            response, elapsed = next(responses)
+        delay = self.latency + self.scale * elapsed
+        if delay:
+            time.sleep(delay)
+        return response
@@ -0,0 +1,154 @@
+'''
+*"Many hands make light work."* - **John Heywood**
+
+Module contains a small thread pool used to run pidman API calls
+concurrently.  Most of the time spent in a bulk pidman operation is waiting
+on the network, so a handful of threads sharing one
+:class:`~pidservices.clients.PidmanRestClient` is enough to keep the server
+busy without pulling in any dependencies.
+'''
+
+from collections import deque
+import contextvars
+import queue
+import sys
+import threading
+
+
+class Task(object):
+    '''A unit of work submitted to a :class:`WorkerPool`.  Stores the
+    return value or the exception raised by the function, and lets the
+    caller wait for either.  Tasks run in a copy of the :mod:`contextvars`
+    context they were created in (e.g., with the active tracing span).'''
+
+    def __init__(self, func, args=(), kwargs=None, callback=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.callback = callback
+        self.context = contextvars.copy_context()
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def run(self):
+        try:
+            self._value = self.context.run(self.func, *self.args, **self.kwargs)
+        except Exception:
+            self._error = sys.exc_info()
+        self._done.set()
+        if self.callback is not None:
+            self.callback(self)
+
+    def done(self):
+        'True once the task has finished running (successfully or not).'
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        '''Wait for the task to finish and return its value.  If the task
+        raised an exception, it is re-raised here.'''
+        self._done.wait(timeout)
+        if self._error is not None:
+            raise self._error[1].with_traceback(self._error[2])
+        return self._value
+
+
+class WorkerPool(object):
+    '''Pool of daemon worker threads for running pidman API calls
+    concurrently.
+
+    With ``workers=1`` (or less) no threads are started and tasks run
+    inline in the calling thread, which keeps serial runs simple to debug.
+
+    :param workers: number of worker threads to run
+    '''
+
+    def __init__(self, workers=4):
+        self.workers = max(int(workers or 1), 1)
+        self._queue = queue.Queue()
+        self._threads = []
+        if self.workers > 1:
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                    name='pidservices-worker-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task.run()
+
+    def submit(self, func, *args, **kwargs):
+        '''Schedule ``func(*args, **kwargs)`` to run on the pool.
+
+        :returns: :class:`Task`
+        '''
+        return self._schedule(Task(func, args, kwargs))
+
+    def _schedule(self, task):
+        if self._threads:
+            self._queue.put(task)
+        else:
+            task.run()
+        return task
+
+    def imap(self, func, iterable, window=None, ordered=True):
+        '''Apply ``func`` to every item in ``iterable``, yielding the
+        results as they become available.
+
+        Unlike :meth:`multiprocessing.pool.ThreadPool.imap`, the input is
+        consumed lazily: no more than ``window`` items are pending at any
+        time, so memory use stays bounded no matter how long the input is.
+
+        :param func: function taking a single item
+        :param iterable: items to process
+        :param window: maximum number of items in flight; defaults to
+            twice the number of workers
+        :param ordered: if True (the default), results are yielded in input
+            order; otherwise, in completion order
+        '''
+        if window is None:
+            window = self.workers * 2
+        window = max(window, 1)
+        items = iter(iterable)
+
+        if ordered:
+            pending = deque()
+            for item in items:
+                pending.append(self.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+            return
+
+        # unordered: finished tasks report themselves on a shared queue
+        finished = queue.Queue()
+        in_flight = 0
+        for item in items:
+            self._schedule(Task(func, (item,), callback=finished.put))
+            in_flight += 1
+            if in_flight >= window:
+                yield finished.get().result()
+                in_flight -= 1
+        while in_flight:
+            yield finished.get().result()
+            in_flight -= 1
+
+    def close(self):
+        '''Stop the worker threads once any queued tasks have run.'''
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
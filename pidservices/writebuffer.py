@@ -0,0 +1,169 @@
+'''
+*"Never put off till tomorrow what may be done day after tomorrow just
+as well."* - **Mark Twain**
+
+Module contains :class:`WriteBuffer`, a write-buffer mode for
+:class:`~pidservices.clients.PidmanRestClient`.  While a client is
+buffering, calls to
+:meth:`~pidservices.clients.PidmanRestClient.update_pid` and
+:meth:`~pidservices.clients.PidmanRestClient.update_target` are queued
+instead of sent; updates to the same pid or target are merged into one
+request, and queued updates are sent concurrently when the buffer is
+full, when the oldest update has waited long enough, and when buffering
+ends::
+
+    with client.buffer_writes(size=500, delay=5, workers=8) as buffer:
+        for noid in noids:
+            client.update_ark_target(noid, active=False)
+            client.update_ark_target(noid, target_uri=new_uri(noid))
+    print('%d updates in %d requests' % (buffer.updates, buffer.requests))
+
+Buffered calls return None rather than the updated pid or target, and
+errors are not raised to the caller: failed updates are logged and
+recorded in :attr:`WriteBuffer.failed`.
+'''
+
+from collections import OrderedDict
+import json
+import logging
+import threading
+import time
+
+from pidservices.workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer(object):
+    '''Queue and coalesce pid and target updates for a client; see module
+    documentation.  Use :meth:`PidmanRestClient.buffer_writes
+    <pidservices.clients.PidmanRestClient.buffer_writes>` to create one.
+
+    :param client: :class:`~pidservices.clients.PidmanRestClient`
+    :param size: send queued updates when this many pids or targets have
+        updates queued
+    :param delay: send queued updates when the oldest has been queued
+        for this many seconds; None to only send when full or finished
+    :param workers: number of updates to send concurrently
+    '''
+
+    def __init__(self, client, size=100, delay=5, workers=4):
+        self.client = client
+        self.size = size
+        self.delay = delay
+        self.workers = workers
+        #: number of updates queued
+        self.updates = 0
+        #: number of update requests sent
+        self.requests = 0
+        #: list of (url, fields, exception) for updates that failed
+        self.failed = []
+        self._pending = OrderedDict()
+        self._oldest = None
+        self._lock = threading.Lock()
+        # only one flush at a time, so updates to a url are sent in order
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''Start buffering the client's updates.'''
+        self._closed.clear()
+        self.client.write_buffer = self
+        if self.delay is not None:
+            self._thread = threading.Thread(target=self._run, name='pidservices-write-buffer')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def add(self, url, fields, expected_response):
+        '''Queue an update, merging it with any update already queued for
+        the same url.  Called by the client.
+
+        :param url: API url of the pid or target
+        :param fields: dictionary of fields to update
+        :param expected_response: expected response status code(s)
+        '''
+        with self._lock:
+            self.updates += 1
+            queued = self._pending.get(url)
+            if queued is None:
+                self._pending[url] = (dict(fields), expected_response)
+            else:
+                queued[0].update(fields)
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = len(self._pending) >= self.size
+        if full:
+            # flush in the caller's thread, so a fast producer waits for
+            # the server instead of queueing without limit
+            self.flush()
+
+    def __len__(self):
+        'Number of pids and targets with updates queued.'
+        return len(self._pending)
+
+    def _send(self, item):
+        url, (fields, expected_response) = item
+        from requests.exceptions import RequestException
+        try:
+            self.client.put(url, body=json.dumps(fields), expected_response=expected_response)
+        except RequestException as err:
+            return url, fields, err
+        return url, fields, None
+
+    def flush(self):
+        '''Send all queued updates, concurrently, and wait for them to
+        finish.
+
+        :returns: list of (url, fields, exception) for failed updates
+        '''
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                self._oldest = None
+            if not pending:
+                return []
+            failed = []
+            batch = self.client._start_batch('flush_writes', updates=len(pending))
+            try:
+                with self.client._in_batch(batch):
+                    with WorkerPool(self.workers) as pool:
+                        for url, fields, err in pool.imap(self._send, pending.items(),
+                                                          ordered=False):
+                            if err is not None:
+                                logger.error('Error updating %s with %s: %s', url, fields, err)
+                                failed.append((url, fields, err))
+            finally:
+                if batch is not None:
+                    batch.end()
+            with self._lock:
+                self.requests += len(pending)
+                self.failed.extend(failed)
+            return failed
+
+    def _run(self):
+        # flush updates that have waited too long
+        while not self._closed.is_set():
+            oldest = self._oldest
+            wait = self.delay if oldest is None else oldest + self.delay - time.time()
+            if wait <= 0:
+                self.flush()
+            else:
+                self._closed.wait(wait)
+
+    def close(self):
+        '''Stop buffering, and send any queued updates.'''
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.client.write_buffer is self:
+            self.client.write_buffer = None
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -11,12 +11,10 @@
 #   for top level object see link (getDatastreamDissemination)
 
 import sys
-import httplib
 import json
-import urllib2
-from urlparse import parse_qs
+import urllib.parse
+from urllib.parse import parse_qs
 import getopt
-import urlparse
 import re
 
 from pidservices.clients import PidmanRestClient, is_ark, parse_ark
@@ -25,9 +23,9 @@ def main():
   
   try:
       opts, args = getopt.getopt(sys.argv[1:], "hf:", ["--help", "--url", "--port"])
-  except getopt.GetoptError, err:
+  except getopt.GetoptError as err:
       # print help information and exit:
-      print str(err) 
+      print(str(err)) 
       usage()
       sys.exit(2)
 
@@ -55,7 +53,7 @@ def main():
     # validate that each arg starts with http and ends with a port number
     validate(old_fedora_base, new_fedora_base)     
   else:
-    print '\nError: argument list incomplete. See usage example below.'
+    print('\nError: argument list incomplete. See usage example below.')
     usage()
     sys.exit()
   
@@ -74,20 +72,20 @@ def main():
   page_link_1 = search_results['first_page_link']
   page_link = page_link_1[0:-1]
   
-  print "\n=> Processing page[%d] that contains [%d] of a total of [%d] pages ..." %(current_page, max, total_pages)
+  print("\n=> Processing page[%d] that contains [%d] of a total of [%d] pages ..." %(current_page, max, total_pages))
   page_results = search_results['results']
   count = process_page(current_page, page_results)
   current_page = current_page + 1  
   while (current_page <= total_pages):
     search_results = client.search_pids(type='ark', domain='LSDI', page=current_page, count=max)
     page_results = search_results['results']    
-    print "\n=> Processing page[%d] of [%d] that contains [%d] arks." \
-          %(current_page, total_pages, max)
+    print("\n=> Processing page[%d] of [%d] that contains [%d] arks." \
+          %(current_page, total_pages, max))
     upd_count = process_page(current_page, page_results)
     count = count + upd_count    
     current_page = current_page + 1
 
-  print "\n=> All done, total updated arks for LSDI = [%d]." % count
+  print("\n=> All done, total updated arks for LSDI = [%d]." % count)
   sys.exit()
 
 def process_page(page, results):
@@ -102,7 +100,7 @@ def process_page(page, results):
       target_uri = tg['target_uri'] 
         
       if (target_uri.find("fedora")>0):
-        tup = urlparse.urlparse(target_uri)             
+        tup = urllib.parse.urlparse(target_uri)             
         m = re.search('fedora/get/(^/$)/?', tup[2])
         n = tup[2].split("/")
         old_url = tup[0] + "://" + tup[1]
@@ -122,7 +120,7 @@ def process_page(page, results):
           wrongfedorabasecount = wrongfedorabasecount + 1
       else: # There is no 'fedora' pattern match for the target_uri
         na_count = na_count + 1
-  print "   Page [%d] results: Updated[%d] WrongFedoraBase[%d] N/A[%d]." % (page, updatedcount, wrongfedorabasecount, na_count)
+  print("   Page [%d] results: Updated[%d] WrongFedoraBase[%d] N/A[%d]." % (page, updatedcount, wrongfedorabasecount, na_count))
   return updatedcount
     
  
@@ -136,7 +134,7 @@ def validate(old_fedora_base, new_fedora_base):
     show_error('Error: first argument <old_base_url> must end with port number')
   
 def show_error(err):
-  print err
+  print(err)
   usage()
   sys.exit() 
       
@@ -147,7 +145,7 @@ def usage():
   msg = msg + bold + 'Description:' + bold_off + ' Update the lsdi domain arks for fedora 3.4 migration.\n'    
   msg = msg + bold + 'Usage:' + bold_off + ' migrate_lsdi_arks.py  <old_base_url> <new_base_url> <pid username> <pid password> <pid manager url>.\n'
   msg = msg + bold + 'Example:' + bold_off + ' migrate_lsdi_arks.py "https://dev11.library.emory.edu:8443" "https://dev11.library.emory.edu:8943" "username" "password" "https://testpid.library.emory.edu/"\n'    
-  print msg
+  print(msg)
   sys.exit() 
     
 if __name__ == "__main__":
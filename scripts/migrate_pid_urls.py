@@ -3,12 +3,10 @@
 # Script to find and replace netloc of pids in a given domain.
 
 import sys
-import httplib
 import json
-import urllib2
-from urlparse import parse_qs
+import urllib.parse
+from urllib.parse import parse_qs
 import getopt
-import urlparse
 import re
 
 from pidservices.clients import PidmanRestClient
@@ -18,9 +16,9 @@ def main():
   
   try:
       opts, args = getopt.getopt(sys.argv[1:], "hu:", ["--help", "--url1", "--url2"])
-  except getopt.GetoptError, err:
+  except getopt.GetoptError as err:
       # print help information and exit:
-      print str(err) 
+      print(str(err)) 
       usage()
       sys.exit(2)
 
@@ -38,7 +36,7 @@ def main():
     sys.exit()
       
   if (len(args)==5 or len(args)==6):
-    print str(args)
+    print(str(args))
   
     old_netloc = args[0]
     new_netloc = args[1]
@@ -51,7 +49,7 @@ def main():
       db_baseurl = 'https://testpid.library.emory.edu/'
        
   else:
-    print '\nError: argument list incomplete. See usage example below.'
+    print('\nError: argument list incomplete. See usage example below.')
     usage()
     sys.exit()
   
@@ -67,7 +65,7 @@ def main():
   total_pages = search_results['page_count']
   
   page_results = search_results['results']
-  print "\n=> Processing page[%d] that contains [%d] of a total of [%d] pages..." %(current_page, max, total_pages)
+  print("\n=> Processing page[%d] that contains [%d] of a total of [%d] pages..." %(current_page, max, total_pages))
   
   count = process_page(current_page, page_results)
 
@@ -76,13 +74,13 @@ def main():
     #search_results = client.search_pids(type='purl', domain='General purchased collections', page=current_page, count=max)
     search_results = client.search_pids(type='purl', domain=domain, page=current_page, count=max)
     page_results = search_results['results']
-    print "\n=> Processing page[%d] of [%d] that contains [%d] pids." \
-          %(current_page, total_pages, max)
+    print("\n=> Processing page[%d] of [%d] that contains [%d] pids." \
+          %(current_page, total_pages, max))
     upd_count = process_page(current_page, page_results)
     count = count + upd_count    
     current_page = current_page + 1
 
-  print "\n=> All done, total updated pids = [%d]." % count
+  print("\n=> All done, total updated pids = [%d]." % count)
   sys.exit()
 
 def process_page(page, results):
@@ -94,11 +92,11 @@ def process_page(page, results):
     for tg in targets:
       all_count = all_count + 1
       target_uri = tg['target_uri']
-      scheme = str(urlparse.urlparse(target_uri).scheme)
-      path = str(urlparse.urlparse(target_uri).path)
-      params = str(urlparse.urlparse(target_uri).params)
-      query = str(urlparse.urlparse(target_uri).query)
-      fragment = str(urlparse.urlparse(target_uri).fragment)
+      scheme = str(urllib.parse.urlparse(target_uri).scheme)
+      path = str(urllib.parse.urlparse(target_uri).path)
+      params = str(urllib.parse.urlparse(target_uri).params)
+      query = str(urllib.parse.urlparse(target_uri).query)
+      fragment = str(urllib.parse.urlparse(target_uri).fragment)
       
       if target_uri.find(old_netloc) > 0:
         new_url = scheme + "://" + new_netloc
@@ -115,11 +113,11 @@ def process_page(page, results):
         updatedcount += 1
 
       
-  print "   Page [%d] results: Updated[%d]." % (page, updatedcount)
+  print("   Page [%d] results: Updated[%d]." % (page, updatedcount))
   return updatedcount
   
 def show_error(err):
-  print err
+  print(err)
   usage()
   sys.exit() 
       
@@ -130,7 +128,7 @@ def usage():
   msg = msg + bold + 'Description:' + bold_off + ' Find and replace pid urls.\n'    
   msg = msg + bold + 'Usage:' + bold_off + ' migrate_pid_urls.py <old_base_domain> <new_base_domain> <pid username> <pid password> <domain> <pid manager url>.\n'
   msg = msg + bold + 'Example:' + bold_off + ' migrate_pid_urls.py "www.lexisnexis.com" "congressional.proquest.com" "username" "password" "General purchased collections" "https://testpid.library.emory.edu/"\n'    
-  print msg
+  print(msg)
   sys.exit() 
     
 if __name__ == "__main__":
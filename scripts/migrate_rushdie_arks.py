@@ -11,12 +11,9 @@
 #   for top level object see link (getDatastreamDissemination)
 
 import sys
-import httplib
 import json
-import urllib2
-from urlparse import parse_qs
+from urllib.parse import parse_qs
 import getopt
-import urlparse
 import re
 
 from eulcore.fedora import Repository
@@ -24,8 +21,8 @@ from eulcore.fedora.models import ContentModel
 from eulcore.fedora.models import DigitalObject
 from rdflib import Namespace
 
-import urllib2
-from urllib2 import URLError
+import urllib.request, urllib.error, urllib.parse
+from urllib.error import URLError
 
 from pidservices.clients import PidmanRestClient, is_ark, parse_ark
 
@@ -33,9 +30,9 @@ def main():
   
   try:
       opts, args = getopt.getopt(sys.argv[1:], "hf:", ["--help", "--url", "--port"])
-  except getopt.GetoptError, err:
+  except getopt.GetoptError as err:
       # print help information and exit:
-      print str(err) 
+      print(str(err)) 
       usage()
       sys.exit(2)
 
@@ -65,7 +62,7 @@ def main():
     # validate that each arg starts with http and ends with a port number
     validate(new_url_base, fedora_url)     
   else:
-    print '\nError: argument list incomplete. See usage example below.'
+    print('\nError: argument list incomplete. See usage example below.')
     usage()
     sys.exit()
 
@@ -90,20 +87,20 @@ def main():
   page_link_1 = search_results['first_page_link']
   page_link = page_link_1[0:-1]
   
-  print "\n=> Processing page[%d] that contains [%d] of a total of [%d] pages ..." %(current_page, max, total_pages)
+  print("\n=> Processing page[%d] that contains [%d] of a total of [%d] pages ..." %(current_page, max, total_pages))
   page_results = search_results['results']
   count = process_page(current_page, page_results)
   current_page = current_page + 1  
   while (current_page <= total_pages):
     search_results = client.search_pids(type='ark', domain='Rushdie Collection', page=current_page, count=max)
     page_results = search_results['results']    
-    print "\n=> Processing page[%d] of [%d] that contains [%d] arks." \
-          %(current_page, total_pages, max)
+    print("\n=> Processing page[%d] of [%d] that contains [%d] arks." \
+          %(current_page, total_pages, max))
     upd_count = process_page(current_page, page_results)
     count = count + upd_count    
     current_page = current_page + 1
 
-  print "\n=> All done, total updated arks for Rushdie = [%d]." % count
+  print("\n=> All done, total updated arks for Rushdie = [%d]." % count)
   sys.exit()
 
 def process_page(page, results):
@@ -125,10 +122,10 @@ def process_page(page, results):
               #Plug objects into the webapp and make sure we don't get an error.
               returnCode = 0
               try:
-                  HTTPresponse = urllib2.urlopen(new_target_uri)
+                  HTTPresponse = urllib.request.urlopen(new_target_uri)
                   htmlResult = HTTPresponse.read()
                   returnCode = HTTPresponse.code
-              except URLError, e:
+              except URLError as e:
                   htmlResult = e.read()
                   returnCode = e.code
                   
@@ -139,7 +136,7 @@ def process_page(page, results):
                   #Object exists in fedora and is accessible in the webapp, update it to point to the documents of the webapp.
                   target_result = client.update_ark_target(itemid, target_uri=new_target_uri, active=True)
               else:
-                  print "oooppss.... some unexpected return code has been detected."
+                  print("oooppss.... some unexpected return code has been detected.")
           else:
               #Object doesn't exist (likely removed due to sensitivity concerns of the information). Leave its ARK, but mark inactive.
               target_result = client.update_ark_target(itemid, active=False)
@@ -156,7 +153,7 @@ def validate(new_url_base, fedora_url_base):
     show_error('Error: first argument <fedora_url> must begin with "https"')
   
 def show_error(err):
-  print err
+  print(err)
   usage()
   sys.exit() 
       
@@ -167,7 +164,7 @@ def usage():
   msg = msg + bold + 'Description:' + bold_off + ' Update the rushdie domain arks to the webapp.\n'    
   msg = msg + bold + 'Usage:' + bold_off + ' migrate_rushdie_arks.py  <new_base_url> <pid username> <pid password> <pid manager url> <fedora_url> <fedora_username> <fedora_password>.\n'
   msg = msg + bold + 'Example (quotes required):' + bold_off + ' migrate_lsdi_arks.py "https://marbl.library.emory.edu/collections/rushdie/documents/" "pid_manager_username" "pid_manager_password" "https://testpid.library.emory.edu/" "https://fedora.library.emory.edu:8443/fedora/" "fedoraAdmin" "fedora_password"\n'    
-  print msg
+  print(msg)
   sys.exit() 
     
 if __name__ == "__main__":
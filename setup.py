@@ -1,14 +1,36 @@
+import re
+
 from setuptools import setup
-import pidservices
+
+
+def package_info():
+    # read version and author information without importing the package
+    with open('pidservices/__init__.py') as init:
+        source = init.read()
+    info = dict(re.findall(r'^__(\w+)__ = "([^"]*)"', source, re.M))
+    version_info = re.search(r'^__version_info__ = \((.*)\)', source, re.M).group(1)
+    version_info = [part.strip().strip("'") for part in version_info.split(',')]
+    info['version'] = '.'.join(version_info[:-1])
+    if version_info[-1] != 'None':
+        info['version'] += '-%s' % version_info[-1]
+    return info
+
+info = package_info()
 
 setup(
     name='pidservices',
-    version=pidservices.__version__,
-    author=pidservices.__author__,
-    author_email=pidservices.__email__,
-    packages=['pidservices', 'pidservices.djangowrapper'],
+    version=info['version'],
+    author=info['author'],
+    author_email=info['email'],
+    packages=['pidservices', 'pidservices.djangowrapper',
+              'pidservices.djangowrapper.templatetags'],
     install_requires=[
         'requests',
     ],
-    scripts=['scripts/allocate_pids',],
+    python_requires='>=3.7',
+    scripts=['scripts/allocate_pids', 'scripts/export_pids',
+             'scripts/import_pids'],
+    entry_points={
+        'console_scripts': ['pidman = pidservices.cli:main'],
+    },
 )
@@ -5,11 +5,19 @@
 
 """
 
+import csv
+import gzip
 import json
+import os
+import shutil
+from io import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-import urllib2
-from urlparse import parse_qs
-from mock import patch, MagicMock
+from unittest.mock import patch, MagicMock
 import requests
 
 # from django.core.management import setup_environ
@@ -21,7 +29,21 @@ settings.configure(
 )
 
 from pidservices.clients import PidmanRestClient, is_ark, parse_ark
+from pidservices.djangowrapper import minting, resolve, shortcuts
 from pidservices.djangowrapper.shortcuts import DjangoPidmanRestClient
+from pidservices import benchmark, cli, export, importer, linkcheck, scheduler, transports
+from pidservices.fake import FakePidman
+from pidservices.metrics import ClientMetrics, LatencyHistogram, classify
+from pidservices import tracing
+from pidservices.progress import ProgressReporter
+from pidservices import planner
+from pidservices.domains import DomainNotFound, DomainTree
+from pidservices.paging import PageSizeTuner, aligned_size
+from pidservices.snapshot import SearchSnapshot
+from pidservices.noids import NoidSet, decode_noid, encode_noid
+from pidservices import diff
+from pidservices.pool import PidPool
+from pidservices.workers import WorkerPool
 
 # Mock httplib so we don't need an actual server to test against.
 class MockHttpResponse():
@@ -67,6 +89,13 @@ class MockHttplib:
         self.url = url
         self.connection = MockHttpConnection()
 
+class CommandTestMixin(object):
+    'Helper for tests that run pidman subcommands.'
+
+    def _run(self, argv):
+        args = cli.get_parser().parse_args(argv)
+        return args.command_obj.run(args)
+
 # Test the normal pidman client.
 
 class PidmanRestClientTest(unittest.TestCase):
@@ -106,6 +135,14 @@ class PidmanRestClientTest(unittest.TestCase):
             '/pidman',
             'Path not correctly set when baseurl specified with trailing slash')
 
+        # each client has its own base url
+        other = PidmanRestClient('https://other.host/')
+        client = self._new_client()
+        self.assertEqual('https://other.host/ark/1fx',
+                         other.absolute_url(other._pid_url('ark', '1fx')))
+        self.assertEqual('http://brutus.library.emory.edu/pidman/ark/1fx/PDF',
+                         client.absolute_url(client._target_url('ark', '1fx', 'PDF')))
+
     def test_search_pids(self):
         """Tests the REST return for searching pids."""
         # Be a normal return.
@@ -136,7 +173,7 @@ class PidmanRestClientTest(unittest.TestCase):
             data = data_client.list_domains()
             self.assertTrue(data, "No data returned when listing domains.")
             call_args = self.mock_get.call_args
-            self.assert_('auth' not in call_args,
+            self.assertTrue('auth' not in call_args,
                 'authentication should not be passed when listing domains')
 
         # This should error
@@ -153,13 +190,13 @@ class PidmanRestClientTest(unittest.TestCase):
         with patch.object(client, 'session') as mocksession:
             mocksession.post = self.mock_post
             response = self.mock_post.return_value
-            response.content = ''
+            response.text = ''
             response.status_code = requests.codes.created
             client.create_domain('Test Domain')
             # I'm actually just testing that this doesn't throw an error.
             self.mock_post.assert_called()
             args, kwargs = self.mock_post.call_args
-            self.assert_('auth' in kwargs,
+            self.assertTrue('auth' in kwargs,
                 'authentication should be passed when creating a new domain')
             self.assertEqual('text/plain', kwargs['headers']['Accept'],
                 'Accept header should be set to text/plain when creating a new domain')
@@ -194,7 +231,7 @@ class PidmanRestClientTest(unittest.TestCase):
             domain = client.update_domain(domain_id, name=name)
             self.mock_put.assert_called()
             args, kwargs = self.mock_put.call_args
-            self.assert_('auth' in kwargs,
+            self.assertTrue('auth' in kwargs,
                 'auth header is passed when updating a domain')
             self.assertEqual(name, json.loads(kwargs['data'])['name'])
 
@@ -218,7 +255,7 @@ class PidmanRestClientTest(unittest.TestCase):
         with patch.object(client, 'session') as mocksession:
             mocksession.post = self.mock_post
             response = self.mock_post.return_value
-            response.content = new_purl
+            response.text = new_purl
             response.status_code = requests.codes.created
 
             # minimum required parameters
@@ -228,10 +265,10 @@ class PidmanRestClientTest(unittest.TestCase):
 
             args, kwargs = self.mock_post.call_args
             url = args[0]
-            self.assert_(url.endswith('/purl/'),
+            self.assertTrue(url.endswith('/purl/'),
                 'create_pid posts to expected url for new purl; should end with /purl/')
 
-            self.assert_('auth' in kwargs,
+            self.assertTrue('auth' in kwargs,
                         'auth header is passed when creating a pid')
             self.assertEqual('text/plain', kwargs['headers']['Accept'],
                 'Accept header should be set to text/plain when creating a new pid')
@@ -245,22 +282,22 @@ class PidmanRestClientTest(unittest.TestCase):
             self.assertEqual(target, params['target_uri'],
                 'expected target uri value set in posted data')
             # unspecified parameters should not be set in request
-            self.assert_('name' not in params,
+            self.assertTrue('name' not in params,
                 'unspecified parameter (name) not set in posted values')
-            self.assert_('external_system_id' not in params,
+            self.assertTrue('external_system_id' not in params,
                 'unspecified parameter (external system) not set in posted values')
-            self.assert_('external_system_key' not in params,
+            self.assertTrue('external_system_key' not in params,
                 'unspecified parameter (external system key) not set in posted values')
-            self.assert_('policy' not in params,
+            self.assertTrue('policy' not in params,
                 'unspecified parameter (policy) not set in posted values')
-            self.assert_('proxy' not in params,
+            self.assertTrue('proxy' not in params,
                 'unspecified parameter (proxy) not set in posted values')
-            self.assert_('qualifier' not in params,
+            self.assertTrue('qualifier' not in params,
                 'unspecified parameter (qualifier) not set in posted values')
 
             # handle unicode characters in pid titles
             created = client.create_pid('purl', domain, target, u'unicode \u2026 in title')
-            self.assert_(created, 'craete_pid succeeds when title contains non-ascii unicode')
+            self.assertTrue(created, 'craete_pid succeeds when title contains non-ascii unicode')
 
             # all parameters
             name, ext_sys, ext_id, qual = 'my new pid', 'EUCLID', 'ocm1234', 'q'
@@ -271,7 +308,7 @@ class PidmanRestClientTest(unittest.TestCase):
             args, kwargs = self.mock_post.call_args
 
             url = args[0]
-            self.assert_(url.endswith('/ark/'),
+            self.assertTrue(url.endswith('/ark/'),
                 'create_pid posts to expected url for new ark; should end with /ark/')
 
             args, kwargs = self.mock_post.call_args
@@ -293,10 +330,9 @@ class PidmanRestClientTest(unittest.TestCase):
             # 400 - bad request
             self.mock_post.return_value.status_code = requests.codes.bad_request
             # when response has body text, should be included in error
-            # (can't figure out how to test this in python 2.6; use assertRaisesRegex in 2.7)
-            self.mock_post.return_value.content = 'Error: Could not resolve domain URI'
-            self.assertRaises(requests.exceptions.HTTPError, client.create_pid, 'ark', 'domain-2',
-                            'http://pid.com/')
+            self.mock_post.return_value.text = 'Error: Could not resolve domain URI'
+            self.assertRaisesRegex(requests.exceptions.HTTPError, 'Could not resolve domain URI',
+                                   client.create_pid, 'ark', 'domain-2', 'http://pid.com/')
 
         # invalid pid type should cause an exception
         self.assertRaises(Exception, client.create_pid, 'faux-pid')
@@ -324,7 +360,7 @@ class PidmanRestClientTest(unittest.TestCase):
 
             args, kwargs = self.mock_get.call_args
             url = args[0]
-            self.assert_(url.endswith('/purl/aa'),
+            self.assertTrue(url.endswith('/purl/aa'),
                 'get_pid requests expected url; should end with /purl/aa')
 
             # 404 - pid not found
@@ -355,17 +391,17 @@ class PidmanRestClientTest(unittest.TestCase):
             args, kwargs = self.mock_get.call_args
             # expected, got = '/pidman/purl/aa/', client.connection.url
             url = args[0]
-            self.assert_(url.endswith('/purl/aa/'),
+            self.assertTrue(url.endswith('/purl/aa/'),
                 'get_target requests expected url; should end with /purl/aa/')
 
-            self.assert_('auth' not in kwargs,
+            self.assertTrue('auth' not in kwargs,
                 'auth header is not passed when accessing a target')
 
             # target qualifier
             target_info = client.get_target('ark', 'bb', 'PDF')
             args, kwargs = self.mock_get.call_args
             url = args[0]
-            self.assert_(url.endswith('/ark/bb/PDF'),
+            self.assertTrue(url.endswith('/ark/bb/PDF'),
                 'get_target requests expected url; should end with /ark/bb/PDF')
 
             # 404 - target not found
@@ -400,9 +436,9 @@ class PidmanRestClientTest(unittest.TestCase):
             args, kwargs = self.mock_put.call_args
             # expected, got = '/pidman/purl/aa', client.connection.url
             url = args[0]
-            self.assert_(url.endswith('/purl/aa'),
+            self.assertTrue(url.endswith('/purl/aa'),
                 'update_pid requested expected url for update purl; should end with /purl/aa')
-            self.assert_(kwargs['auth'],
+            self.assertTrue(kwargs['auth'],
                 'auth header is passed when updating a pid')
             self.assertEqual('application/json', kwargs['headers']['Content-type'],
                 'content-type should be JSON for PUT data')
@@ -411,13 +447,13 @@ class PidmanRestClientTest(unittest.TestCase):
             self.assertEqual('new name', opts['name'],
                 'requested new name value set in request data')
             # unspecified parameters should not be set in posted data
-            self.assert_('domain' not in opts,
+            self.assertTrue('domain' not in opts,
                 'unspecified parameter (domain) not set in posted values')
-            self.assert_('external_system_id' not in opts,
+            self.assertTrue('external_system_id' not in opts,
                 'unspecified parameter (external system) not set in posted values')
-            self.assert_('external_system_key' not in opts,
+            self.assertTrue('external_system_key' not in opts,
                 'unspecified parameter (external system key) not set in posted values')
-            self.assert_('policy' not in opts,
+            self.assertTrue('policy' not in opts,
                 'unspecified parameter (policy) not set in posted values')
 
             # all parameters
@@ -428,7 +464,7 @@ class PidmanRestClientTest(unittest.TestCase):
                                     ext_id, policy)
             args, kwargs = self.mock_put.call_args
             url = args[0]
-            self.assert_(url.endswith('/ark/bb'),
+            self.assertTrue(url.endswith('/ark/bb'),
                 'update_pid requests to expected url for new ark; should end with /ark/bb')
             opts = json.loads(kwargs['data'])
             # all optional values should be set in query string
@@ -461,10 +497,10 @@ class PidmanRestClientTest(unittest.TestCase):
         # shortcut methods
         with patch.object(client, 'update_pid') as mockupdate_pid:
             client.update_purl('aa', domain, name)
-            mockupdate_pid.assert_alled_with('purl', 'aa', domain, name)
+            mockupdate_pid.assert_called_with('purl', 'aa', domain, name)
 
             client.update_ark('bb', domain, name)
-            mockupdate_pid.assert_alled_with('ark', 'bb', domain, name)
+            mockupdate_pid.assert_called_with('ark', 'bb', domain, name)
 
     def test_update_target(self):
         """Test updating an existing target."""
@@ -484,9 +520,9 @@ class PidmanRestClientTest(unittest.TestCase):
             # base url configured for tests is /pidman
             args, kwargs = self.mock_put.call_args
             url = args[0]
-            self.assert_(url.endswith('/purl/aa/'),
+            self.assertTrue(url.endswith('/purl/aa/'),
                 'update_target url for update purl target should end with "/purl/aa/"')
-            self.assert_(kwargs['auth'],
+            self.assertTrue(kwargs['auth'],
                 'auth header is passed when updating a target')
 
             # request body is JSON-encoded update values
@@ -494,9 +530,9 @@ class PidmanRestClientTest(unittest.TestCase):
             self.assertEqual(False, opts['active'],
                 'update active value set in request data')
             # unspecified parameters should not be set in posted data
-            self.assert_('target_uri' not in opts,
+            self.assertTrue('target_uri' not in opts,
                 'unspecified parameter (target_uri) not set in update values')
-            self.assert_('proxy' not in opts,
+            self.assertTrue('proxy' not in opts,
                 'unspecified parameter (proxy) not set in update values')
 
             # all parameters
@@ -504,7 +540,7 @@ class PidmanRestClientTest(unittest.TestCase):
             client.update_target('ark', 'bb', 'PDF', target, proxy, active)
             args, kwargs = self.mock_put.call_args
             url = args[0]
-            self.assert_(url.endswith('ark/bb/PDF'),
+            self.assertTrue(url.endswith('ark/bb/PDF'),
                 'update_target url for ark target should end with ark/bb/PDF')
 
             opts = json.loads(kwargs['data'])
@@ -542,6 +578,64 @@ class PidmanRestClientTest(unittest.TestCase):
             client.update_ark_target('bb', 'NEW-qual', target_uri=target)
             mockupdate_target.assert_called_with('ark', 'bb', 'NEW-qual', target_uri=target)
 
+    def test_create_pids(self):
+        'Test creating pids with templated target URIs'
+        client = self._new_client()
+        target = 'http://my.app/item/%s' % client.pid_token
+        with patch.object(client, 'create_pid') as mockcreate:
+            with patch.object(client, 'update_target') as mockupdate:
+                mockcreate.return_value = 'http://pid.emory.edu/ark:/25593/1fx'
+                self.assertEqual(mockcreate.return_value,
+                    client.create_templated_pid('ark', 'domain-1', target, name='Item'))
+                mockcreate.assert_called_with('ark', 'domain-1', target, name='Item')
+                mockupdate.assert_called_with('ark', '1fx', '',
+                                              target_uri='http://my.app/item/1fx')
+
+                # bulk creation, with create and update for each pid in one worker
+                mockcreate.side_effect = ['http://pid.emory.edu/%s' % noid
+                                          for noid in ['1b', '1c', '1d']]
+                mockupdate.reset_mock()
+                mockupdate.side_effect = [None, requests.exceptions.HTTPError('500'), None]
+                results = list(client.create_pids('purl', 'domain-1',
+                    [target, target, 'http://my.app/static'], workers=1))
+                self.assertEqual(['http://pid.emory.edu/1b', 'http://pid.emory.edu/1c',
+                                  'http://pid.emory.edu/1d'], [pid for pid, err in results])
+                # pid created but target update failed
+                self.assertTrue(isinstance(results[1][1], requests.exceptions.HTTPError))
+                self.assertEqual(None, results[0][1])
+                # target without the token isn't updated
+                self.assertEqual(2, mockupdate.call_count)
+                mockupdate.assert_called_with('purl', '1c', '',
+                                              target_uri='http://my.app/item/1c')
+
+    def test_iter_search_pids(self):
+        """Test iterating over all pages of search results."""
+        client = self._new_client()
+        pages = {
+            1: {'page_count': 3, 'results': [{'pid': 'aa'}, {'pid': 'bb'}]},
+            2: {'page_count': 3, 'results': [{'pid': 'cc'}, {'pid': 'dd'}]},
+            3: {'page_count': 3, 'results': [{'pid': 'ee'}]},
+        }
+        foo = {'uri': 'http://pid.emory.edu/domains/7/', 'name': 'foo'}
+        with patch.object(client, 'search_pids') as mocksearch, \
+                patch.object(client, 'list_domains', return_value=[foo]):
+            mocksearch.side_effect = lambda page=None, **kwargs: pages[page]
+            for workers in [1, 3]:
+                pids = [p['pid'] for p in client.iter_search_pids(workers=workers,
+                        domain='foo', page=5)]
+                self.assertEqual(['aa', 'bb', 'cc', 'dd', 'ee'], pids,
+                    'all pids should be returned in page order (%d workers)' % workers)
+            # search options passed through, domain name resolved to its
+            # URI; page option ignored
+            mocksearch.assert_called_with(page=3, domain_uri=foo['uri'])
+            # unknown domain names are an error, not an empty search
+            self.assertRaises(DomainNotFound, list, client.iter_search_pids(domain='bar'))
+
+            # single page of results
+            mocksearch.side_effect = None
+            mocksearch.return_value = {'page_count': 1, 'results': [{'pid': 'aa'}]}
+            self.assertEqual(1, len(list(client.iter_search_pids(workers=2))))
+
     def test_delete_target(self):
         """Test deleting an existing target."""
         # Test a normal working return.
@@ -554,10 +648,10 @@ class PidmanRestClientTest(unittest.TestCase):
             # base url configured for tests is /pidman
             args, kwargs = self.mock_delete.call_args
             url = args[0]
-            self.assert_(url.endswith('/ark/aa/'),
+            self.assertTrue(url.endswith('/ark/aa/'),
                 'delete_target url should end with /ark/aa/')
 
-            self.assert_('auth' in kwargs,
+            self.assertTrue('auth' in kwargs,
                 'auth header is passed when deleting a target')
 
             # 404 - target not found
@@ -565,6 +659,26 @@ class PidmanRestClientTest(unittest.TestCase):
             self.mock_delete.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError
             self.assertRaises(requests.exceptions.HTTPError, client.delete_ark_target, 'ee', 'pdf')
 
+    def test_session_threads(self):
+        """Test threads using a new client at once share one session."""
+        client = self._new_client()
+        sessions = []
+
+        def new_session():
+            time.sleep(0.01)
+            session = requests.Session()
+            sessions.append(session)
+            return session
+
+        with patch.object(client, '_new_session', side_effect=new_session):
+            threads = [threading.Thread(target=lambda: client.session) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, len(sessions))
+        self.assertTrue(client.session is sessions[0])
+
 
 # Test the Django wrapper code for pidman Client.
 class DjangoPidmanRestClientTest(unittest.TestCase):
@@ -583,11 +697,217 @@ class DjangoPidmanRestClientTest(unittest.TestCase):
         self.assertEqual('testpass', password,
             'Client password %s is not expected value' % password)
 
+     def test_get_client(self):
+        'Test the shared process-wide client'
+        shortcuts.reset_client()
+        client = shortcuts.get_client()
+        self.assertTrue(isinstance(client, DjangoPidmanRestClient))
+        self.assertTrue(client is shortcuts.get_client(),
+            'get_client should return the same client on every call')
+
+        # concurrent first calls create a single client
+        shortcuts.reset_client()
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(shortcuts.get_client()))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(set(id(c) for c in clients)))
+
+        # a forked process gets its own client
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            forked = shortcuts.get_client()
+        self.assertFalse(forked is clients[0])
+
+        # session connection pool is sized from settings
+        settings.PIDMAN_POOL_SIZE = 3
+        try:
+            adapter = forked.session.get_adapter('https://pid.emory.edu/')
+            self.assertEqual(3, adapter._pool_maxsize)
+        finally:
+            del settings.PIDMAN_POOL_SIZE
+        shortcuts.reset_client()
+
      def test_runtime_error(self):
         'Test Django init without required Django settings'
         del settings.PIDMAN_HOST
         self.assertRaises(RuntimeError, DjangoPidmanRestClient)
 
+class ResolveArksTest(unittest.TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = MagicMock()
+        self.client.get_ark.side_effect = lambda noid: {'pid': noid, 'name': 'ark %s' % noid}
+
+    def test_resolve_arks(self):
+        'Test resolving a batch of ARKs with caching'
+        arks = ['ark:/25593/1fx', 'http://pid.emory.edu/ark:/25593/1fx/PDF',
+                '2bc', None, '']
+        info = resolve.resolve_arks(arks, client=self.client, workers=2)
+        self.assertEqual(set(['1fx', '2bc']), set(info.keys()))
+        self.assertEqual('ark 1fx', info['1fx']['name'])
+        # duplicate noids are only requested once
+        self.assertEqual(2, self.client.get_ark.call_count)
+
+        # cached arks are not requested again
+        info = resolve.resolve_arks(['1fx', '2bc', '3cd'], client=self.client)
+        self.assertEqual('ark 3cd', info['3cd']['name'])
+        self.assertEqual(3, self.client.get_ark.call_count)
+
+        # PURLs are resolved by their last path segment, not used as noids
+        info = resolve.resolve_arks(['http://pid.emory.edu/2bc'], client=self.client)
+        self.assertEqual({'2bc': {'pid': '2bc', 'name': 'ark 2bc'}}, info)
+        self.assertEqual(3, self.client.get_ark.call_count)
+
+        # errors result in None, cached for a shorter time
+        self.client.get_ark.side_effect = requests.exceptions.HTTPError('404: not found')
+        with patch('django.core.cache.cache.set_many') as mockset:
+            self.assertEqual({'4df': None}, resolve.resolve_arks(['4df'], client=self.client))
+            mockset.assert_called_once_with({resolve.CACHE_KEY % '4df': resolve.NOT_FOUND},
+                                            resolve.CACHE_ERROR_TIMEOUT)
+        self.assertEqual({'4df': None}, resolve.resolve_arks(['4df'], client=self.client))
+        self.assertEqual({'4df': None}, resolve.resolve_arks(['4df'], client=self.client))
+        self.assertEqual(5, self.client.get_ark.call_count)
+
+    def test_prefetch_arks(self):
+        'Test prefetching ARK information for a list of objects'
+        class Item(object):
+            def __init__(self, ark):
+                self.ark = ark
+        items = [Item('ark:/25593/1fx'), Item(None), Item('2bc')]
+        result = resolve.prefetch_arks(iter(items), client=self.client)
+        self.assertEqual(items, result)
+        self.assertEqual('ark 1fx', items[0].ark_info['name'])
+        self.assertEqual(None, items[1].ark_info)
+        self.assertEqual('ark 2bc', items[2].ark_info['name'])
+
+    def test_template_tags(self):
+        'Test prefetch_arks template tag and ark_info filter'
+        from django.template import Context, Engine
+        engine = Engine(libraries={'pidman': 'pidservices.djangowrapper.templatetags.pidman'})
+        template = engine.from_string('{% load pidman %}{% prefetch_arks items "noid" %}'
+            '{% for item in items %}{{ item.ark_info.name }};{% endfor %}'
+            '{% with "1fx"|ark_info as info %}{{ info.name }}{% endwith %}')
+        class Item(object):
+            def __init__(self, noid):
+                self.noid = noid
+        with patch('pidservices.djangowrapper.shortcuts.get_client',
+                   return_value=self.client):
+            output = template.render(Context({'items': [Item('1fx'), Item('2bc')]}))
+        self.assertEqual('ark 1fx;ark 2bc;ark 1fx', output)
+        # filter used the cached result from prefetch_arks
+        self.assertEqual(2, self.client.get_ark.call_count)
+
+
+class MintingQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.created = []
+        lock = threading.Lock()
+        def create_pid(type, domain, target):
+            with lock:
+                pid = 'http://pid.emory.edu/ark:/25593/%s' % 'bcdfghjkmnpq'[len(self.created)]
+                self.created.append(pid)
+            return pid
+        self.client.create_templated_pid.side_effect = create_pid
+        self.client.expand_pid_token.side_effect = \
+            lambda uri, noid: uri.replace(PidmanRestClient.pid_token, noid)
+        self.placeholder = 'http://my.app/pending/%s' % PidmanRestClient.pid_token
+
+    def test_mint(self):
+        'Test handing out pre-allocated pids and assigning targets'
+        queue = minting.MintingQueue(self.client, 'http://pid.emory.edu/domains/1/',
+                                     self.placeholder, stock=4, low_water=2, workers=1)
+        queue.replenish()
+        self.assertEqual(4, len(queue))
+        self.client.create_templated_pid.assert_called_with('ark',
+            'http://pid.emory.edu/domains/1/', self.placeholder)
+
+        pid = queue.mint('http://my.app/item/%s' % PidmanRestClient.pid_token, name='Item')
+        self.assertEqual(self.created[0], pid)
+        self.client.update_target.assert_called_with('ark', 'b',
+            target_uri='http://my.app/item/b')
+        self.client.update_pid.assert_called_with('ark', 'b', name='Item')
+        self.assertEqual(3, len(queue))
+
+        # stock is replenished after falling below the low-water mark
+        queue.mint('http://my.app/item/2')
+        self.assertEqual(2, len(queue))
+        queue.mint('http://my.app/item/3')
+        self.assertEqual(4, len(queue))
+        self.assertEqual(7, self.client.create_templated_pid.call_count)
+
+        # failed updates are recorded and reported
+        failures = []
+        queue.on_failure = lambda *args: failures.append(args)
+        self.client.update_target.side_effect = requests.exceptions.HTTPError('404: not found')
+        pid = queue.mint('http://my.app/item/4')
+        self.assertEqual(pid, queue.failed[0][0])
+        self.assertEqual([queue.failed[0]], failures)
+
+        # server errors are retried
+        queue.retry_delay = 0
+        self.client.update_target.reset_mock()
+        self.client.update_target.side_effect = [
+            requests.exceptions.ConnectionError('connection refused'), None]
+        queue.mint('http://my.app/item/5')
+        self.assertEqual(2, self.client.update_target.call_count)
+        self.assertEqual(1, len(queue.failed))
+
+        # a pid whose placeholder target wasn't expanded can still be used
+        error = requests.exceptions.HTTPError('500: error')
+        error.pid = 'http://pid.emory.edu/ark:/25593/z'
+        self.client.create_templated_pid.side_effect = error
+        queue._pids.clear()
+        self.client.update_target.side_effect = None
+        self.assertEqual(error.pid, queue.mint('http://my.app/item/6'))
+
+    def test_mint_background(self):
+        'Test minting with background workers'
+        queue = minting.MintingQueue(self.client, 'http://pid.emory.edu/domains/1/',
+                                     self.placeholder, stock=3, workers=3)
+        # empty stock: a pid is created when needed
+        pids = [queue.mint('http://my.app/item/%d' % i) for i in range(5)]
+        queue.join()
+        self.assertEqual(5, len(set(pids)))
+        self.assertEqual(5, self.client.update_target.call_count)
+        # stock never goes above the configured size
+        self.assertTrue(len(queue) <= 3)
+        self.assertEqual(len(self.created), len(pids) + len(queue))
+        queue.close()
+
+        # closing the queue waits for pids to be assigned
+        def slow_update(*args, **kwargs):
+            time.sleep(0.05)
+        self.client.update_target.side_effect = slow_update
+        with minting.MintingQueue(self.client, 'http://pid.emory.edu/domains/1/',
+                                  self.placeholder, stock=1, workers=2) as queue:
+            queue.mint('http://my.app/item/5')
+        self.assertEqual(6, self.client.update_target.call_count)
+
+    def test_get_queue(self):
+        'Test the shared queue configured from Django settings'
+        self.assertRaises(RuntimeError, minting.get_queue)
+        settings.PIDMAN_DOMAIN = 'http://pid.emory.edu/domains/1/'
+        settings.PIDMAN_PLACEHOLDER_TARGET = self.placeholder
+        settings.PIDMAN_MINT_WORKERS = 1
+        try:
+            with patch('pidservices.djangowrapper.shortcuts.get_client',
+                       return_value=self.client):
+                queue = minting.get_queue()
+                self.assertTrue(queue is minting.get_queue())
+                self.assertEqual(minting.STOCK, len(queue))
+        finally:
+            del settings.PIDMAN_DOMAIN, settings.PIDMAN_PLACEHOLDER_TARGET, \
+                settings.PIDMAN_MINT_WORKERS
+            minting._after_fork()
+
+
 class IsArkTest(unittest.TestCase):
 
     def test_is_ark(self):
@@ -658,6 +978,1462 @@ class ParseArkTest(unittest.TestCase):
         self.assertEqual(None, parse_ark('doi:10.1000/182'),
             'attempting to parse non-ark results in None')
 
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_imap(self):
+        'Test applying a function concurrently with WorkerPool.imap'
+        for workers in [1, 4]:
+            with WorkerPool(workers) as pool:
+                self.assertEqual([i * 2 for i in range(20)],
+                    list(pool.imap(lambda i: i * 2, range(20), window=3)),
+                    'ordered imap returns results in input order')
+                self.assertEqual(set(i * 2 for i in range(20)),
+                    set(pool.imap(lambda i: i * 2, range(20), ordered=False)),
+                    'unordered imap returns all results')
+
+    def test_imap_bounded(self):
+        'Test that WorkerPool.imap does not consume input ahead of the window'
+        consumed = []
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+        with WorkerPool(2) as pool:
+            results = pool.imap(lambda i: i, items(), window=4)
+            next(results)
+            self.assertTrue(len(consumed) <= 5,
+                'only window items should be consumed before the first result')
+            list(results)
+        self.assertEqual(100, len(consumed))
+
+    def test_errors(self):
+        'Test exceptions in worker tasks are raised to the caller'
+        def fail(i):
+            raise ValueError(i)
+        with WorkerPool(2) as pool:
+            task = pool.submit(fail, 1)
+            self.assertRaises(ValueError, task.result)
+            self.assertRaises(ValueError, list, pool.imap(fail, range(3)))
+
+
+class ExportTest(unittest.TestCase):
+
+    pids = [
+        {'pid': 'aa', 'name': u'unicode \u2026 name', 'domain': 'Test',
+         'targets': [{'qualifier': '', 'target_uri': 'http://a.b/1', 'active': True},
+                     {'qualifier': 'PDF', 'target_uri': 'http://a.b/1.pdf', 'active': False}]},
+        {'pid': 'bb', 'name': 'no targets', 'domain': 'Test', 'targets': []},
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.client = PidmanRestClient('http://pid.emory.edu/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pid_rows(self):
+        'Test flattening a pid into one row per target'
+        rows = export.pid_rows(self.pids[0])
+        self.assertEqual(2, len(rows))
+        self.assertEqual('aa', rows[1]['pid'])
+        self.assertEqual('PDF', rows[1]['qualifier'])
+        self.assertEqual(False, rows[1]['active'])
+        # pid without targets is still exported
+        rows = export.pid_rows(self.pids[1], fields=['pid', 'target_uri'])
+        self.assertEqual([{'pid': 'bb', 'target_uri': None}], rows)
+
+    def test_export_pids(self):
+        'Test exporting search results to csv and json lines'
+        with patch.object(self.client, 'iter_search_pages') as mockpages:
+            mockpages.return_value = [self.pids[:1], self.pids[1:]]
+            path = os.path.join(self.tmpdir, 'out.csv')
+            total = export.export_pids(self.client, path, domain='Test')
+            self.assertEqual(3, total)
+            mockpages.assert_called_with(4, progress=None, count=export.PAGE_SIZE, domain='Test')
+            with open(path, encoding='utf-8', newline='') as csvfile:
+                rows = list(csv.DictReader(csvfile))
+            self.assertEqual(3, len(rows))
+            self.assertEqual('http://a.b/1.pdf', rows[1]['target_uri'])
+
+            path = os.path.join(self.tmpdir, 'out.jsonl')
+            export.export_pids(self.client, path, 'jsonl', workers=2)
+            with open(path, encoding='utf-8') as jsonfile:
+                rows = [json.loads(line) for line in jsonfile]
+            self.assertEqual(u'unicode \u2026 name', rows[0]['name'])
+
+            # gzip output should be reproducible
+            outputs = []
+            path = os.path.join(self.tmpdir, 'out.jsonl.gz')
+            for i in range(2):
+                export.export_pids(self.client, path, 'jsonl', compression='gzip')
+                with open(path, 'rb') as gzfile:
+                    outputs.append(gzfile.read())
+            self.assertEqual(outputs[0], outputs[1])
+
+        self.assertRaises(Exception, export.get_writer, 'xls', path)
+        self.assertRaises(Exception, export.open_output, path, 'zip')
+
+
+class PidImporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.client = PidmanRestClient('http://pid.emory.edu/', 'user', 'pass')
+        self.manifest = os.path.join(self.tmpdir, 'items.csv')
+        with open(self.manifest, 'w') as manifest:
+            manifest.write('name,target_uri,external_system_key,qualifier:PDF\n')
+            manifest.write('one,http://a.b/1,k1,http://a.b/1.pdf\n')
+            manifest.write('two,http://a.b/2,k2,\n')
+            manifest.write('three,,k3,\n')
+        self.arks = iter('http://pid.emory.edu/ark:/25593/%s' % noid
+                         for noid in ['1b', '1c', '1d', '1f'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lazy_import(self):
+        'Test importing the importer does not load requests'
+        output = subprocess.check_output([sys.executable, '-c',
+            'import sys, pidservices.importer; print("requests" in sys.modules)'],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(b'False', output.strip())
+
+    def test_read_manifest(self):
+        'Test reading CSV and JSON lines manifests'
+        rows = list(importer.read_manifest(self.manifest))
+        self.assertEqual(3, len(rows))
+        self.assertEqual({'PDF': 'http://a.b/1.pdf'}, rows[0]['qualifiers'])
+        self.assertEqual({}, rows[1]['qualifiers'])
+        jsonl = os.path.join(self.tmpdir, 'items.jsonl')
+        with open(jsonl, 'w') as manifest:
+            manifest.write('{"target_uri": "http://a.b/1", "qualifiers": {"PDF": "x"}}\n\n')
+        self.assertEqual([{'target_uri': 'http://a.b/1', 'qualifiers': {'PDF': 'x'}}],
+                         list(importer.read_manifest(jsonl)))
+
+    def test_run(self):
+        'Test importing a manifest and resuming an interrupted import'
+        output = os.path.join(self.tmpdir, 'out.jsonl')
+        pid_importer = importer.PidImporter(self.client, domain='http://pid.emory.edu/domains/1/',
+                                            workers=2)
+        with patch.object(self.client, 'create_pid') as mockcreate:
+            with patch.object(self.client, 'update_ark_target') as mockupdate:
+                mockcreate.side_effect = lambda *args, **kwargs: next(self.arks)
+                mockupdate.side_effect = requests.exceptions.HTTPError('500: error')
+                counts = pid_importer.run(self.manifest, output)
+                self.assertEqual({'created': 1, 'partial': 1, 'error': 1, 'skipped': 0},
+                                 counts)
+                self.assertEqual(2, mockcreate.call_count)
+                mockcreate.assert_any_call('ark', 'http://pid.emory.edu/domains/1/',
+                    'http://a.b/1', name='one', external_system=None,
+                    external_system_key='k1', policy=None)
+                mockupdate.assert_called_with('1b', 'PDF', target_uri='http://a.b/1.pdf')
+
+                with open(output) as outfile:
+                    rows = [json.loads(line) for line in outfile]
+                self.assertEqual(['partial', 'created', 'error'], [r['status'] for r in rows])
+                self.assertEqual('1b', rows[0]['pid'])
+
+                # re-run: created row skipped, partial row only retries targets,
+                # error row tried again
+                mockupdate.side_effect = None
+                counts = pid_importer.run(self.manifest, output)
+                self.assertEqual({'created': 1, 'partial': 0, 'error': 1, 'skipped': 1},
+                                 counts)
+                self.assertEqual(2, mockcreate.call_count)
+                counts = pid_importer.run(self.manifest, output)
+                self.assertEqual(2, counts['skipped'])
+
+    def test_templated_target(self):
+        'Test a pid whose templated target failed to update is not created again'
+        fake = FakePidman()
+        domain = fake.add_domain('Test')
+        client = PidmanRestClient(fake.url, 'user', 'pass', transport=fake)
+        manifest = os.path.join(self.tmpdir, 'items.jsonl')
+        with open(manifest, 'w') as infile:
+            infile.write('{"target_uri": "http://a.b/{%PID%}"}\n')
+        output = os.path.join(self.tmpdir, 'out.jsonl')
+        pid_importer = importer.PidImporter(client, domain=domain, workers=1)
+        with patch.object(client, 'update_target',
+                          side_effect=requests.exceptions.HTTPError('500: error')):
+            self.assertEqual(1, pid_importer.run(manifest, output)['partial'])
+        self.assertEqual(1, len(fake.pids))
+        self.assertEqual(1, pid_importer.run(manifest, output)['created'])
+        self.assertEqual(1, len(fake.pids))
+        noid = list(fake.pids.values())[0]['noid']
+        self.assertEqual('http://a.b/%s' % noid, client.get_ark_target(noid, '')['target_uri'])
+
+
+class TransportTest(unittest.TestCase):
+
+    def test_transport(self):
+        'Test sending client requests through a custom transport'
+        class StubTransport(transports.Transport):
+            def __init__(self):
+                self.requests = []
+            def request(self, method, url, **kwargs):
+                self.requests.append((method, url, kwargs))
+                if method == 'POST':
+                    return transports.Response(201, 'http://pid.emory.edu/ark:/25593/1fx')
+                return transports.Response(404, '', url=url)
+
+        transport = StubTransport()
+        client = PidmanRestClient('http://pid.emory.edu/', 'user', 'pass',
+                                  transport=transport)
+        self.assertEqual('http://pid.emory.edu/ark:/25593/1fx',
+                         client.create_ark('domain-1', 'http://example.com/'))
+        method, url, kwargs = transport.requests[0]
+        self.assertEqual(('POST', 'http://pid.emory.edu/ark/'), (method, url))
+        self.assertEqual(('user', 'pass'), kwargs['auth'])
+        self.assertEqual('http://example.com/', kwargs['data']['target_uri'])
+        # error responses raise the same exceptions as with requests
+        self.assertRaises(requests.exceptions.HTTPError, client.get_ark, '1fx')
+
+    def test_http2_transport(self):
+        'Test the httpx transport against the stand-in server'
+        try:
+            import httpx
+        except ImportError:
+            return
+        with benchmark.StandInServer() as server:
+            transport = transports.HTTP2Transport(max_connections=2)
+            client = PidmanRestClient(server.url, transport=transport)
+            self.assertEqual('1fx', client.get_ark('1fx')['pid'])
+            self.assertEqual(2, len(client.search_pids(count=2)['results']))
+            self.assertRaises(requests.exceptions.HTTPError, client.get_domain, 1)
+            transport.close()
+            self.assertEqual(['HTTP/1.1'], list(server.protocols))
+        # HTTP/2 with prior knowledge multiplexes requests over one connection
+        with benchmark.StandInServer(delay=0.05) as server:
+            transport = transports.HTTP2Transport(http1=False, max_connections=1)
+            client = PidmanRestClient(server.url, transport=transport)
+            self.assertEqual(2000, len(client.search_pids(count=2000)['results']))
+            result = benchmark.benchmark(client, 'get', requests=10, workers=10)
+            transport.close()
+            self.assertEqual(['HTTP/2'], list(server.protocols))
+            self.assertTrue(result.elapsed < 0.4)
+        # connection errors raise the same exceptions as with requests
+        client.session = transports.HTTP2Transport()
+        self.assertRaises(requests.exceptions.ConnectionError, client.get_ark, '1fx')
+
+    def test_benchmark(self):
+        'Test benchmarking client requests against the stand-in server'
+        with benchmark.StandInServer(total=50) as server:
+            client = PidmanRestClient(server.url)
+            result = benchmark.benchmark(client, 'search', requests=20, workers=4)
+            self.assertEqual((20, 0), (result.requests, result.errors))
+            self.assertEqual(20, server.requests)
+            self.assertTrue(result.rate > 0)
+
+        # pidman benchmark starts its own stand-in server
+        args = cli.get_parser().parse_args(['benchmark', '-q', '-n', '10', '--delay', '0',
+                                            '--compare', 'requests'])
+        with patch('sys.stdout', new=StringIO()) as stdout:
+            self.assertEqual(0, args.command_obj.run(args))
+            self.assertTrue(stdout.getvalue().startswith('requests'))
+            self.assertEqual(['10', '0'], stdout.getvalue().split()[1:3])
+
+    def test_record_replay(self):
+        'Test recording requests and replaying them'
+        fake = FakePidman()
+        domain = fake.add_domain('Test')
+        for i in range(30):
+            fake.add_pid('ark', domain, 'http://example.com/%d' % i)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'trace.jsonl.gz')
+            recorder = transports.RecordingTransport(path, fake)
+            client = PidmanRestClient(fake.url, 'user', 'pass', transport=recorder)
+            pids = list(client.iter_search_pids(workers=3, domain='Test', count=7))
+            ark = client.create_ark(domain, 'http://example.com/new')
+            self.assertRaises(requests.exceptions.HTTPError, client.get_purl, 'zz')
+            recorder.close()
+            # (including one request to list domains, to look up Test)
+            self.assertEqual(8, sum(fake.requests.values()))
+
+            replay = transports.ReplayTransport(path)
+            self.assertEqual(8, replay.recorded)
+            client = PidmanRestClient(fake.url, 'user', 'pass', transport=replay)
+            # same results, without the server, any number of times
+            for i in range(2):
+                self.assertEqual(pids, list(client.iter_search_pids(domain='Test', count=7)))
+            self.assertEqual(ark, client.create_ark(domain, 'http://example.com/new'))
+            self.assertRaises(requests.exceptions.HTTPError, client.get_purl, 'zz')
+            self.assertEqual(8, sum(fake.requests.values()))
+            self.assertRaisesRegex(Exception, 'No recorded response', client.get_ark, 'zz')
+
+            # synthetic latency
+            client.session = transports.ReplayTransport(path, latency=0.01)
+            start = time.time()
+            self.assertRaises(requests.exceptions.HTTPError, client.get_purl, 'zz')
+            self.assertTrue(time.time() - start >= 0.01)
+
+            # pidman --replay
+            args = cli.get_parser().parse_args(['search', '-q', '--domain', 'Test',
+                '--page-size', '7', '--pidman-url', fake.url, '--replay', path])
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                self.assertEqual(0, args.command_obj.run(args))
+            self.assertEqual(30, len(stdout.getvalue().splitlines()))
+
+            # unknown domain names are reported, not searched for
+            args = cli.get_parser().parse_args(['search', '-q', '--domain', 'Tset',
+                '--pidman-url', fake.url, '--replay', path])
+            with patch('sys.stderr', new=StringIO()) as stderr:
+                self.assertEqual(1, args.command_obj.run(args))
+            self.assertTrue('Domain Tset not found' in stderr.getvalue())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class FakePidmanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakePidman('http://pidman.example.com/pidman/', ('user', 'pass'))
+        self.client = PidmanRestClient(self.fake.url, 'user', 'pass', transport=self.fake)
+
+    def test_domains(self):
+        'Test creating, listing and updating domains'
+        parent = self.client.create_domain('Parent', policy='Permanent')
+        child = self.client.create_domain('Child', parent=parent)
+        self.assertEqual('http://pidman.example.com/pidman/domains/2/', child)
+        self.assertEqual(['Parent', 'Child'], [d['name'] for d in self.client.list_domains()])
+        self.assertEqual(parent, self.client.get_domain(2)['parent'])
+        self.assertEqual('Kid', self.client.update_domain(2, name='Kid')['name'])
+        self.assertRaises(requests.exceptions.HTTPError, self.client.get_domain, 3)
+        self.assertRaises(requests.exceptions.HTTPError, self.client.update_domain,
+                          2, parent='http://pidman.example.com/pidman/domains/9/')
+        # changes require credentials
+        anon = PidmanRestClient(self.fake.url, transport=self.fake)
+        self.assertRaises(requests.exceptions.HTTPError, anon.create_domain, 'Anon')
+
+    def test_pids(self):
+        'Test creating, getting and updating pids and targets'
+        domain = self.client.create_domain('Test')
+        ark = self.client.create_ark(domain, 'http://example.com/1', name='one')
+        self.assertTrue(is_ark(ark))
+        noid = parse_ark(ark)['noid']
+        self.assertEqual('one', self.client.get_ark(noid)['name'])
+        self.assertEqual('Test', self.client.update_ark(noid, external_system_key='k1')['domain'])
+        self.assertEqual('k1', self.client.get_ark(noid)['ext_system_key'])
+        # qualified targets
+        target = self.client.update_ark_target(noid, 'PDF', target_uri='http://example.com/1.pdf')
+        self.assertEqual(ark + '/PDF', target['access_uri'])
+        self.assertEqual(['', 'PDF'], [t['qualifier'] for t in self.client.get_ark(noid)['targets']])
+        self.assertTrue(self.client.delete_ark_target(noid, 'PDF'))
+        self.assertRaises(requests.exceptions.HTTPError, self.client.get_ark_target, noid, 'PDF')
+        # purls
+        purl = self.client.create_purl(domain, 'http://example.com/2')
+        self.assertFalse(is_ark(purl))
+        noid = purl.split('/')[-1]
+        self.client.update_purl_target(noid, active=False)
+        self.assertFalse(self.client.get_purl_target(noid)['active'])
+        self.assertRaises(requests.exceptions.HTTPError, self.client.delete, 'purl/%s/' % noid)
+        self.assertRaises(requests.exceptions.HTTPError, self.client.get_ark, noid)
+        # templated targets
+        pid = self.client.create_templated_pid('ark', domain, 'http://example.com/{%PID%}')
+        noid = parse_ark(pid)['noid']
+        self.assertEqual('http://example.com/%s' % noid,
+                         self.client.get_ark_target(noid, '')['target_uri'])
+
+    def test_search(self):
+        'Test searching pids, with pagination'
+        test = self.fake.add_domain('Test')
+        other = self.fake.add_domain('Other')
+        for i in range(25):
+            self.fake.add_pid('ark', test, 'http://example.com/%d' % i)
+        self.fake.add_pid('purl', other, 'http://example.com/0')
+        results = self.client.search_pids(domain='Test', count=10, page=3)
+        self.assertEqual((25, 3, 3), (results['results_count'], results['page'],
+                                      results['page_count']))
+        self.assertEqual(5, len(results['results']))
+        self.assertTrue(results['first_page_link'].endswith('page=1'))
+        self.assertRaises(requests.exceptions.HTTPError, self.client.search_pids,
+                          domain='Test', count=10, page=4)
+        self.assertEqual(2, self.client.search_pids(target='http://example.com/0')['results_count'])
+        self.assertEqual(1, self.client.search_pids(type='purl', domain_uri=other)['results_count'])
+        pids = list(self.client.iter_search_pids(workers=4, domain_uri=test, count=7))
+        self.assertEqual(['http://example.com/%d' % i for i in range(25)],
+                         [pid['targets'][0]['target_uri'] for pid in pids])
+        self.assertEqual(len(set(pid['pid'] for pid in pids)), 25)
+        # results reflect changes
+        self.fake.add_pid('ark', test, 'http://example.com/25')
+        self.assertEqual(26, self.client.search_pids(domain='Test')['results_count'])
+        # domain names are resolved as for iter_search_pids
+        self.assertRaises(DomainNotFound, self.client.search_pids, domain='Nonexistent')
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_histogram(self):
+        'Test latency histogram percentiles'
+        histogram = LatencyHistogram()
+        self.assertEqual(None, histogram.percentile(50))
+        for ms in range(1, 10001):
+            histogram.record(ms / 1000.0)
+        snapshot = histogram.snapshot()
+        self.assertEqual((10000, 0.001, 10.0), (snapshot['count'], snapshot['min'],
+                                                 snapshot['max']))
+        self.assertAlmostEqual(5.0005, snapshot['mean'])
+        for percent in [50, 90, 99, 99.9]:
+            self.assertTrue(abs(snapshot['p%g' % percent] - percent / 10.0) <= percent / 1000.0)
+        self.assertEqual(10.0, histogram.percentile(100))
+        # small values are exact
+        histogram.reset()
+        histogram.record(0.000123)
+        self.assertEqual(0.000123, histogram.percentile(50))
+
+    def test_client_metrics(self):
+        'Test recording client request times by operation'
+        self.assertEqual(('get_target', '{type}/{noid}/{qualifier}'),
+                         classify('GET', 'ark/1fx/PDF'))
+        self.assertEqual(('update_pid', '{type}/{noid}'), classify('PUT', 'purl/1fx'))
+        self.assertEqual(('search_pids', 'pids/'), classify('GET', '/pids/'))
+
+        fake = FakePidman()
+        domain = fake.add_domain('Test')
+        metrics = ClientMetrics(slow=0)
+        client = PidmanRestClient(fake.url, 'user', 'pass', transport=fake, metrics=metrics)
+        with self.assertLogs('pidservices.metrics', 'WARNING') as logs:
+            noid = client.create_ark(domain, 'http://example.com/').split('/')[-1]
+            client.get_ark(noid)
+            client.update_ark_target(noid, target_uri='http://example.com/1')
+            self.assertRaises(requests.exceptions.HTTPError, client.get_ark, 'zz')
+        self.assertIn('get_pid GET {type}/{noid}', logs.output[1])
+        snapshot = metrics.snapshot()
+        self.assertEqual(['create_pid', 'get_pid', 'update_target'], list(snapshot))
+        self.assertEqual((2, 1), (snapshot['get_pid']['count'], snapshot['get_pid']['errors']))
+
+        output = StringIO()
+        metrics.export(output, reset=True)
+        data = json.loads(output.getvalue())
+        self.assertEqual(1, data['operations']['update_target']['count'])
+        self.assertEqual(0, metrics.snapshot()['get_pid']['count'])
+
+        # periodic export
+        metrics.start(output, interval=0.01)
+        time.sleep(0.05)
+        metrics.stop()
+        self.assertTrue(len(output.getvalue().splitlines()) > 2)
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakePidman()
+        self.domain = self.fake.add_domain('Test')
+        self.tracer = tracing.Tracer()
+        self.client = PidmanRestClient(self.fake.url, 'user', 'pass', transport=self.fake,
+                                       tracer=self.tracer)
+
+    def test_spans(self):
+        'Test spans for client API calls and batch operations'
+        targets = ['http://example.com/%d/{%%PID%%}' % i for i in range(5)]
+        with self.tracer.span('job') as job:
+            pids = list(self.client.create_pids('ark', self.domain, targets, workers=3))
+            self.assertRaises(requests.exceptions.HTTPError, self.client.get_ark, 'zz')
+        spans = dict((span.span_id, span) for span in self.tracer.spans)
+        self.assertEqual(set([job.trace_id]), set(span.trace_id for span in spans.values()))
+        batch = [span for span in spans.values() if span.name == 'create_pids'][0]
+        self.assertEqual(job.span_id, batch.parent_id)
+        calls = [span for span in spans.values() if span.parent_id == batch.span_id]
+        self.assertEqual(['create_pid'] * 5 + ['update_target'] * 5,
+                         sorted(span.name for span in calls))
+        update = [span for span in calls if span.name == 'update_target'][0]
+        self.assertEqual('{type}/{noid}/{qualifier}', update.attributes['pidman.url_template'])
+        self.assertEqual(['decode', 'transport'], sorted(
+            span.name for span in spans.values() if span.parent_id == update.span_id))
+        # only API requests are client spans
+        self.assertEqual(set(['create_pid', 'update_target', 'get_pid']), set(
+            span.name for span in spans.values() if span.kind == tracing.CLIENT))
+        self.assertEqual(tracing.INTERNAL, batch.kind)
+        error = [span for span in spans.values() if span.name == 'get_pid'][0]
+        self.assertEqual(job.span_id, error.parent_id)
+        self.assertEqual(404, error.attributes['http.status_code'])
+        self.assertTrue(error.error.startswith('HTTPError'))
+        self.assertTrue(all(span.duration is not None for span in spans.values()))
+
+        # paginated search
+        self.tracer.spans = []
+        self.assertEqual(5, len(list(self.client.iter_search_pids(workers=2, count=2))))
+        batch = [span for span in self.tracer.spans if span.name == 'iter_search_pages'][0]
+        self.assertEqual('3', str(batch.attributes['page_count']))
+        self.assertEqual(3, len([span for span in self.tracer.spans
+                                 if span.parent_id == batch.span_id]))
+
+    def test_export(self):
+        'Test exporting spans to a file and encoding them for a collector'
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'trace.jsonl')
+            self.fake.add_pid('ark', self.domain, 'http://example.com/')
+            args = cli.get_parser().parse_args(['search', '-q', '--pidman-url', self.fake.url,
+                                                '--trace', path])
+            with patch.object(cli.Command, 'get_transport', return_value=self.fake):
+                with patch('sys.stdout', new=StringIO()):
+                    self.assertEqual(0, args.command_obj.run(args))
+            with open(path) as trace:
+                spans = [json.loads(line) for line in trace]
+            self.assertEqual(['decode', 'iter_search_pages', 'pidman search', 'search_pids',
+                              'transport'], sorted(span['name'] for span in spans))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        exporter = tracing.OTLPExporter('http://localhost:4318/v1/traces')
+        with self.tracer.span('job', {'count': 2}):
+            pass
+        data = json.loads(exporter.encode(self.tracer.spans))
+        span = data['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual('job', span['name'])
+        # SPAN_KIND_INTERNAL
+        self.assertEqual(1, span['kind'])
+        self.assertEqual(32, len(span['traceId']))
+        self.assertEqual([{'key': 'count', 'value': {'intValue': '2'}}], span['attributes'])
+        # errors sending the last batch are logged, not raised
+        exporter.export(self.tracer.spans)
+        with patch('requests.post', side_effect=requests.exceptions.ConnectionError('refused')), \
+                patch.object(tracing.logger, 'error') as mocklog:
+            exporter.close()
+            self.assertEqual(1, mocklog.call_count)
+
+
+class ProgressReporterTest(unittest.TestCase):
+
+    def test_report(self):
+        'Test progress reports with rate, latency and ETA'
+        now = [1000.0]
+        with patch('pidservices.progress.time.time', lambda: now[0]):
+            output = StringIO()
+            progress = ProgressReporter('test', total=100, interval=10, stream=output,
+                                        window=5)
+            for i in range(20):
+                now[0] += 1
+                progress.update(latency=0.2)
+            progress.update(errors=1, latency=1.2)
+            self.assertAlmostEqual(0.3, progress.latency)
+            # rate over the last few seconds only
+            for i in range(10):
+                now[0] += 1
+                progress.update(10)
+            self.assertEqual(10, progress.current_rate)
+            self.assertTrue(progress.rate < 5)
+            self.assertEqual(0, progress.eta)
+            lines = output.getvalue().splitlines()
+            self.assertEqual(3, len(lines))
+            self.assertEqual('test: 20/100 items, 0 errors, 1.0 items/sec, 200 ms avg latency, '
+                             'ETA 0:01:20', lines[1])
+
+            progress = ProgressReporter('json', interval=0, stream=output, format='json')
+            now[0] += 2
+            progress.update(4, errors=1)
+            progress.finish()
+            report, summary = [json.loads(line) for line in output.getvalue().splitlines()[3:]]
+            self.assertEqual((4, 1, None, 2.0), (report['count'], report['errors'],
+                                                 report['eta'], report['current_rate']))
+            self.assertTrue(summary['finished'])
+
+    def test_bulk_progress(self):
+        'Test progress reporting from bulk client operations'
+        fake = FakePidman()
+        domain = fake.add_domain('Test')
+        client = PidmanRestClient(fake.url, 'user', 'pass', transport=fake)
+        progress = ProgressReporter(interval=None)
+        targets = ['http://example.com/%d' % i for i in range(12)]
+        list(client.create_pids('ark', domain, targets, workers=3, progress=progress))
+        self.assertEqual((12, 0), (progress.count, progress.errors))
+        self.assertTrue(progress.latency is not None)
+
+        progress = ProgressReporter(interval=None)
+        list(client.iter_search_pids(workers=2, progress=progress, count=5))
+        self.assertEqual((12, 12), (progress.count, progress.total))
+
+
+class PlannerTest(CommandTestMixin, unittest.TestCase):
+
+    def test_plan(self):
+        'Test planning only the necessary pid and target changes'
+        pid = {'pid': '1fx', 'name': 'one', 'ext_system_key': None, 'targets': [
+            {'qualifier': '', 'target_uri': 'http://a/1fx', 'proxy': None, 'active': True}]}
+        target = planner.find_target(pid)
+        self.assertEqual(None, planner.find_target(pid, 'PDF'))
+        self.assertEqual(None, planner.plan_target('ark', '1fx', '', target,
+                                                   target_uri='http://a/1fx', active=True))
+        change = planner.plan_target('ark', '1fx', '', target, target_uri='http://a/1fx',
+                                     active=False, proxy=None)
+        self.assertEqual({'active': False}, change.fields)
+        self.assertEqual("ark 1fx: active True -> False", change.describe())
+        change = planner.plan_target('ark', '1fx', 'PDF', None, target_uri='http://a/1fx.pdf')
+        self.assertEqual("ark 1fx/PDF: create target_uri 'http://a/1fx.pdf'", change.describe())
+        self.assertRaises(Exception, planner.plan_target, 'ark', '1fx', '', target, foo=1)
+
+        self.assertEqual(None, planner.plan_pid('ark', pid, name='one'))
+        change = planner.plan_pid('ark', pid, name='one', external_system_key='k',
+                                  domain='http://pidman/domains/1/')
+        # current domain uri not known, so it is always updated
+        self.assertEqual({'external_system_key': 'k', 'domain': 'http://pidman/domains/1/'},
+                         change.fields)
+
+        plan = planner.ChangePlan()
+        plan.add(planner.plan_target('ark', '1fx', '', target, active=True))
+        plan.add(planner.plan_target('ark', '1fx', '', target, active=False))
+        plan.add(planner.plan_target('ark', '1fx', '', target, target_uri='http://b/1fx'))
+        self.assertEqual((1, 1), (len(plan), plan.unchanged))
+        self.assertEqual({'active': False, 'target_uri': 'http://b/1fx'}, list(plan)[0].fields)
+        output = StringIO()
+        plan.report(output)
+        self.assertEqual(["ark 1fx: active True -> False, target_uri 'http://a/1fx' -> "
+                          "'http://b/1fx'", '1 changes planned, 1 unchanged'],
+                         output.getvalue().splitlines())
+
+    def test_apply(self):
+        'Test applying planned changes, and idempotent reruns'
+        fake = FakePidman()
+        domain = fake.add_domain('Test')
+        noids = [fake.add_pid('ark', domain, 'http://old.host/%d' % i) for i in range(6)]
+        client = PidmanRestClient(fake.url, 'user', 'pass', transport=fake)
+
+        def plan():
+            plan = planner.ChangePlan()
+            for pid in client.iter_search_pids():
+                target = planner.find_target(pid)
+                plan.add(planner.plan_target('ark', pid['pid'], '', target,
+                    target_uri=target['target_uri'].replace('old.host', 'new.host')))
+            return plan
+
+        first = plan()
+        self.assertEqual(6, len(first))
+        progress = ProgressReporter(interval=None)
+        self.assertEqual([None] * 6, [err for change, err in first.apply(client, 3, progress)])
+        self.assertEqual(6, progress.count)
+        self.assertEqual(6, fake.requests['PUT'])
+        # a rerun has nothing to do
+        self.assertEqual((0, 6), (len(plan()), plan().unchanged))
+
+        # pidman deactivate only updates active targets
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'pids.txt')
+            with open(path, 'w') as pidfile:
+                pidfile.write('\n'.join(noids[:3]))
+            argv = ['deactivate', '-q', '--pidman-url', fake.url, '--pidman-user', 'user',
+                    '-p', 'pass', path]
+            with patch.object(cli.Command, 'get_transport', return_value=fake):
+                with patch('sys.stdout', new=StringIO()) as stdout:
+                    self.assertEqual(0, self._run(argv + ['--dry-run']))
+                self.assertEqual(3, len(stdout.getvalue().splitlines()))
+                self.assertEqual(6, fake.requests['PUT'])
+                for i in range(2):
+                    self.assertEqual(0, self._run(argv))
+            self.assertEqual(9, fake.requests['PUT'])
+            self.assertFalse(client.get_ark_target(noids[0], '')['active'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class WriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakePidman()
+        domain = self.fake.add_domain('Test')
+        self.noids = [self.fake.add_pid('ark', domain, 'http://old.host/%d' % i)
+                      for i in range(10)]
+        self.client = PidmanRestClient(self.fake.url, 'user', 'pass', transport=self.fake)
+
+    def test_coalesce(self):
+        'Test merging buffered updates to the same target'
+        with self.client.buffer_writes(size=4, delay=None, workers=3) as buffer:
+            for noid in self.noids:
+                self.assertEqual(None, self.client.update_ark_target(noid, '', active=False))
+                self.client.update_ark_target(noid, '', target_uri='http://new.host/%s' % noid)
+            self.client.update_ark(self.noids[0], name='first')
+            # full batches are sent as the buffer fills, which sometimes
+            # separates the two updates to a target
+            self.assertEqual(12, self.fake.requests['PUT'])
+            self.assertEqual(2, len(buffer))
+        self.assertEqual((21, 14, 14), (buffer.updates, buffer.requests,
+                                        self.fake.requests['PUT']))
+        self.assertEqual(None, self.client.write_buffer)
+        for noid in self.noids:
+            target = self.client.get_ark_target(noid, '')
+            self.assertEqual((False, 'http://new.host/%s' % noid),
+                             (target['active'], target['target_uri']))
+        self.assertEqual('first', self.client.get_ark(self.noids[0])['name'])
+        # not buffering: updates are sent immediately
+        self.assertEqual('second', self.client.update_ark(self.noids[0], name='second')['name'])
+
+    def test_flush(self):
+        'Test sending buffered updates after a delay, and failed updates'
+        with self.client.buffer_writes(size=100, delay=0.05) as buffer:
+            self.client.update_ark_target(self.noids[0], '', active=False)
+            self.client.update_purl_target('zz', active=False)
+            time.sleep(0.2)
+            self.assertEqual(2, self.fake.requests['PUT'])
+            self.assertEqual(0, len(buffer))
+        self.assertEqual(1, len(buffer.failed))
+        url, fields, err = buffer.failed[0]
+        self.assertEqual(('purl/zz/', {'active': False}), (url, fields))
+        self.assertTrue(isinstance(err, requests.exceptions.HTTPError))
+
+
+class DomainTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakePidman()
+        self.client = PidmanRestClient(self.fake.url, 'user', 'pass', transport=self.fake)
+        self.top = self.fake.add_domain('Collections')
+        self.child = self.fake.add_domain('Rushdie', parent=self.top)
+        self.grandchild = self.fake.add_domain('Letters', parent=self.child)
+        self.fake.add_domain('Other')
+
+    def test_lookup(self):
+        'Test looking up domains and their relations from the cache'
+        domains = self.client.domains
+        rushdie = domains.get('Rushdie')
+        self.assertEqual(('2', self.child, self.top), (rushdie.id, rushdie.uri, rushdie.parent))
+        self.assertEqual(rushdie, domains.get(self.child))
+        self.assertEqual(rushdie, domains.get(2))
+        # URIs match with or without the trailing slash
+        self.assertEqual(rushdie, domains.get(self.child.rstrip('/')))
+        self.assertEqual(rushdie, domains.get(self.child.rstrip('/') + '/'))
+        self.assertEqual(self.top, domains.parent(rushdie).uri)
+        self.assertEqual(['Collections', 'Other'], [d.name for d in domains.children()])
+        self.assertEqual(['Rushdie', 'Letters'],
+                         [d.name for d in domains.descendants('Collections')])
+        self.assertEqual(['Rushdie', 'Collections'],
+                         [d.name for d in domains.ancestors('Letters')])
+        self.assertFalse('Nonexistent' in domains)
+        self.assertRaises(KeyError, domains.get, 'Nonexistent')
+        # only listed once
+        self.assertEqual(1, self.fake.requests['GET'])
+
+        # nested subdomains
+        nested = [{'uri': self.top, 'name': 'Collections', 'policy': None,
+                   'collections': [{'uri': self.child, 'name': 'Rushdie', 'policy': None}]}]
+        with patch.object(self.client, 'list_domains', return_value=nested):
+            tree = DomainTree(self.client)
+            self.assertEqual(self.top, tree.get('Rushdie').parent)
+            self.assertEqual('1', tree.get(self.top).id)
+
+    def test_refresh(self):
+        'Test refreshing the cache after changes and when expired'
+        domains = self.client.domains
+        self.assertEqual(4, len(domains))
+        self.client.create_domain('Rushdie', parent=self.top)
+        self.assertEqual(5, len(domains))
+        self.assertRaises(KeyError, domains.get, 'Rushdie')
+        self.client.update_domain(5, name='Rushdie Papers')
+        self.assertEqual(self.child, domains.uri('Rushdie'))
+        self.assertEqual(3, self.fake.requests['GET'])
+        # changes made elsewhere are found when the cache expires
+        self.fake.add_domain('Elsewhere')
+        domains.ttl = 0
+        time.sleep(0.01)
+        self.assertTrue('Elsewhere' in domains)
+
+    def test_search_domains(self):
+        'Test searching several domains and subdomains concurrently'
+        expected = {}
+        for i, domain in enumerate([self.top, self.child, self.grandchild, self.top]):
+            for j in range(5):
+                noid = self.fake.add_pid('ark', domain, 'http://example.com/%d/%d' % (i, j))
+                expected.setdefault(domain, set()).add(noid)
+        progress = ProgressReporter(interval=None)
+        pids = [pid['pid'] for pid in self.client.iter_search_pids(
+            workers=3, progress=progress, domain='Collections', subdomains=True, count=3)]
+        self.assertEqual(20, len(pids))
+        self.assertEqual(set().union(*expected.values()), set(pids))
+        self.assertEqual((20, 20), (progress.count, progress.total))
+        # searched by domain uri
+        self.assertEqual([self.top, self.child, self.grandchild],
+                         sorted(dict(filters)['domain_uri'] for filters in self.fake._searches))
+        pids = [pid['pid'] for pid in self.client.iter_search_pids(
+            workers=2, domain=['Rushdie'], domain_uri=[self.grandchild], count=2)]
+        self.assertEqual(expected[self.child] | expected[self.grandchild], set(pids))
+        self.assertEqual(10, len(pids))
+        self.assertRaises(KeyError, list, self.client.iter_search_pids(domain=['Nonexistent']))
+
+
+class PageSizeTunerTest(unittest.TestCase):
+
+    def test_tuner(self):
+        'Test choosing page sizes from page latency and size'
+        self.assertEqual([1024, 256, 8, 1], [aligned_size(1024, offset)
+                                             for offset in [0, 2304, 8200, 4097]])
+        tuner = PageSizeTuner(target_latency=1, min_size=16, max_size=4096, initial=1000)
+        self.assertEqual(512, tuner.size)
+        # fast pages: size at most doubles
+        self.assertEqual(1024, tuner.observe(512, 0.01))
+        self.assertEqual(2048, tuner.observe(1024, 0.4))
+        # slow page: size drops at once
+        self.assertEqual(256, tuner.observe(2048, 6))
+        self.assertEqual(256, tuner.observe(256, 0.9))
+        # memory budget
+        tuner.max_bytes = 10000
+        self.assertEqual(128, tuner.observe(256, 0.1, nbytes=16000))
+        self.assertEqual(64, tuner.timeout(128))
+        tuner.min_size = 64
+        self.assertEqual(None, tuner.timeout(64))
+        self.assertEqual(2, tuner.timeouts)
+
+    def test_sweep(self):
+        'Test searching with adaptive page sizes'
+        fake = FakePidman(max_page_size=100)
+        domain = fake.add_domain('Test')
+        noids = [fake.add_pid('ark', domain, 'http://example.com/%d' % i) for i in range(300)]
+        client = PidmanRestClient(fake.url, transport=fake)
+        tuner = PageSizeTuner(min_size=4, initial=16)
+        progress = ProgressReporter(interval=None)
+        pids = [pid['pid'] for pid in client.iter_search_pids(adaptive=tuner, progress=progress,
+                                                              domain='Test')]
+        self.assertEqual(noids, pids)
+        self.assertEqual((300, 300), (progress.count, progress.total))
+        # grew to the server's maximum page size
+        self.assertEqual(64, tuner.size)
+
+        # page sizes that time out are reduced
+        search_pids = client.search_pids
+
+        def slow_search(**kwargs):
+            if kwargs['count'] > 32:
+                response = requests.Response()
+                response.status_code = 504
+                raise requests.exceptions.HTTPError('504', response=response)
+            return search_pids(**kwargs)
+
+        tuner = PageSizeTuner(min_size=4, initial=128)
+        with patch.object(client, 'search_pids', side_effect=slow_search):
+            self.assertEqual(noids, [pid['pid'] for pid in
+                                     client.iter_search_pids(adaptive=tuner)])
+            self.assertEqual(32, tuner.size)
+            self.assertTrue(tuner.timeouts >= 2)
+            tuner = PageSizeTuner(min_size=64, initial=128)
+            self.assertRaises(requests.exceptions.HTTPError, list,
+                              client.iter_search_pids(adaptive=tuner))
+
+
+class SearchSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakePidman()
+        domain = self.fake.add_domain('Test')
+        self.noids = [self.fake.add_pid('ark', domain, 'http://example.com/%d' % i)
+                      for i in range(30)]
+        self.client = PidmanRestClient(self.fake.url, transport=self.fake)
+
+    def test_snapshot(self):
+        'Test searching while pids are reordered'
+        search_pids = self.client.search_pids
+        self.moved = False
+
+        def search(**kwargs):
+            data = search_pids(**kwargs)
+            if kwargs.get('page') == 1 and not self.moved:
+                # the last three pids move to the front, shifting later pages
+                self.moved = True
+                for noid in self.noids[-3:]:
+                    self.fake.pids.move_to_end(('ark', noid), last=False)
+                self.fake._changed()
+            return data
+
+        with patch.object(self.client, 'search_pids', side_effect=search):
+            # without a snapshot, pids are repeated and missed
+            pids = [pid['pid'] for pid in self.client.iter_search_pids(count=10)]
+            self.assertEqual((30, 27), (len(pids), len(set(pids))))
+
+            for noid in self.noids[-3:]:
+                self.fake.pids.move_to_end(('ark', noid))
+            self.fake._changed()
+            self.moved = False
+            self.fake.requests.clear()
+            progress = ProgressReporter(interval=None)
+            snapshot = SearchSnapshot(self.client, workers=1, progress=progress, count=10)
+            pids = [pid['pid'] for pid in snapshot]
+            self.assertEqual(sorted(self.noids), sorted(pids))
+            self.assertEqual((3, 3, 2, 30), (snapshot.duplicates, snapshot.recovered,
+                                             snapshot.passes, snapshot.expected))
+            self.assertTrue(snapshot.complete)
+            self.assertEqual(30, progress.count)
+            # the second pass only reads the pages up to the shifted page,
+            # plus a request to check the count after each pass
+            self.assertEqual([3, 2], snapshot.pages_read)
+            self.assertEqual(7, self.fake.requests['GET'])
+
+        # a pid removed while the search runs hides a missed pid: the
+        # counts agree, but the search isn't complete until it is found
+        for noid in self.noids[-3:]:
+            self.fake.pids.move_to_end(('ark', noid))
+        self.fake._changed()
+        removing = []
+        def search(**kwargs):
+            data = search_pids(**kwargs)
+            if kwargs.get('page') == 1 and removing:
+                del self.fake.pids['ark', self.noids[removing.pop()]]
+                self.fake._changed()
+            return data
+
+        with patch.object(self.client, 'search_pids', side_effect=search):
+            removing.append(5)
+            snapshot = SearchSnapshot(self.client, workers=1, passes=1, count=10)
+            pids = [pid['pid'] for pid in snapshot]
+            self.assertEqual((29, 29), (len(pids), snapshot.expected))
+            self.assertFalse(self.noids[10] in pids)
+            self.assertFalse(snapshot.complete)
+
+            removing.append(6)
+            snapshot = SearchSnapshot(self.client, workers=1, count=10)
+            pids = [pid['pid'] for pid in snapshot]
+            self.assertTrue(self.noids[11] in pids)
+            self.assertEqual((29, 1, 28), (len(pids), snapshot.recovered, snapshot.expected))
+            self.assertTrue(snapshot.complete)
+
+    def test_search(self):
+        'Test searching as a snapshot'
+        pids = [pid['pid'] for pid in self.client.iter_search_pids(workers=3, snapshot=True,
+                                                                   count=7)]
+        self.assertEqual(self.noids, pids)
+        # one request to check the count
+        self.assertEqual(6, self.fake.requests['GET'])
+        self.assertRaises(Exception, SearchSnapshot, self.client, subdomains=True)
+
+
+class NoidSetTest(unittest.TestCase):
+
+    def test_encoding(self):
+        'Test encoding NOIDs as integers'
+        self.assertEqual([1, 29, 30, 31], [encode_noid(noid) for noid in ['0', 'z', '00', '01']])
+        for noid in ['1fx', '0', '00', 'zzzzzzzzzzzzz', '1b0c', 'x7']:
+            self.assertEqual(noid, decode_noid(encode_noid(noid)))
+        self.assertEqual(encode_noid('1fx'), encode_noid('1FX'))
+        self.assertTrue(encode_noid('zzzzzzzzzzzzz') < 2 ** 64)
+        for noid in ['', 'abc', '1fx/PDF', '0' * 14]:
+            self.assertRaises(ValueError, encode_noid, noid)
+        # integers sort noids by length, then alphabetically
+        noids = ['1fx', 'z', '1fz', '00', '1b', 'b']
+        self.assertEqual(['b', 'z', '00', '1b', '1fx', '1fz'], sorted(noids, key=encode_noid))
+
+    def test_set(self):
+        'Test adding, finding and combining NOIDs'
+        fake = FakePidman()
+        noids = [fake.mint() for i in range(10000)]
+        evens = NoidSet(noids[::2])
+        self.assertEqual(5000, len(evens))
+        self.assertTrue(noids[0] in evens)
+        self.assertFalse(noids[1] in evens)
+        self.assertFalse('not a noid' in evens)
+        evens.add(noids[0])
+        self.assertEqual(5000, len(evens))
+        self.assertEqual(sorted(noids[::2], key=encode_noid), list(evens))
+        self.assertEqual(40000, evens.nbytes)
+        firsts = NoidSet(reversed(noids[:100]))
+        self.assertEqual(5050, len(evens | firsts))
+        self.assertEqual(set(noids[:100:2]), set(evens & firsts))
+        self.assertEqual(set(noids[1:100:2]), set(firsts - evens))
+        self.assertEqual(NoidSet(noids[::2]), evens)
+        # added noids are merged into the array in batches
+        small = NoidSet()
+        small.batch_size = 3
+        small.update(['1c', '1b', 'z', '1b'])
+        self.assertEqual(['z', '1b', '1c'], list(small))
+
+
+class DiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old = FakePidman('http://pid.example.com/')
+        self.new = FakePidman('http://testpid.example.com/')
+        for fake in (self.old, self.new):
+            domain = fake.add_domain('Test')
+            self.noids = [fake.add_pid('ark', domain, 'http://example.com/%d' % i,
+                                       name='pid %d' % i) for i in range(20)]
+        self.added = self.new.add_pid('ark', self.new.domain_uri(1), 'http://example.com/new')
+        del self.new.pids['ark', self.noids[0]]
+        self.new.pids['ark', self.noids[3]]['name'] = 'renamed'
+        self.new.pids['ark', self.noids[4]]['targets']['']['active'] = False
+        self.new.pids['ark', self.noids[5]]['targets']['PDF'] = {
+            'target_uri': 'http://example.com/5.pdf', 'proxy': None, 'active': True}
+        self.new._changed()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, fake):
+        client = PidmanRestClient(fake.url, transport=fake)
+        return diff.search_source(client, workers=3, domain='Test', count=7)
+
+    def test_diff(self):
+        'Test comparing pids on two instances'
+        domain_diff = diff.DomainDiff(self.search(self.old), self.search(self.new),
+                                      chunk_size=6, tmpdir=self.tmpdir)
+        differences = list(domain_diff)
+        self.assertEqual([
+            'removed pid %s' % self.noids[0],
+            "changed pid %s: name 'pid 3' -> 'renamed'" % self.noids[3],
+            'changed target %s: active True -> False' % self.noids[4],
+            'added target %s/PDF' % self.noids[5],
+            'added pid %s' % self.added,
+        ], [difference.describe() for difference in differences])
+        self.assertEqual(('added', None), (differences[-1].status, differences[-1].old))
+        self.assertEqual(1, differences[-1].new['targets'])
+        self.assertEqual((20, 20), (domain_diff.pids['old'], domain_diff.pids['new']))
+        self.assertEqual(1, domain_diff.counts['changed', 'target'])
+        self.assertTrue(domain_diff.summary().startswith('1 added pids, 1 added targets'))
+        # sorted chunks are removed
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def test_snapshot_files(self):
+        'Test comparing snapshot files'
+        oldfile = os.path.join(self.tmpdir, 'old.jsonl.gz')
+        args = cli.get_parser().parse_args(['search', '-q', '--json', '--domain', 'Test',
+                                            '--pidman-url', self.old.url])
+        with patch.object(cli.Command, 'get_transport', return_value=self.old), \
+                patch('sys.stdout', new=StringIO()) as stdout:
+            self.assertEqual(0, args.command_obj.run(args))
+        with gzip.open(oldfile, 'wt') as snapshot:
+            snapshot.write(stdout.getvalue())
+        self.assertEqual(20, len(list(diff.file_source(oldfile))))
+
+        # pidman diff compares files and Pid Managers
+        args = cli.get_parser().parse_args(['diff', '--domain', 'Test', '--json',
+                                            oldfile, self.new.url])
+        with patch.object(cli.Command, 'get_transport', return_value=self.new), \
+                patch('sys.stdout', new=StringIO()) as stdout, \
+                patch('sys.stderr', new=StringIO()) as stderr:
+            self.assertEqual(0, args.command_obj.run(args))
+        differences = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(5, len(differences))
+        self.assertEqual({'status': 'changed', 'noid': self.noids[3], 'qualifier': None,
+                          'old': {'name': 'pid 3'}, 'new': {'name': 'renamed'}},
+                         differences[1])
+        self.assertTrue('Compared 20 old and 20 new pids' in stderr.getvalue())
+
+    def test_record_replay(self):
+        'Test recording and replaying the requests to each Pid Manager separately'
+        self.assertEqual(os.path.join('traces', 'diff.old.jsonl.gz'),
+                         cli.suffixed_path(os.path.join('traces', 'diff.jsonl.gz'), 'old'))
+        path = os.path.join(self.tmpdir, 'diff.jsonl')
+        fakes = {cli.suffixed_path(path, 'old'): self.old,
+                 cli.suffixed_path(path, 'new'): self.new}
+        recording = transports.RecordingTransport
+        argv = ['diff', '-q', '--domain', 'Test', self.old.url, self.new.url]
+        with patch('pidservices.transports.RecordingTransport',
+                   side_effect=lambda path, transport: recording(path, fakes[path])), \
+                patch('sys.stdout', new=StringIO()) as stdout:
+            args = cli.get_parser().parse_args(argv + ['--record', path])
+            self.assertEqual(0, args.command_obj.run(args))
+        self.assertEqual(5, len(stdout.getvalue().splitlines()))
+        self.assertEqual(sorted(os.path.basename(name) for name in fakes),
+                         sorted(os.listdir(self.tmpdir)))
+        # the same differences, from the recordings
+        args = cli.get_parser().parse_args(argv + ['--replay', path])
+        with patch('sys.stdout', new=StringIO()) as replayed:
+            self.assertEqual(0, args.command_obj.run(args))
+        self.assertEqual(stdout.getvalue(), replayed.getvalue())
+
+
+class PidPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'pool.db')
+        self.client = MagicMock()
+        counter = iter(range(1000))
+        lock = threading.Lock()
+        def create_pid(*args):
+            with lock:
+                return 'ark:/25593/p%d' % next(counter)
+        self.client.create_pid.side_effect = create_pid
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _pool(self, **kwargs):
+        return PidPool(self.path, self.client, 'http://pid.emory.edu/domains/1/',
+                       'http://my.app/pending/', **kwargs)
+
+    def test_take(self):
+        'Test taking pids from the pool and refilling the stock'
+        pool = self._pool(stock=10, low_water=5, workers=2)
+        self.assertEqual(0, len(pool))
+        self.assertEqual(2, pool.add(['ark:/25593/1fx\n', 'ark:/25593/1fz', 'ark:/25593/1fx', '']))
+        self.assertEqual(['ark:/25593/1fx'], pool.take())
+        # stock below low-water mark: refilled in the background
+        pool.join()
+        self.assertEqual(10, len(pool))
+        self.client.create_pid.assert_called_with('ark', 'http://pid.emory.edu/domains/1/',
+                                                  'http://my.app/pending/', None)
+        # stock is shared through the database file
+        pids = PidPool(self.path).take(3)
+        self.assertEqual('ark:/25593/1fz', pids[0])
+        self.assertEqual(7, len(pool))
+
+        # without a client, can only take from the stock
+        self.assertRaises(Exception, PidPool(self.path).take, 8)
+        self.assertEqual(7, len(pool))
+
+        # taking more than the stock creates the rest immediately
+        pool.low_water = 0
+        pids = pool.take(9)
+        self.assertEqual(9, len(set(pids)))
+        self.assertEqual(0, len(pool))
+
+    def test_concurrent_take(self):
+        'Test pids are handed out only once to concurrent takers'
+        pool = self._pool(stock=50, low_water=0)
+        pool.fill(50)
+        taken = []
+        def take():
+            for i in range(10):
+                taken.extend(PidPool(self.path).take())
+        threads = [threading.Thread(target=take) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(50, len(set(taken)))
+        self.assertEqual(0, len(pool))
+        self.assertEqual(50, self.client.create_pid.call_count)
+
+    def test_refill_lease(self):
+        'Test only one pool refills the stock at a time'
+        pool = self._pool(stock=5)
+        other = self._pool(stock=5)
+        self.assertTrue(pool._acquire_lease())
+        self.assertFalse(other.refill())
+        pool._release_lease()
+        self.assertTrue(other.refill(wait=True))
+        self.assertEqual(5, len(pool))
+
+
+class PidmanCommandTest(CommandTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parser = cli.get_parser()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_pid(self):
+        'Test parsing pids listed in an input file'
+        self.assertEqual(('1fx', ''), cli.parse_pid('http://pid.emory.edu/ark:/25593/1fx\n'))
+        self.assertEqual(('1fx', 'PDF'), cli.parse_pid('ark:/25593/1fx/PDF'))
+        self.assertEqual(('1fx', ''), cli.parse_pid('http://pid.emory.edu/1fx'))
+        self.assertEqual(('1fx', ''), cli.parse_pid('1fx'))
+
+    def test_no_command(self):
+        'Test running pidman without a subcommand'
+        with patch('sys.stderr', new=StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as context:
+                cli.main([])
+        self.assertEqual(2, context.exception.code)
+        self.assertTrue('usage: pidman' in stderr.getvalue())
+
+    def test_config_file(self):
+        'Test generating and loading a config file'
+        cfgfile = os.path.join(self.tmpdir, 'pids.cfg')
+        self.assertEqual(0, self._run(['allocate', '-q', '-g', cfgfile,
+            '--pidman-url', 'http://pid.emory.edu/', '--max', '10', '--type', 'ARK',
+            '--workers', '8', '--transport', 'http2']))
+        args = self.parser.parse_args(['allocate', '-c', cfgfile, '--max', '5'])
+        command = args.command_obj
+        command.args = args
+        command.load_configfile()
+        self.assertEqual('http://pid.emory.edu/', args.pidman_url)
+        self.assertEqual('ARK', args.type)
+        self.assertEqual('8', args.workers)
+        self.assertEqual('http2', args.transport)
+        # command-line options take precedence over config file
+        self.assertEqual(5, args.max)
+
+    def test_allocate(self):
+        'Test allocating pids concurrently'
+        argv = ['allocate', '-q', '--pidman-url', 'http://pid.emory.edu/',
+                '--pidman-user', 'user', '-p', 'pass', '--max', '5', '--type', 'ARK',
+                '--domain', 'http://pid.emory.edu/domains/1/', '-w', '3']
+        client = PidmanRestClient('http://pid.emory.edu/', 'user', 'pass')
+        domains = [{'uri': 'http://pid.emory.edu/domains/1/', 'name': 'Default'},
+                   {'uri': 'http://pid.emory.edu/domains/2/', 'name': 'Test'}]
+        with patch('pidservices.cli.PidmanRestClient', return_value=client), \
+                patch.object(client, 'list_domains', return_value=domains) as mocklist, \
+                patch.object(client, 'create_pid') as mockcreate, \
+                patch.object(client, 'update_target') as mockupdate:
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                mockcreate.return_value = 'ark:/25593/1fx'
+                self.assertEqual(0, self._run(argv))
+                self.assertEqual(5, mockcreate.call_count)
+                mockcreate.assert_called_with('ark', 'http://pid.emory.edu/domains/1/',
+                                              None, name=None)
+                self.assertEqual(5, stdout.getvalue().count('ark:/25593/1fx'))
+                mockupdate.assert_not_called()
+            # missing required options
+            with patch('sys.stderr', new=StringIO()):
+                self.assertEqual(1, self._run(argv[:-6]))
+
+            # templated target uri is expanded for each pid
+            mockcreate.side_effect = ['ark:/25593/%s' % noid
+                for noid in ['1b', '1c', '1d', '1f', '1g']]
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                self.assertEqual(0, self._run(argv +
+                    ['--target', 'http://my.app/item/{%PID%}']))
+            self.assertEqual(5, mockupdate.call_count)
+            mockupdate.assert_any_call('ark', '1d', '', target_uri='http://my.app/item/1d')
+
+            # allocate into a pid pool
+            mockcreate.side_effect = ['ark:/25593/%s' % noid
+                for noid in ['1b', '1c', '1d', '1f', '1g']]
+            dbfile = os.path.join(self.tmpdir, 'pool.db')
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                self.assertEqual(0, self._run(argv + ['--pool', dbfile]))
+                self.assertEqual('', stdout.getvalue())
+            self.assertEqual(5, len(PidPool(dbfile)))
+
+            # domain selected by name
+            mockcreate.side_effect = None
+            with patch('sys.stdout', new=StringIO()):
+                self.assertEqual(0, self._run(argv[:-4] + ['--domain', 'Test']))
+                mockcreate.assert_called_with('ark', 'http://pid.emory.edu/domains/2/',
+                                              None, name=None)
+                # a domain URI without the trailing slash
+                self.assertEqual(0, self._run(argv[:-4] +
+                                              ['--domain', 'http://pid.emory.edu/domains/2']))
+                mockcreate.assert_called_with('ark', 'http://pid.emory.edu/domains/2/',
+                                              None, name=None)
+                with patch('sys.stderr', new=StringIO()):
+                    self.assertEqual(1, self._run(argv[:-4] + ['--domain', 'Nonexistent']))
+                    self.assertEqual(1, self._run(argv[:-4] +
+                                                  ['--domain', 'http://pid.emory.edu/domains/9/']))
+            # domains are listed once, from the client's cache
+            self.assertEqual(1, mocklist.call_count)
+
+            # the first error stops the batch; pids already being created
+            # are still output
+            one_worker = argv[:-1] + ['1']
+            mockcreate.reset_mock()
+            mockcreate.side_effect = [requests.exceptions.HTTPError('503'),
+                                      'ark:/25593/1c', 'ark:/25593/1d']
+            with patch('sys.stdout', new=StringIO()) as stdout, \
+                    patch('sys.stderr', new=StringIO()) as stderr:
+                self.assertEqual(1, self._run(one_worker))
+                self.assertEqual(2, mockcreate.call_count)
+                self.assertEqual('ark:/25593/1c\n', stdout.getvalue())
+                self.assertTrue('1 of 5 pids created' in stderr.getvalue())
+            # unless told to keep going
+            mockcreate.reset_mock()
+            mockcreate.side_effect = [requests.exceptions.HTTPError('503')] + \
+                ['ark:/25593/%s' % noid for noid in ['1c', '1d', '1f', '1g']]
+            with patch('sys.stdout', new=StringIO()) as stdout, \
+                    patch('sys.stderr', new=StringIO()):
+                self.assertEqual(1, self._run(one_worker + ['--keep-going']))
+                self.assertEqual(5, mockcreate.call_count)
+                self.assertEqual(4, len(stdout.getvalue().split()))
+
+    def test_verify(self):
+        'Test verifying a list of pids'
+        pidfile = os.path.join(self.tmpdir, 'pids.txt')
+        with open(pidfile, 'w') as pids:
+            pids.write('ark:/25593/1fx\nark:/25593/1fz/PDF\n\n')
+        with patch('pidservices.cli.PidmanRestClient') as mockclient:
+            mockclient.return_value.get_target.side_effect = \
+                requests.exceptions.HTTPError('404')
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                self.assertEqual(1, self._run(['verify', '-q', '--pidman-url',
+                    'http://pid.emory.edu/', pidfile]))
+                mockclient.return_value.get_pid.assert_called_with('ark', '1fx')
+                self.assertEqual('1fz/PDF\n', stdout.getvalue())
+
+    def test_rewrite_targets(self):
+        'Test rewriting target URIs'
+        pids = [{'pid': '1fx', 'targets': [
+                    {'qualifier': '', 'target_uri': 'http://old.host/1fx'},
+                    {'qualifier': 'PDF', 'target_uri': 'http://other.host/1fx.pdf'}]}]
+        with patch('pidservices.cli.PidmanRestClient') as mockclient:
+            mockclient.return_value.iter_search_pids.return_value = pids
+            self.assertEqual(0, self._run(['rewrite-targets', '-q',
+                '--pidman-url', 'http://pid.emory.edu/', '--pidman-user', 'user',
+                '-p', 'pass', '--type', 'ark', '--domain', 'Test',
+                '--find', 'old.host', '--replace', 'new.host']))
+            mockclient.return_value.update_target.assert_called_once_with('ark', '1fx',
+                '', target_uri='http://new.host/1fx')
+
+            # dry run outputs planned updates without making them
+            mockclient.return_value.update_target.reset_mock()
+            with patch('sys.stdout', new=StringIO()) as stdout:
+                self.assertEqual(0, self._run(['rewrite-targets', '-q',
+                    '--pidman-url', 'http://pid.emory.edu/', '--pidman-user', 'user',
+                    '-p', 'pass', '--type', 'ark', '--find', 'old.host',
+                    '--replace', 'new.host', '--dry-run']))
+            self.assertEqual("ark 1fx: target_uri 'http://old.host/1fx' -> 'http://new.host/1fx'",
+                             stdout.getvalue().strip())
+            self.assertEqual(0, mockclient.return_value.update_target.call_count)
+
+            # new target uris checked before updating
+            mockclient.return_value.update_target.reset_mock()
+            with patch('pidservices.linkcheck.TargetChecker.probe') as mockprobe:
+                mockprobe.return_value = linkcheck.ProbeResult('http://new.host/1fx',
+                    404, None, 'HEAD', 0.1)
+                with patch('sys.stderr', new=StringIO()):
+                    self.assertEqual(1, self._run(['rewrite-targets', '-q',
+                        '--pidman-url', 'http://pid.emory.edu/', '--pidman-user', 'user',
+                        '-p', 'pass', '--type', 'ark', '--find', 'old.host',
+                        '--replace', 'new.host', '--check']))
+                mockprobe.assert_called_with('http://new.host/1fx')
+                self.assertEqual(0, mockclient.return_value.update_target.call_count)
+
+
+class TargetCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = PidmanRestClient('http://pid.emory.edu/', 'user', 'pass')
+        self.session = MagicMock()
+        self.checker = linkcheck.TargetChecker(self.client, 'ark', workers=3,
+                                               session=self.session)
+
+    def test_probe(self):
+        'Test probing URLs with HEAD, falling back to ranged GET'
+        self.session.head.return_value.status_code = 200
+        result = self.checker.probe('http://a.b/1')
+        self.assertTrue(result.ok)
+        self.assertEqual('HEAD', result.method)
+        # cached: probing again does not make a new request
+        self.checker.probe('http://a.b/1')
+        self.assertEqual(1, self.session.head.call_count)
+
+        self.session.head.return_value.status_code = 405
+        self.session.get.return_value.status_code = 206
+        result = self.checker.probe('http://a.b/2')
+        self.assertTrue(result.ok)
+        self.assertEqual('GET', result.method)
+        args, kwargs = self.session.get.call_args
+        self.assertEqual('bytes=0-0', kwargs['headers']['Range'])
+        self.assertTrue(kwargs['stream'])
+
+        self.session.head.side_effect = requests.exceptions.ConnectionError('refused')
+        result = self.checker.probe('http://c.d/')
+        self.assertFalse(result.ok)
+        self.assertEqual(None, result.status)
+        self.assertEqual('refused', result.error)
+
+        # empty responses can't serve the first byte, but are reachable
+        self.session.head.side_effect = None
+        self.session.get.reset_mock()
+        self.session.get.side_effect = lambda url, **kwargs: \
+            MagicMock(status_code=416 if 'headers' in kwargs else 200)
+        result = self.checker.probe('http://a.b/empty')
+        self.assertTrue(result.ok)
+        self.assertEqual(200, result.status)
+        self.assertEqual(2, self.session.get.call_count)
+        args, kwargs = self.session.get.call_args
+        self.assertFalse('headers' in kwargs)
+        self.assertTrue(kwargs['stream'])
+
+    def test_cache_size(self):
+        'Test the probe cache keeps only the most recently used results'
+        checker = linkcheck.TargetChecker(self.client, 'ark', session=self.session,
+                                          cache_size=2)
+        self.session.head.return_value.status_code = 200
+        checker.probe('http://a.b/1')
+        checker.probe('http://a.b/2')
+        checker.probe('http://a.b/1')
+        checker.probe('http://a.b/3')
+        self.assertEqual(['http://a.b/1', 'http://a.b/3'], list(checker._cache))
+        self.assertEqual(3, self.session.head.call_count)
+        # the evicted url is probed again
+        checker.probe('http://a.b/2')
+        self.assertEqual(4, self.session.head.call_count)
+        self.assertEqual(2, len(checker._cache))
+
+    def test_check(self):
+        'Test checking and repairing targets'
+        pids = [{'pid': '1fx', 'targets': [
+                    {'qualifier': '', 'target_uri': 'http://a.b/ok', 'active': True},
+                    {'qualifier': 'PDF', 'target_uri': 'http://a.b/gone', 'active': True},
+                    {'qualifier': 'XML', 'target_uri': 'http://a.b/old', 'active': False}]},
+                {'pid': '1fz', 'targets': [
+                    {'qualifier': '', 'target_uri': 'http://a.b/ok', 'active': True}]}]
+        def head(url, **kwargs):
+            return MagicMock(status_code=404 if url.endswith('gone') else 200)
+        self.session.head.side_effect = head
+        with patch.object(self.client, 'update_target') as mockupdate:
+            statuses = list(self.checker.check(pids, repair=True))
+            self.assertEqual(3, len(statuses), 'inactive targets are skipped by default')
+            self.assertEqual(2, self.session.head.call_count,
+                'each distinct url is only probed once')
+            broken = [s for s in statuses if not s.result.ok]
+            self.assertEqual(1, len(broken))
+            self.assertEqual('PDF', broken[0].target['qualifier'])
+            mockupdate.assert_called_once_with('ark', '1fx', 'PDF', active=False)
+
+            # retarget instead of deactivating
+            self.checker.repair(broken[0], lambda status: 'http://a.b/new')
+            mockupdate.assert_called_with('ark', '1fx', 'PDF', target_uri='http://a.b/new')
+
+        self.assertEqual(4, len(list(self.checker.check(pids, include_inactive=True))))
+
+        # pidman check-targets --deactivate uses the command's client,
+        # with its transport and credentials
+        fake = FakePidman(credentials=('user', 'pass'))
+        domain = fake.add_domain('Test')
+        ok = fake.add_pid('ark', domain, 'http://a.b/ok')
+        gone = fake.add_pid('ark', domain, 'http://a.b/gone')
+        args = cli.get_parser().parse_args(['check-targets', '-q', '--type', 'ark',
+            '--pidman-url', fake.url, '--deactivate', '--pidman-user', 'user', '-p', 'pass'])
+        with patch.object(cli.Command, 'get_transport', return_value=fake), \
+                patch.object(cli.Command, 'get_checker', side_effect=lambda pidclient:
+                             linkcheck.TargetChecker(pidclient, 'ark', session=self.session)), \
+                patch('sys.stdout', new=StringIO()):
+            self.assertEqual(1, args.command_obj.run(args))
+        self.assertFalse(fake.pids['ark', gone]['targets']['']['active'])
+        self.assertTrue(fake.pids['ark', ok]['targets']['']['active'])
+
+
+class HostSchedulerTest(unittest.TestCase):
+
+    def test_imap(self):
+        'Test per-host concurrency limits'
+        lock = threading.Lock()
+        active, max_active = {}, {}
+        def work(url):
+            host = scheduler.url_host(url)
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                max_active[host] = max(max_active.get(host, 0), active[host])
+            time.sleep(0.01)
+            with lock:
+                active[host] -= 1
+            return url
+
+        urls = ['http://fedora.host/%d' % i for i in range(20)] + \
+               ['http://webapp.host/%d' % i for i in range(5)] + \
+               ['http://other%d.host/' % i for i in range(5)]
+        host_scheduler = scheduler.HostScheduler(workers=6, per_host=2,
+            host_limits={'webapp.host': (1, None)})
+        results = list(host_scheduler.imap(work, urls, window=10))
+        self.assertEqual(sorted(urls), sorted(results))
+        self.assertEqual(2, max_active['fedora.host'])
+        self.assertEqual(1, max_active['webapp.host'])
+
+        # items run in the caller's context, e.g. with its tracing span
+        tracer = tracing.Tracer()
+        with tracer.span('check') as span:
+            parents = list(host_scheduler.imap(lambda url: tracing.current_span(), urls[:3]))
+        self.assertEqual([span] * 3, parents)
+
+    def test_rate(self):
+        'Test per-host rate limits'
+        host_scheduler = scheduler.HostScheduler(workers=4, per_host=4, rate=50)
+        start = time.time()
+        list(host_scheduler.imap(lambda url: url, ['http://a.host/%d' % i for i in range(6)]))
+        self.assertTrue(time.time() - start >= 0.09,
+            'six requests to one host at 50/sec should take at least 0.1 seconds')
+
+    def test_errors(self):
+        'Test exceptions are raised to the caller'
+        def fail(url):
+            raise ValueError(url)
+        host_scheduler = scheduler.HostScheduler(workers=2)
+        self.assertRaises(ValueError, list, host_scheduler.imap(fail, ['http://a.host/']))
+
+
 def suite():
     suite = unittest.TestSuite()
     loader = unittest.TestLoader()
@@ -665,8 +2441,29 @@ def suite():
     test_cases = (
         PidmanRestClientTest,
         DjangoPidmanRestClientTest,
+        ResolveArksTest,
+        MintingQueueTest,
         IsArkTest,
         ParseArkTest,
+        WorkerPoolTest,
+        ExportTest,
+        PidImporterTest,
+        TransportTest,
+        FakePidmanTest,
+        MetricsTest,
+        TracingTest,
+        ProgressReporterTest,
+        PlannerTest,
+        WriteBufferTest,
+        DomainTreeTest,
+        PageSizeTunerTest,
+        SearchSnapshotTest,
+        NoidSetTest,
+        DiffTest,
+        PidPoolTest,
+        PidmanCommandTest,
+        TargetCheckerTest,
+        HostSchedulerTest,
     )
     for test_case in test_cases:
         suite.addTests(loader.loadTestsFromTestCase(test_case))